@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+"""
+Benchmark the GTFS-realtime feed parsers used by bus_arrival_times.py.
+Compares the original full-decode loop, the protobuf-based extractor, and the
+wire-format scanner on synthetic feeds of several sizes and on recorded feeds.
+With --sensor, also measures touch sensor press-to-handler latency on a fake GPIO backend.
+With --render, also compares display writes per hour with and without change-only rendering.
+With --offline, also serves the feeds and synthetic static GTFS zips from a local stand-in
+HTTP server and measures end-to-end fetch_bus_arrivals() latency, static index build time
+(load_static_gtfs_data()) and peak RSS, without touching the GRT API.
+
+Results can be saved with --json and compared against an earlier run with --compare.
+
+Usage:
+    python3 benchmark.py [recorded_feed.pb ...] [--repeat N] [--sensor] [--render] [--offline]
+                         [--json results.json] [--compare baseline.json]
+"""
+
+import sys
+import io
+import os
+import json
+import time
+import random
+import zipfile
+import platform
+import multiprocessing
+import resource
+import tempfile
+import threading
+import contextlib
+from pathlib import Path
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from google.transit import gtfs_realtime_pb2
+
+import bus_arrival_times as bus
+from fake_hardware import FakeGPIO, FakeTM1637
+
+# Synthetic feed sizes (number of trip_update entities)
+SYNTHETIC_SIZES = (100, 500, 2000)
+
+
+def make_synthetic_feed(num_trips, stops_per_trip=25, stop_id=None, seed=1):
+    """Build a serialized FeedMessage resembling the GRT network feed.
+    About one trip in ten calls at stop_id; routes are spread over 40 route numbers
+    including the configured display routes.
+    """
+    rng = random.Random(seed)
+    stop_id = stop_id or bus.STOP_ID
+    routes = sorted(bus.DESIRED_ROUTES) + [str(r) for r in range(100, 138)]
+    now = int(time.time())
+
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = now
+
+    for i in range(num_trips):
+        entity = feed.entity.add()
+        entity.id = f"{i}"
+        trip_update = entity.trip_update
+        trip_update.trip.trip_id = f"{rng.randint(1000000, 9999999)}"
+        trip_update.trip.route_id = rng.choice(routes)
+        trip_update.trip.start_date = datetime.now().strftime("%Y%m%d")
+        trip_update.timestamp = now
+        matching_stop = rng.randrange(stops_per_trip) if rng.random() < 0.1 else -1
+        for j in range(stops_per_trip):
+            stop_time_update = trip_update.stop_time_update.add()
+            stop_time_update.stop_sequence = j + 1
+            stop_time_update.stop_id = stop_id if j == matching_stop else f"{rng.randint(1000, 9999)}"
+            stop_time_update.arrival.time = now + 60 * j + rng.randint(0, 3600)
+            stop_time_update.departure.time = stop_time_update.arrival.time + 15
+
+    return feed.SerializeToString()
+
+
+def legacy_parse(data):
+    """The original fetch_bus_arrivals() parse loop: full decode, every stop_time_update visited."""
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(data)
+    arrivals = []
+    for entity in feed.entity:
+        if entity.HasField("trip_update"):
+            trip_update = entity.trip_update
+            for stop_time_update in trip_update.stop_time_update:
+                if str(stop_time_update.stop_id) == bus.STOP_ID:
+                    if stop_time_update.HasField("arrival"):
+                        timestamp = stop_time_update.arrival.time
+                    elif stop_time_update.HasField("departure"):
+                        timestamp = stop_time_update.departure.time
+                    else:
+                        continue
+                    arrivals.append({
+                        "time": datetime.fromtimestamp(timestamp, tz=timezone.utc),
+                        "route_id": trip_update.trip.route_id,
+                        "trip_id": trip_update.trip.trip_id,
+                        "timestamp": timestamp
+                    })
+    return [a for a in arrivals if a["route_id"] in bus.DESIRED_ROUTES]
+
+
+PARSERS = (
+    ("legacy", legacy_parse),
+    ("protobuf", lambda data: bus.parse_trip_updates(data, bus.STOP_IDS, bus.DESIRED_ROUTES)),
+    ("scan", lambda data: bus.scan_trip_updates(data, bus.STOP_IDS, bus.DESIRED_ROUTES)),
+)
+
+
+def time_parser(parser, data, repeat):
+    """Return the best time in milliseconds over repeat runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser(data)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def benchmark_parsers(feeds, repeat):
+    """Print a table of parse times for each feed and parser.
+    Returns {"parse/<feed>/<parser>": {"ms": ..., "mb_per_s": ...}}.
+    """
+    results = {}
+    print(f"\n{'feed':<24}{'KB':>8}{'entities':>10}" + "".join(f"{name + ' ms':>14}" for name, _ in PARSERS) + f"{'speedup':>10}")
+    print("-" * (52 + 14 * len(PARSERS)))
+    for name, data in feeds:
+        _, entity_count, _ = bus.scan_trip_updates(data, bus.STOP_IDS, bus.DESIRED_ROUTES)
+        times = [time_parser(parser, data, repeat) for _, parser in PARSERS]
+        speedup = times[0] / times[-1] if times[-1] else float("inf")
+        print(f"{name:<24}{len(data) / 1024:>8.0f}{entity_count:>10}" + "".join(f"{t:>14.2f}" for t in times) + f"{speedup:>9.1f}x")
+        for (parser_name, _), t in zip(PARSERS, times):
+            results[f"parse/{name}/{parser_name}"] = {"ms": t, "mb_per_s": len(data) / 1e6 / (t / 1000) if t else 0}
+    return results
+
+
+# Synthetic static GTFS sizes (number of trips, 25 stops each); GRT's feed is roughly the largest
+STATIC_SIZES = (2000, 10000, 40000)
+
+
+def make_synthetic_static_zip(num_trips, stops_per_trip=25, stop_id=None, seed=1):
+    """Build a static GTFS zip with trips.txt, stop_times.txt, calendar.txt and feed_info.txt.
+    About one trip in ten calls at stop_id, on the configured display routes and headsigns.
+    """
+    rng = random.Random(seed)
+    stop_id = stop_id or bus.STOP_ID
+    display_routes = [(display.route_id, display.headsign or "Terminal") for display in bus.DISPLAYS]
+    trips = ["route_id,service_id,trip_id,trip_headsign,direction_id,block_id,shape_id"]
+    stop_times = ["trip_id,arrival_time,departure_time,stop_id,stop_sequence,pickup_type,drop_off_type"]
+    for i in range(num_trips):
+        if rng.random() < 0.1:
+            route_id, headsign = rng.choice(display_routes)
+            matching_stop = rng.randrange(stops_per_trip)
+        else:
+            route_id, headsign = str(rng.randint(100, 137)), f"Station {rng.randint(1, 40)}"
+            matching_stop = -1
+        trip_id = f"{1000000 + i}"
+        trips.append(f"{route_id},WKD,{trip_id},{headsign},{i % 2},{i // 8},{route_id}0{i % 2}")
+        start = rng.randint(5 * 3600, 24 * 3600)
+        for j in range(stops_per_trip):
+            t = start + 90 * j
+            hms = f"{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}"
+            stop = stop_id if j == matching_stop else f"{rng.randint(1000, 9999)}"
+            stop_times.append(f"{trip_id},{hms},{hms},{stop},{j + 1},0,0")
+    
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("feed_info.txt", f"feed_publisher_name,feed_version\nGRT,synthetic-{num_trips}\n")
+        zip_file.writestr("trips.txt", "\n".join(trips) + "\n")
+        zip_file.writestr("stop_times.txt", "\n".join(stop_times) + "\n")
+        zip_file.writestr("calendar.txt", "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n"
+                                          "WKD,1,1,1,1,1,1,1,20200101,20991231\n")
+    return buffer.getvalue()
+
+
+class StandInServer:
+    """Local HTTP server standing in for the GRT API.
+    Serves registered bodies by path with an ETag, answering If-None-Match with 304 like the real API.
+    """
+
+    def __init__(self):
+        self.bodies = {}
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_GET(self):
+                body = server.bodies.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                etag = f'"{len(body)}-{hash(body) & 0xffffffff:x}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+    
+    def serve(self, path, body):
+        """Serve body at path and return its URL."""
+        self.bodies[path] = body
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{path}"
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def reset_peak_rss():
+    """Reset the peak RSS high-water mark (Linux); returns False where that is not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    """Return the peak resident set size in KB since the last reset_peak_rss() (or process start)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def current_rss_kb():
+    """Return the current resident set size in KB (0 where /proc is unavailable)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def use_static_cache_dir(path):
+    """Point the static GTFS cache of bus_arrival_times at path."""
+    path = Path(path)
+    bus.STATIC_GTFS_CACHE_DIR = path
+    bus.STATIC_GTFS_CACHE_ZIP = path / "static_gtfs.zip"
+    bus.STATIC_GTFS_CACHE_META = path / "static_gtfs_meta.json"
+    bus.STATIC_GTFS_CACHE_INDEX = path / "stop_index.json"
+
+
+def run_isolated(function, *args):
+    """Return function(*args) run in a fresh interpreter, so memory the allocator kept from an
+    earlier scenario does not show up in the peak RSS of the next one.
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(function, args)
+
+
+def measure_static(url, repeat):
+    """Time load_static_gtfs_data() from url for a fresh download, a 304 revalidation and the index build alone.
+    Run through run_isolated(); returns (result, RSS in KB before loading).
+    """
+    bus.STATIC_GTFS_URL = url
+    rss_before = current_rss_kb()
+    load_times, revalidate_times, build_times, peak = [], [], [], 0
+    for _ in range(max(1, repeat // 2)):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            use_static_cache_dir(cache_dir)
+            reset_peak_rss()
+            start = time.perf_counter()
+            static_data = bus.load_static_gtfs_data()
+            load_times.append(time.perf_counter() - start)
+            peak = max(peak, peak_rss_kb())
+            start = time.perf_counter()
+            bus.load_static_gtfs_data()
+            revalidate_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            bus.build_stop_trip_index(bus.STATIC_GTFS_CACHE_ZIP, bus.STOP_IDS)
+            build_times.append(time.perf_counter() - start)
+    result = {
+        "trips": len(static_data.trips),
+        "download_build_ms": min(load_times) * 1000,
+        "revalidate_ms": min(revalidate_times) * 1000,
+        "build_ms": min(build_times) * 1000,
+        "peak_rss_mb": peak / 1024,
+    }
+    return result, rss_before
+
+
+def benchmark_static(server, repeat):
+    """Print load_static_gtfs_data() times for a fresh download, a 304 revalidation and the index build alone,
+    and the peak RSS of each, measured in a fresh process per feed.
+    Returns {"static/<size>": {...}}.
+    """
+    results = {}
+    print(f"\n{'static feed':<24}{'KB':>8}{'trips':>8}{'download+build ms':>19}{'revalidate ms':>15}{'build ms':>10}{'peak RSS MB':>13}")
+    print("-" * 97)
+    for size in STATIC_SIZES:
+        data = make_synthetic_static_zip(size)
+        result, rss_before = run_isolated(measure_static, server.serve(f"/static-{size}", data), repeat)
+        result = {"kb": len(data) / 1024, **result}
+        results[f"static/synthetic-{size}"] = result
+        print(f"{'synthetic-' + str(size):<24}{result['kb']:>8.0f}{result['trips']:>8}{result['download_build_ms']:>19.0f}"
+              f"{result['revalidate_ms']:>15.1f}{result['build_ms']:>10.0f}{result['peak_rss_mb']:>13.1f}")
+    print(f"Each feed is loaded in a fresh process, which uses {rss_before / 1024:.1f} MB before loading")
+    return results
+
+
+def static_data_for_feed(data):
+    """Return StaticGTFSData giving each feed trip at the monitored stops the headsign of a display on its route,
+    so the headsign filter in fetch_bus_arrivals() matches as it would with the real static feed.
+    """
+    headsigns = {display.route_id: display.headsign for display in bus.DISPLAYS}
+    _, _, predictions = bus.scan_trip_updates(data, bus.STOP_IDS, bus.DESIRED_ROUTES)
+    trips = {p.trip_id: bus.StopTrip(p.route_id, headsigns.get(p.route_id, ""), "WKD", ((p.stop_id, 0),)) for p in predictions}
+    return bus.StaticGTFSData(trips, {})
+
+
+def measure_fetch(url, data, repeat):
+    """Time fetch_bus_arrivals() from url serving feed data, changed (full download and parse) and unchanged (304).
+    Run through run_isolated(); returns the result.
+    """
+    bus.API_URL = url
+    # Serve headsigns for this feed without starting a static GTFS refresh
+    bus._STATIC_GTFS_DATA = static_data_for_feed(data)
+    bus._STATIC_GTFS_DATA_TIMESTAMP = time.time()
+    changed_times, unchanged_times, arrivals = [], [], []
+    reset_peak_rss()
+    for _ in range(repeat):
+        bus.reset_realtime_feed_cache()
+        start = time.perf_counter()
+        arrivals = bus.fetch_bus_arrivals()
+        changed_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        bus.fetch_bus_arrivals()
+        unchanged_times.append(time.perf_counter() - start)
+    return {
+        "changed_ms": min(changed_times) * 1000,
+        "not_modified_ms": min(unchanged_times) * 1000,
+        "arrivals": len(arrivals or []),
+        "peak_rss_mb": peak_rss_kb() / 1024,
+    }
+
+
+def benchmark_fetch(server, feeds, repeat):
+    """Print end-to-end fetch_bus_arrivals() latency against the stand-in server,
+    for a changed feed (full download and parse) and an unchanged one (304), each feed in a fresh process.
+    Returns {"fetch/<feed>": {...}}.
+    """
+    results = {}
+    print(f"\n{'fetch feed':<24}{'KB':>8}{'changed ms':>12}{'304 ms':>10}{'arrivals':>10}{'peak RSS MB':>13}")
+    print("-" * 77)
+    for name, data in feeds:
+        result = {"kb": len(data) / 1024, **run_isolated(measure_fetch, server.serve(f"/rt/{name}", data), data, repeat)}
+        results[f"fetch/{name}"] = result
+        print(f"{name:<24}{result['kb']:>8.0f}{result['changed_ms']:>12.1f}{result['not_modified_ms']:>10.1f}"
+              f"{result['arrivals']:>10}{result['peak_rss_mb']:>13.1f}")
+    return results
+
+
+def benchmark_offline(feeds, repeat):
+    """Run the static GTFS and fetch benchmarks against a local stand-in server."""
+    api_url, static_url, cache_dir = bus.API_URL, bus.STATIC_GTFS_URL, bus.STATIC_GTFS_CACHE_DIR
+    server = StandInServer()
+    try:
+        results = benchmark_fetch(server, feeds, repeat)
+        results.update(benchmark_static(server, repeat))
+    finally:
+        server.close()
+        bus.API_URL, bus.STATIC_GTFS_URL = api_url, static_url
+        bus._STATIC_GTFS_DATA = bus._STATIC_GTFS_DATA_TIMESTAMP = None
+        use_static_cache_dir(cache_dir)
+        bus.reset_realtime_feed_cache()
+    return results
+
+
+def save_results(path, results):
+    """Write results to path as JSON, with enough about the machine to tell runs apart."""
+    document = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=1, sort_keys=True)
+
+
+def compare_results(path, results):
+    """Print each timing that is in both this run and the saved run at path, with the change in percent.
+    Times (ms) and peak RSS are compared; lower is better for all of them.
+    """
+    with open(path) as f:
+        baseline = json.load(f)["results"]
+    print(f"\nCompared with {path}:")
+    print(f"{'benchmark':<48}{'before':>10}{'after':>10}{'change':>9}")
+    print("-" * 77)
+    for key in sorted(set(results) & set(baseline)):
+        for field, value in results[key].items():
+            before = baseline[key].get(field)
+            if not (field.endswith("_ms") or field == "ms" or field == "peak_rss_mb") or not before:
+                continue
+            change = (value - before) / before * 100
+            print(f"{key + ' ' + field:<48}{before:>10.2f}{value:>10.2f}{change:>+8.0f}%")
+
+
+# Simulated touches per sensor scenario
+SENSOR_PRESSES = 30
+
+
+def measure_sensor_latency(presses, tap, load=False, seed=1):
+    """Press a fake sensor presses times for tap seconds each and return (latencies in ms, missed count).
+    With load, a thread keeps scanning a large feed meanwhile to compete for the GIL.
+    """
+    rng = random.Random(seed)
+    gpio = FakeGPIO()
+    handled = threading.Event()
+    handled_at = []
+    
+    def on_press():
+        handled_at.append(time.perf_counter())
+        handled.set()
+    
+    stop_load = threading.Event()
+    if load:
+        feed = make_synthetic_feed(2000)
+        def scan_forever():
+            while not stop_load.is_set():
+                bus.scan_trip_updates(feed, bus.STOP_IDS, bus.DESIRED_ROUTES)
+        threading.Thread(target=scan_forever, daemon=True).start()
+    
+    latencies = []
+    missed = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager = bus.CapacitiveSensorManager(callback=on_press, gpio=gpio)
+        manager.start()
+        for _ in range(presses):
+            handled.clear()
+            handled_at.clear()
+            # Random phase against the sampling period
+            time.sleep(rng.uniform(0.05, 0.15))
+            start = time.perf_counter()
+            gpio.press(bus.SENSOR_PIN, tap)
+            if handled.wait(1):
+                latencies.append((handled_at[0] - start) * 1000)
+            else:
+                missed += 1
+            # Let the release debounce before the next touch
+            time.sleep(tap + 0.05)
+        manager.cleanup()
+    stop_load.set()
+    return latencies, missed
+
+
+def benchmark_sensor(presses=SENSOR_PRESSES):
+    """Print press-to-handler latency percentiles for normal taps, short taps and taps under parse load."""
+    scenarios = (
+        ("tap 80 ms", 0.08, False),
+        ("tap 30 ms", 0.03, False),
+        ("tap 80 ms, parse load", 0.08, True),
+    )
+    print(f"\n{'sensor scenario':<24}{'presses':>8}{'missed':>8}{'p50 ms':>10}{'p90 ms':>10}{'max ms':>10}")
+    print("-" * 70)
+    for name, tap, load in scenarios:
+        latencies, missed = measure_sensor_latency(presses, tap, load)
+        latencies.sort()
+        p50 = bus._percentile(latencies, 0.5)
+        p90 = bus._percentile(latencies, 0.9)
+        worst = latencies[-1] if latencies else 0
+        print(f"{name:<24}{presses:>8}{missed:>8}{p50:>10.1f}{p90:>10.1f}{worst:>10.1f}")
+
+
+# Simulated rendering: one hour of one-second ticks, realtime predictions refreshed every 2 minutes
+RENDER_TICKS = 3600
+RENDER_FETCH_INTERVAL = 120
+
+
+def measure_tm1637_byte_cost(samples=200):
+    """Return the time raspberrypi-tm1637 spends sleeping per byte on this machine.
+    Each byte is 26 sleep(10 ns) calls around its GPIO writes; the writes themselves are not counted.
+    """
+    start = time.perf_counter()
+    for _ in range(samples * 26):
+        time.sleep(0.00000001)
+    return (time.perf_counter() - start) / samples
+
+
+def simulate_render(change_only, byte_cost, seed=1):
+    """Render one hour of arrivals for each display once per tick and return the fake backends."""
+    rng = random.Random(seed)
+    backends = [FakeTM1637(byte_cost) for _ in bus.DISPLAYS]
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager = bus.TM1637DisplayManager(backends=backends)
+    start = time.time()
+    # Buses every 15 minutes on odd displays and every 30 minutes on even ones
+    schedules = [[start + 60 + j * (900 if i % 2 == 0 else 1800) for j in range(8)] for i in range(len(bus.DISPLAYS))]
+    predicted = None
+    for tick in range(RENDER_TICKS):
+        now = start + tick
+        if tick % RENDER_FETCH_INTERVAL == 0:
+            # Each fetch moves predictions by up to a minute either way
+            predicted = [[t + rng.randint(-60, 60) for t in times] for times in schedules]
+        arrivals = []
+        for times in predicted:
+            upcoming = [t for t in times if t > now]
+            arrivals.append({"time": datetime.fromtimestamp(upcoming[0], tz=timezone.utc), "scheduled": False} if upcoming else None)
+        if not change_only:
+            manager.frames = []
+        manager.show_arrivals(arrivals)
+    return backends
+
+
+def benchmark_render():
+    """Print display writes and their cost for one simulated hour, writing every tick vs only on change."""
+    byte_cost = measure_tm1637_byte_cost()
+    print(f"\nTM1637 bus time per byte on this machine: {byte_cost * 1e6:.0f} us (sleeps only)")
+    print(f"{'render mode':<24}{'writes/h':>10}{'bytes/h':>10}{'bus ms/h':>12}{'ms/tick':>10}")
+    print("-" * 66)
+    for name, change_only in (("every tick", False), ("change only", True)):
+        backends = simulate_render(change_only, byte_cost)
+        writes = sum(b.writes for b in backends)
+        sent = sum(b.bytes_sent for b in backends)
+        cost = sum(b.time_cost for b in backends)
+        print(f"{name:<24}{writes:>10}{sent:>10}{cost * 1000:>12.0f}{cost * 1000 / RENDER_TICKS:>10.2f}")
+
+
+def main():
+    repeat = 5
+    args = sys.argv[1:]
+    if "--repeat" in args:
+        i = args.index("--repeat")
+        repeat = int(args[i + 1])
+        del args[i:i + 2]
+    sensor = "--sensor" in args
+    if sensor:
+        args.remove("--sensor")
+    render = "--render" in args
+    if render:
+        args.remove("--render")
+    offline = "--offline" in args
+    if offline:
+        args.remove("--offline")
+    json_path = compare_path = None
+    if "--json" in args:
+        i = args.index("--json")
+        json_path = args[i + 1]
+        del args[i:i + 2]
+    if "--compare" in args:
+        i = args.index("--compare")
+        compare_path = args[i + 1]
+        del args[i:i + 2]
+
+    feeds = [(f"synthetic-{size}", make_synthetic_feed(size)) for size in SYNTHETIC_SIZES]
+    for path in args:
+        with open(path, 'rb') as f:
+            feeds.append((path.rsplit('/', 1)[-1][:23], f.read()))
+
+    results = benchmark_parsers(feeds, repeat)
+    if offline:
+        results.update(benchmark_offline(feeds, repeat))
+    if sensor:
+        benchmark_sensor()
+    if render:
+        benchmark_render()
+    if json_path:
+        save_results(json_path, results)
+    if compare_path:
+        compare_results(compare_path, results)
+
+
+if __name__ == "__main__":
+    main()
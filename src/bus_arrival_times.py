@@ -5,13 +5,8 @@ Uses the GTFS Realtime API provided by Region of Waterloo.
 Direction information is obtained from the static GTFS data.
 """
 
-import requests
-from datetime import datetime, timezone, time as datetime_time
-from google.transit import gtfs_realtime_pb2
-import urllib3
+from datetime import datetime, timezone, timedelta, time as datetime_time
 import ssl
-from requests.adapters import HTTPAdapter
-from urllib3.util.ssl_ import create_urllib3_context
 import time
 import sys
 import os
@@ -20,29 +15,64 @@ from pathlib import Path
 import csv
 import zipfile
 import io
+import json
+import threading
+import asyncio
+import bisect
+import math
+import signal
+import logging
+from collections import namedtuple, deque
+from bustime_logging import setup_logging, set_level
+from bustime_metrics import MetricsRegistry, start_metrics_server
+from bustime_archive import PredictionArchive
+from bustime_api import JSONDocuments, start_api_server
+
+log = logging.getLogger("bustime")
+
+# Source of the current time in seconds since the epoch. Everything that schedules by or compares
+# against the wall clock reads it through clock_time()/clock_now(), so simulate.py can substitute
+# an accelerated clock.
+_CLOCK = time.time
+
+
+def set_clock(clock):
+    """Use clock() instead of time.time() as the current time."""
+    global _CLOCK
+    _CLOCK = clock
+
+
+def clock_time():
+    return _CLOCK()
+
+
+def clock_now(tz=None):
+    return datetime.fromtimestamp(_CLOCK(), tz)
+
+# Warnings about missing optional libraries, logged once logging is configured
+_LIBRARY_WARNINGS = []
 try:
     from astral import Observer
     from astral.sun import sun
     ASTRAL_AVAILABLE = True
 except ImportError:
     ASTRAL_AVAILABLE = False
-    print("Warning: astral library not found. Sunset dimming disabled.")
+    _LIBRARY_WARNINGS.append("astral library not found. Sunset dimming disabled.")
 try:
     from tm1637 import TM1637
     TM1637_AVAILABLE = True
 except ImportError:
     TM1637_AVAILABLE = False
-    print("Warning: raspberrypi-tm1637 library not found. Display functionality disabled.")
+    _LIBRARY_WARNINGS.append("raspberrypi-tm1637 library not found. Display functionality disabled.")
 
 try:
     import RPi.GPIO as GPIO
     GPIO_AVAILABLE = True
 except ImportError:
     GPIO_AVAILABLE = False
-    print("Warning: RPi.GPIO library not found. Capacitive sensor functionality disabled.")
+    _LIBRARY_WARNINGS.append("RPi.GPIO library not found. Capacitive sensor functionality disabled.")
 
-# Disable SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+CONFIG_PATH = Path(__file__).parent / "config.txt"
 
 
 def load_config():
@@ -50,14 +80,12 @@ def load_config():
     Returns a dictionary with all configuration values.
     Raises FileNotFoundError if config.txt doesn't exist.
     """
-    config_path = Path(__file__).parent / "config.txt"
-    
-    if not config_path.exists():
-        raise FileNotFoundError(f"Configuration file not found: {config_path}")
+    if not CONFIG_PATH.exists():
+        raise FileNotFoundError(f"Configuration file not found: {CONFIG_PATH}")
     
     config = {}
     
-    with open(config_path, 'r') as f:
+    with open(CONFIG_PATH, 'r') as f:
         for line in f:
             # Skip empty lines and comments
             line = line.strip()
@@ -92,57 +120,157 @@ def load_config():
 try:
     CONFIG = load_config()
 except FileNotFoundError as e:
-    print(f"Error: {e}")
-    print("Please create a config.txt file in the src directory.")
+    print(f"Error: {e}", file=sys.stderr)
+    print("Please create a config.txt file in the src directory.", file=sys.stderr)
     sys.exit(1)
 
 # Extract configuration values
 API_URL = CONFIG.get("API_URL", "https://webapps.regionofwaterloo.ca/api/grt-routes/api/tripupdates/1")
 STATIC_GTFS_URL = CONFIG.get("STATIC_GTFS_URL", "https://webapps.regionofwaterloo.ca/api/grt-routes/api/staticfeeds/1")
-STOP_ID = str(CONFIG.get("STOP_ID", "2783"))
 LOCAL_TZ = ZoneInfo(CONFIG.get("LOCAL_TZ", "America/Toronto"))
 
 # TM1637 Display Configuration
-DISPLAY1_ROUTE = str(CONFIG.get("DISPLAY1_ROUTE", "12"))
-DISPLAY1_HEADSIGN = CONFIG.get("DISPLAY1_HEADSIGN", "")
-DISPLAY1_CLK = int(CONFIG.get("DISPLAY1_CLK", 27))
-DISPLAY1_DIO = int(CONFIG.get("DISPLAY1_DIO", 17))
+# Each display shows the next arrival for one (stop, route, headsign) subscription.
+# Displays 1 and 2 have built-in defaults; more are added with DISPLAY3_*, DISPLAY4_*, ...
+DisplaySubscription = namedtuple("DisplaySubscription", ["number", "stop_id", "route_id", "headsign", "clk", "dio"])
+
+# Default (route, CLK pin, DIO pin) for the original two displays
+_DISPLAY_DEFAULTS = {1: ("12", 27, 17), 2: ("19", 24, 23)}
+
+
+def load_display_subscriptions(config, default_stop_id):
+    """Build the display subscriptions from the DISPLAYn_* configuration keys.
+    Displays are read in order until the first number without a DISPLAYn_ROUTE
+    (displays 1 and 2 fall back to their defaults). DISPLAYn_STOP_ID defaults to STOP_ID
+    and an empty DISPLAYn_HEADSIGN accepts all headsigns.
+    """
+    displays = []
+    number = 1
+    while f"DISPLAY{number}_ROUTE" in config or number in _DISPLAY_DEFAULTS:
+        prefix = f"DISPLAY{number}_"
+        default_route, default_clk, default_dio = _DISPLAY_DEFAULTS.get(number, (None, None, None))
+        try:
+            clk = int(config.get(prefix + "CLK", default_clk))
+            dio = int(config.get(prefix + "DIO", default_dio))
+        except (TypeError, ValueError):
+            log.error(f"{prefix}CLK and {prefix}DIO must be GPIO pin numbers. Display {number} disabled.")
+            number += 1
+            continue
+        headsign = config.get(prefix + "HEADSIGN", "")
+        displays.append(DisplaySubscription(
+            number=number,
+            stop_id=str(config.get(prefix + "STOP_ID", default_stop_id)),
+            route_id=str(config.get(prefix + "ROUTE", default_route)),
+            headsign=str(headsign).strip() if headsign else "",
+            clk=clk,
+            dio=dio,
+        ))
+        number += 1
+    return displays
+
 
-DISPLAY2_ROUTE = str(CONFIG.get("DISPLAY2_ROUTE", "19"))
-DISPLAY2_HEADSIGN = CONFIG.get("DISPLAY2_HEADSIGN", "")
-DISPLAY2_CLK = int(CONFIG.get("DISPLAY2_CLK", 24))
-DISPLAY2_DIO = int(CONFIG.get("DISPLAY2_DIO", 23))
+def index_display_subscriptions(displays):
+    """Return (subscriptions by stop, desired routes, stop IDs) for the display subscriptions."""
+    subscriptions_by_stop = {}
+    for display in displays:
+        subscriptions_by_stop.setdefault(display.stop_id, []).append(display)
+    return subscriptions_by_stop, {display.route_id for display in displays}, set(subscriptions_by_stop)
+
+
+def read_live_settings(config):
+    """Return the settings that reload_config() can change while running, as {global name: value}.
+    Raises ValueError if a value is invalid.
+    """
+    try:
+        settings = {
+            "STOP_ID": str(config.get("STOP_ID", "2783")),
+            "ENABLE_SUNSET_DIMMING": config.get("ENABLE_SUNSET_DIMMING", True),
+            "DAY_BRIGHTNESS": int(config.get("DAY_BRIGHTNESS", 7)),
+            "NIGHT_BRIGHTNESS": int(config.get("NIGHT_BRIGHTNESS", 2)),
+            "BRIGHTNESS_RAMP_MINUTES": float(config.get("BRIGHTNESS_RAMP_MINUTES", 0)),
+            "LOCATION_LATITUDE": float(config.get("LOCATION_LATITUDE", 43.4516)),
+            "LOCATION_LONGITUDE": float(config.get("LOCATION_LONGITUDE", -80.4925)),
+            "REFRESH_INTERVAL": int(config.get("REFRESH_INTERVAL", 180)),
+            "ADAPTIVE_REFRESH": config.get("ADAPTIVE_REFRESH", True),
+            "MIN_REFRESH_INTERVAL": int(config.get("MIN_REFRESH_INTERVAL", 60)),
+            "MAX_REFRESH_INTERVAL": int(config.get("MAX_REFRESH_INTERVAL", 600)),
+            "SERVICE_GAP_SLEEP": config.get("SERVICE_GAP_SLEEP", True),
+            "SLEEP_DISPLAY": str(config.get("SLEEP_DISPLAY", "off")).lower(),
+            "STATIC_GTFS_REFRESH_INTERVAL": int(config.get("STATIC_GTFS_REFRESH_INTERVAL", 43200)),
+            "LOG_LEVEL": str(config.get("LOG_LEVEL", "INFO")).upper(),
+        }
+        # By default adaptive refresh makes no more requests than the fixed interval would
+        settings["MAX_REQUESTS_PER_DAY"] = int(config.get("MAX_REQUESTS_PER_DAY", 86400 // max(1, settings["REFRESH_INTERVAL"])))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid value: {e}") from None
+    
+    for key in ("DAY_BRIGHTNESS", "NIGHT_BRIGHTNESS"):
+        if not 0 <= settings[key] <= 7:
+            raise ValueError(f"{key} must be between 0 and 7")
+    for key in ("REFRESH_INTERVAL", "MIN_REFRESH_INTERVAL", "STATIC_GTFS_REFRESH_INTERVAL"):
+        if settings[key] <= 0:
+            raise ValueError(f"{key} must be positive")
+    if settings["MAX_REQUESTS_PER_DAY"] < 0:
+        raise ValueError("MAX_REQUESTS_PER_DAY must not be negative")
+    if settings["MIN_REFRESH_INTERVAL"] > settings["MAX_REFRESH_INTERVAL"]:
+        raise ValueError("MIN_REFRESH_INTERVAL must not be larger than MAX_REFRESH_INTERVAL")
+    
+    settings["DISPLAYS"] = load_display_subscriptions(config, settings["STOP_ID"])
+    (settings["SUBSCRIPTIONS_BY_STOP"], settings["DESIRED_ROUTES"],
+     settings["STOP_IDS"]) = index_display_subscriptions(settings["DISPLAYS"])
+    return settings
+
+
+try:
+    _LIVE_SETTINGS = read_live_settings(CONFIG)
+except ValueError as e:
+    print(f"Error in config.txt: {e}", file=sys.stderr)
+    sys.exit(1)
+
+STOP_ID = _LIVE_SETTINGS["STOP_ID"]
+DISPLAYS = _LIVE_SETTINGS["DISPLAYS"]
 
 # Capacitive Sensor Configuration
 SENSOR_PIN = int(CONFIG.get("SENSOR_PIN", 4))
 
 # Sunset Dimming Configuration
-ENABLE_SUNSET_DIMMING = CONFIG.get("ENABLE_SUNSET_DIMMING", True)
-DAY_BRIGHTNESS = int(CONFIG.get("DAY_BRIGHTNESS", 7))
-NIGHT_BRIGHTNESS = int(CONFIG.get("NIGHT_BRIGHTNESS", 2))
+ENABLE_SUNSET_DIMMING = _LIVE_SETTINGS["ENABLE_SUNSET_DIMMING"]
+DAY_BRIGHTNESS = _LIVE_SETTINGS["DAY_BRIGHTNESS"]
+NIGHT_BRIGHTNESS = _LIVE_SETTINGS["NIGHT_BRIGHTNESS"]
+# Minutes over which brightness steps one level at a time around sunrise and sunset (0 = switch at once)
+BRIGHTNESS_RAMP_MINUTES = _LIVE_SETTINGS["BRIGHTNESS_RAMP_MINUTES"]
 
 # Location for sunset calculation
-LOCATION_LATITUDE = float(CONFIG.get("LOCATION_LATITUDE", 43.4516))
-LOCATION_LONGITUDE = float(CONFIG.get("LOCATION_LONGITUDE", -80.4925))
+LOCATION_LATITUDE = _LIVE_SETTINGS["LOCATION_LATITUDE"]
+LOCATION_LONGITUDE = _LIVE_SETTINGS["LOCATION_LONGITUDE"]
 
 # Refresh interval in seconds
-REFRESH_INTERVAL = int(CONFIG.get("REFRESH_INTERVAL", 180))
+REFRESH_INTERVAL = _LIVE_SETTINGS["REFRESH_INTERVAL"]
 
-# Static GTFS refresh interval in seconds (default 12 hours)
-STATIC_GTFS_REFRESH_INTERVAL = int(CONFIG.get("STATIC_GTFS_REFRESH_INTERVAL", 43200))
+# Adaptive refresh: poll more often while a bus is close, less often when the next one is far off
+ADAPTIVE_REFRESH = _LIVE_SETTINGS["ADAPTIVE_REFRESH"]
+MIN_REFRESH_INTERVAL = _LIVE_SETTINGS["MIN_REFRESH_INTERVAL"]
+MAX_REFRESH_INTERVAL = _LIVE_SETTINGS["MAX_REFRESH_INTERVAL"]
+# Daily request budget of adaptive refresh (0 = unlimited); button presses are not counted
+MAX_REQUESTS_PER_DAY = _LIVE_SETTINGS["MAX_REQUESTS_PER_DAY"]
 
-# Store headsigns for filtering (empty string means accept all headsigns)
-_display1_headsign = DISPLAY1_HEADSIGN.strip() if DISPLAY1_HEADSIGN else ""
-_display2_headsign = DISPLAY2_HEADSIGN.strip() if DISPLAY2_HEADSIGN else ""
+# Stop polling between the last and first scheduled trips, with the displays blanked ("off") or dimmed ("dim")
+SERVICE_GAP_SLEEP = _LIVE_SETTINGS["SERVICE_GAP_SLEEP"]
+SLEEP_DISPLAY = _LIVE_SETTINGS["SLEEP_DISPLAY"]
 
-# Map routes to their desired headsigns (empty string means accept all headsigns)
-ROUTE_HEADSIGNS = {
-    DISPLAY1_ROUTE: _display1_headsign,
-    DISPLAY2_ROUTE: _display2_headsign,
-}
+# Static GTFS refresh interval in seconds (default 12 hours)
+STATIC_GTFS_REFRESH_INTERVAL = _LIVE_SETTINGS["STATIC_GTFS_REFRESH_INTERVAL"]
+
+# Directory for the on-disk static GTFS cache (relative paths are relative to this script)
+STATIC_GTFS_CACHE_DIR = Path(str(CONFIG.get("STATIC_GTFS_CACHE_DIR", "gtfs_cache")))
+if not STATIC_GTFS_CACHE_DIR.is_absolute():
+    STATIC_GTFS_CACHE_DIR = Path(__file__).parent / STATIC_GTFS_CACHE_DIR
 
-# Routes set for filtering (created once to avoid recreation on every fetch)
-DESIRED_ROUTES = {DISPLAY1_ROUTE, DISPLAY2_ROUTE}
+# Subscriptions indexed by stop so one pass over the realtime feed serves every display,
+# the routes set for filtering, and the stops whose trips are kept in the static GTFS index
+SUBSCRIPTIONS_BY_STOP = _LIVE_SETTINGS["SUBSCRIPTIONS_BY_STOP"]
+DESIRED_ROUTES = _LIVE_SETTINGS["DESIRED_ROUTES"]
+STOP_IDS = _LIVE_SETTINGS["STOP_IDS"]
 
 # Observer for sun calculations (cached to avoid recreation)
 _OBSERVER = None
@@ -153,137 +281,788 @@ if ASTRAL_AVAILABLE and ENABLE_SUNSET_DIMMING:
 _API_SESSION = None
 _API_SESSION_FAILURE_COUNT = 0  # Track consecutive failures to reset session
 
-# Log loaded configuration on startup
-print("[INFO] Configuration loaded from config.txt:")
-print(f"[INFO]   Stop ID: {STOP_ID}")
-print(f"[INFO]   Route 1: {DISPLAY1_ROUTE}", end="")
-if _display1_headsign:
-    print(f" (headsign: {_display1_headsign})", end="")
-print(f" (GPIO {DISPLAY1_CLK}/{DISPLAY1_DIO})")
-print(f"[INFO]   Route 2: {DISPLAY2_ROUTE}", end="")
-if _display2_headsign:
-    print(f" (headsign: {_display2_headsign})", end="")
-print(f" (GPIO {DISPLAY2_CLK}/{DISPLAY2_DIO})")
-print(f"[INFO]   Refresh interval: {REFRESH_INTERVAL} seconds")
-if ENABLE_SUNSET_DIMMING:
-    print(f"[INFO]   Sunset dimming: enabled (day: {DAY_BRIGHTNESS}, night: {NIGHT_BRIGHTNESS})")
-else:
-    print(f"[INFO]   Sunset dimming: disabled")
+# Logging: level for the console and log file, and the size-rotated log file (empty LOG_FILE = console only)
+LOG_LEVEL = _LIVE_SETTINGS["LOG_LEVEL"]
+# Log level given on the command line (--debug), which overrides LOG_LEVEL across config reloads
+_CLI_LOG_LEVEL = None
+LOG_FILE = str(CONFIG.get("LOG_FILE", "bustime.log")).strip()
+if LOG_FILE and not Path(LOG_FILE).is_absolute():
+    LOG_FILE = str(Path(__file__).parent / LOG_FILE)
+LOG_MAX_BYTES = int(CONFIG.get("LOG_MAX_BYTES", 1048576))
+LOG_BACKUP_COUNT = int(CONFIG.get("LOG_BACKUP_COUNT", 5))
 
-def get_sunset_time(date=None):
-    """Calculate sunset time for the location.
-    Returns datetime object in LOCAL_TZ, or None if calculation fails.
-    Uses cached observer instance.
+# Where the in-memory log ring buffer is dumped on SIGUSR1 or a crash
+RECENT_LOG_FILE = Path(__file__).parent / "bustime-recent.log"
+
+# Metrics: local HTTP endpoint (METRICS_PORT = 0 disables it) and JSON status file (empty disables it)
+METRICS_BIND = str(CONFIG.get("METRICS_BIND", "127.0.0.1"))
+METRICS_PORT = int(CONFIG.get("METRICS_PORT", 9110))
+STATUS_FILE = str(CONFIG.get("STATUS_FILE", "bustime-status.json")).strip()
+if STATUS_FILE and not Path(STATUS_FILE).is_absolute():
+    STATUS_FILE = str(Path(__file__).parent / STATUS_FILE)
+STATUS_FILE_INTERVAL = int(CONFIG.get("STATUS_FILE_INTERVAL", 60))
+
+# Prediction archive: daily binary segments of every parsed feed's predictions (empty disables it)
+ARCHIVE_DIR = str(CONFIG.get("ARCHIVE_DIR", "archive")).strip()
+if ARCHIVE_DIR and not Path(ARCHIVE_DIR).is_absolute():
+    ARCHIVE_DIR = str(Path(__file__).parent / ARCHIVE_DIR)
+ARCHIVE_MAX_BYTES = int(CONFIG.get("ARCHIVE_MAX_MB", 50)) * 1024 * 1024
+
+# LAN JSON API with the current arrivals (API_PORT = 0 disables it), and its worker threads
+API_BIND = str(CONFIG.get("API_BIND", "0.0.0.0"))
+API_PORT = int(CONFIG.get("API_PORT", 0))
+API_WORKERS = int(CONFIG.get("API_WORKERS", 4))
+
+# Caching proxy (bustime_proxy.py): the GRT endpoints it mirrors, where it listens and keeps the static zip
+PROXY_API_URL = CONFIG.get("PROXY_API_URL", "https://webapps.regionofwaterloo.ca/api/grt-routes/api/tripupdates/1")
+PROXY_STATIC_GTFS_URL = CONFIG.get("PROXY_STATIC_GTFS_URL", "https://webapps.regionofwaterloo.ca/api/grt-routes/api/staticfeeds/1")
+PROXY_BIND = str(CONFIG.get("PROXY_BIND", "0.0.0.0"))
+PROXY_PORT = int(CONFIG.get("PROXY_PORT", 8120))
+PROXY_WORKERS = int(CONFIG.get("PROXY_WORKERS", 8))
+PROXY_CACHE_DIR = Path(str(CONFIG.get("PROXY_CACHE_DIR", "proxy_cache")))
+if not PROXY_CACHE_DIR.is_absolute():
+    PROXY_CACHE_DIR = Path(__file__).parent / PROXY_CACHE_DIR
+PROXY_STATIC_REFRESH_INTERVAL = int(CONFIG.get("PROXY_STATIC_REFRESH_INTERVAL", 3600))
+
+# Fan-out of parsed predictions between signs: "publish" sends them to subscribed signs on PUSH_PORT,
+# "subscribe" receives them from the PUSH_PUBLISHER sign instead of fetching the feed, "off" does neither
+PUSH_MODE = str(CONFIG.get("PUSH_MODE", "off")).strip().lower()
+PUSH_BIND = str(CONFIG.get("PUSH_BIND", "0.0.0.0"))
+PUSH_PORT = int(CONFIG.get("PUSH_PORT", 8130))
+PUSH_PUBLISHER = str(CONFIG.get("PUSH_PUBLISHER", "")).strip()
+if PUSH_MODE not in ("publish", "subscribe"):
+    PUSH_MODE = "off"
+elif PUSH_MODE == "subscribe" and not PUSH_PUBLISHER:
+    _LIBRARY_WARNINGS.append("PUSH_MODE = subscribe needs PUSH_PUBLISHER, fetching the feed directly.")
+    PUSH_MODE = "off"
+
+
+def log_configuration():
+    """Log the loaded configuration and any missing optional libraries on startup."""
+    for warning in _LIBRARY_WARNINGS:
+        log.warning(warning)
+    log.info("Configuration loaded from config.txt:")
+    log.info(f"  Stop ID: {', '.join(sorted(STOP_IDS))}")
+    for display in DISPLAYS:
+        line = f"  Route {display.number}: {display.route_id}"
+        if display.headsign:
+            line += f" (headsign: {display.headsign})"
+        if len(STOP_IDS) > 1:
+            line += f" (stop: {display.stop_id})"
+        log.info(f"{line} (GPIO {display.clk}/{display.dio})")
+    log.info(f"  Refresh interval: {REFRESH_INTERVAL} seconds")
+    if ADAPTIVE_REFRESH:
+        log.info(f"  Adaptive refresh: {MIN_REFRESH_INTERVAL}-{MAX_REFRESH_INTERVAL} seconds, "
+                 f"{f'at most {MAX_REQUESTS_PER_DAY} requests/day' if MAX_REQUESTS_PER_DAY else 'no daily limit'}")
+    if SERVICE_GAP_SLEEP:
+        log.info(f"  Service gap sleep: enabled (displays {SLEEP_DISPLAY})")
+    if ENABLE_SUNSET_DIMMING:
+        log.info(f"  Sunset dimming: enabled (day: {DAY_BRIGHTNESS}, night: {NIGHT_BRIGHTNESS})")
+    else:
+        log.info("  Sunset dimming: disabled")
+    if PUSH_MODE == "publish":
+        log.info(f"  Push: publishing predictions on port {PUSH_PORT}")
+    elif PUSH_MODE == "subscribe":
+        log.info(f"  Push: subscribed to {PUSH_PUBLISHER}:{PUSH_PORT}")
+    log.info(f"  Log level: {LOG_LEVEL}" + (f" (file: {LOG_FILE})" if LOG_FILE else ""))
+
+
+# Sunrise and sunset per date, computed once per day
+_SUN_TIMES = {}
+
+
+def get_sun_times(date=None):
+    """Return (sunrise, sunset) for the location as datetimes in LOCAL_TZ, or None if unavailable.
+    Each date is calculated once and cached.
     """
     if not ASTRAL_AVAILABLE or not ENABLE_SUNSET_DIMMING or _OBSERVER is None:
         return None
     
-    try:
-        if date is None:
-            date = datetime.now(LOCAL_TZ).date()
-        else:
-            date = date.date() if isinstance(date, datetime) else date
-        
-        sun_times = sun(_OBSERVER, date=date, tzinfo=LOCAL_TZ)
-        return sun_times['sunset']
-    except Exception as e:
-        print(f"[ERROR] Failed to calculate sunset time: {e}")
-        return None
+    if date is None:
+        date = clock_now(LOCAL_TZ).date()
+    else:
+        date = date.date() if isinstance(date, datetime) else date
+    
+    if date not in _SUN_TIMES:
+        try:
+            sun_times = sun(_OBSERVER, date=date, tzinfo=LOCAL_TZ)
+            _SUN_TIMES[date] = (sun_times['sunrise'], sun_times['sunset'])
+        except Exception as e:
+            log.error(f"Failed to calculate sunrise/sunset time: {e}")
+            return None
+        # Only yesterday, today and tomorrow are ever needed
+        for old_date in [d for d in _SUN_TIMES if abs((d - date).days) > 2]:
+            del _SUN_TIMES[old_date]
+    return _SUN_TIMES[date]
+
+
+def get_sunset_time(date=None):
+    """Calculate sunset time for the location.
+    Returns datetime object in LOCAL_TZ, or None if calculation fails.
+    """
+    sun_times = get_sun_times(date)
+    return sun_times[1] if sun_times else None
 
 
 def get_sunrise_time(date=None):
     """Calculate sunrise time for the location.
     Returns datetime object in LOCAL_TZ, or None if calculation fails.
-    Uses cached observer instance.
     """
-    if not ASTRAL_AVAILABLE or not ENABLE_SUNSET_DIMMING or _OBSERVER is None:
-        return None
+    sun_times = get_sun_times(date)
+    return sun_times[0] if sun_times else None
+
+
+def ramp_transitions(center, from_level, to_level):
+    """Return [(timestamp, level)] stepping from from_level to to_level one level at a time,
+    spread evenly over BRIGHTNESS_RAMP_MINUTES centred on center (a single step at center without a ramp).
+    """
+    if from_level == to_level:
+        return []
+    ramp = BRIGHTNESS_RAMP_MINUTES * 60
+    if ramp <= 0:
+        return [(center.timestamp(), to_level)]
+    step = 1 if to_level > from_level else -1
+    levels = list(range(from_level + step, to_level + step, step))
+    start = center.timestamp() - ramp / 2
+    return [(start + (k + 0.5) * ramp / len(levels), level) for k, level in enumerate(levels)]
+
+
+def get_brightness_transitions(date):
+    """Return the day's brightness changes as a sorted [(timestamp, level)]: to DAY_BRIGHTNESS around
+    sunrise and to NIGHT_BRIGHTNESS around sunset. Empty if sunset dimming is unavailable.
+    """
+    sun_times = get_sun_times(date)
+    if sun_times is None:
+        return []
+    sunrise, sunset = sun_times
+    return (ramp_transitions(sunrise, NIGHT_BRIGHTNESS, DAY_BRIGHTNESS)
+            + ramp_transitions(sunset, DAY_BRIGHTNESS, NIGHT_BRIGHTNESS))
+
+
+def get_brightness_at(timestamp):
+    """Return the scheduled brightness level at timestamp."""
+    today = datetime.fromtimestamp(timestamp, tz=LOCAL_TZ).date()
+    level = NIGHT_BRIGHTNESS  # Before the first transition of the day it is still night
+    for transition_time, transition_level in get_brightness_transitions(today):
+        if transition_time > timestamp:
+            break
+        level = transition_level
+    return level
+
+
+def get_next_brightness_transition(timestamp):
+    """Return the first (timestamp, level) brightness change after timestamp, or None."""
+    today = datetime.fromtimestamp(timestamp, tz=LOCAL_TZ).date()
+    for offset in (0, 1):
+        for transition in get_brightness_transitions(today + timedelta(days=offset)):
+            if transition[0] > timestamp:
+                return transition
+    return None
+
+
+# Chunk size used when streaming the static GTFS download to disk
+STATIC_GTFS_CHUNK_SIZE = 64 * 1024
+
+# Files that make up the on-disk static GTFS cache
+STATIC_GTFS_CACHE_ZIP = STATIC_GTFS_CACHE_DIR / "static_gtfs.zip"
+STATIC_GTFS_CACHE_META = STATIC_GTFS_CACHE_DIR / "static_gtfs_meta.json"
+STATIC_GTFS_CACHE_INDEX = STATIC_GTFS_CACHE_DIR / "stop_index.json"
+
+# A trip that calls at one of the monitored stops:
+# route_id, headsign, service_id, and stop_times as ((stop_id, scheduled arrival in seconds after midnight), ...)
+StopTrip = namedtuple("StopTrip", ["route_id", "headsign", "service_id", "stop_times"])
+
+# Static GTFS data kept for the monitored stops:
+# trips maps trip_id -> StopTrip, calendar maps service_id -> service dates (see build_stop_trip_index)
+StaticGTFSData = namedtuple("StaticGTFSData", ["trips", "calendar"])
+
+
+def read_static_cache_meta():
+    """Read the static GTFS cache metadata (ETag, Last-Modified, feed version, check time).
+    Returns an empty dictionary if there is no usable cache on disk.
+    """
+    if not STATIC_GTFS_CACHE_ZIP.exists() or not STATIC_GTFS_CACHE_META.exists():
+        return {}
     
     try:
-        if date is None:
-            date = datetime.now(LOCAL_TZ).date()
-        else:
-            date = date.date() if isinstance(date, datetime) else date
-        
-        sun_times = sun(_OBSERVER, date=date, tzinfo=LOCAL_TZ)
-        return sun_times['sunrise']
-    except Exception as e:
-        print(f"[ERROR] Failed to calculate sunrise time: {e}")
+        with open(STATIC_GTFS_CACHE_META, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning(f"Ignoring unreadable static GTFS cache metadata: {e}")
+        return {}
+
+
+def write_static_cache_meta(meta):
+    """Atomically write the static GTFS cache metadata."""
+    STATIC_GTFS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = STATIC_GTFS_CACHE_META.with_suffix(".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, STATIC_GTFS_CACHE_META)
+
+
+def iter_gtfs_rows(zip_file, member, columns, contains=None):
+    """Yield tuples of the requested columns from a GTFS table inside an open zip, one row at a time.
+    Rows are streamed straight from the archive, so memory use does not grow with the table.
+    Columns missing from the table are returned as empty strings.
+    If contains is given, lines that include none of those strings are skipped before CSV parsing.
+    """
+    with zip_file.open(member) as f:
+        lines = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+        header = next(csv.reader([next(lines, '')]), None)
+        if not header:
+            return
+        header = [name.strip() for name in header]
+        indices = [header.index(name) if name in header else None for name in columns]
+        if contains:
+            lines = (line for line in lines if any(value in line for value in contains))
+        for row in csv.reader(lines):
+            yield tuple(row[i] if i is not None and i < len(row) else "" for i in indices)
+
+
+def read_feed_version(zip_file):
+    """Return feed_version from feed_info.txt, or an empty string if it is not published."""
+    if 'feed_info.txt' not in zip_file.namelist():
+        return ""
+    
+    for (feed_version,) in iter_gtfs_rows(zip_file, 'feed_info.txt', ('feed_version',)):
+        return feed_version
+    return ""
+
+
+def parse_gtfs_time(value):
+    """Convert a GTFS HH:MM:SS time (hours may exceed 24) to seconds after midnight of the service day.
+    Returns None for an empty or malformed value.
+    """
+    try:
+        hours, minutes, seconds = value.strip().split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except ValueError:
         return None
 
 
-def load_static_gtfs_data():
+def build_stop_trip_index(zip_source, stop_ids):
+    """Build the stop-scoped trip index from a static GTFS zip (path or file object).
+    Joins stop_times.txt with trips.txt and keeps only trips that call at one of stop_ids,
+    plus the calendar.txt/calendar_dates.txt entries for their services.
+    Returns StaticGTFSData. Each calendar entry is a dictionary with "start"/"end" dates
+    (YYYYMMDD), "days" (seven 0/1 flags, Monday first), and "added"/"removed" exception dates.
+    """
+    stop_visits = {}  # trip_id -> [(stop_id, scheduled arrival in seconds)]
+    index = {}
+    headsigns = {}  # Share one string object per distinct headsign
+    
+    with zipfile.ZipFile(zip_source) as zip_file:
+        # Scan stop_times.txt for visits to the monitored stops
+        columns = ('trip_id', 'stop_id', 'arrival_time', 'departure_time')
+        for trip_id, stop_id, arrival, departure in iter_gtfs_rows(zip_file, 'stop_times.txt', columns, contains=stop_ids):
+            if trip_id and stop_id in stop_ids:
+                stop_visits.setdefault(trip_id, []).append((stop_id, parse_gtfs_time(arrival or departure)))
+        
+        # Read trips.txt to attach route, headsign and service to the trips found above
+        columns = ('trip_id', 'route_id', 'trip_headsign', 'service_id')
+        for trip_id, route_id, headsign, service_id in iter_gtfs_rows(zip_file, 'trips.txt', columns):
+            visits = stop_visits.get(trip_id)
+            if visits is not None:
+                index[trip_id] = StopTrip(route_id, headsigns.setdefault(headsign, headsign), service_id, tuple(visits))
+        
+        # Read the service calendars of those trips
+        calendar = read_gtfs_calendar(zip_file, {trip.service_id for trip in index.values()})
+    
+    return StaticGTFSData(index, calendar)
+
+
+def read_gtfs_calendar(zip_file, service_ids=None):
+    """Return the calendar.txt and calendar_dates.txt entries of service_ids (default all services)
+    from an open GTFS zip, in the StaticGTFSData calendar format. Either file may be omitted by the feed.
+    """
+    calendar = {}
+    names = zip_file.namelist()
+    if 'calendar.txt' in names:
+        columns = ('service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday',
+                   'start_date', 'end_date')
+        for row in iter_gtfs_rows(zip_file, 'calendar.txt', columns):
+            if service_ids is None or row[0] in service_ids:
+                calendar.setdefault(row[0], {"added": [], "removed": []}).update(
+                    start=row[8], end=row[9], days="".join(flag.strip() or "0" for flag in row[1:8]))
+    if 'calendar_dates.txt' in names:
+        for service_id, date, exception_type in iter_gtfs_rows(zip_file, 'calendar_dates.txt', ('service_id', 'date', 'exception_type')):
+            if (service_ids is None or service_id in service_ids) and exception_type.strip() in ("1", "2"):
+                service = calendar.setdefault(service_id, {"added": [], "removed": []})
+                service["added" if exception_type.strip() == "1" else "removed"].append(date)
+    return calendar
+
+
+def save_stop_trip_index(static_data, meta, stop_ids=None):
+    """Persist the stop trip index for stop_ids (default STOP_IDS) next to the cached zip it was built from."""
+    data = {
+        "downloaded_at": meta.get("downloaded_at"),
+        "stop_ids": sorted(stop_ids or STOP_IDS),
+        "trips": {trip_id: list(trip) for trip_id, trip in static_data.trips.items()},
+        "calendar": static_data.calendar,
+    }
+    tmp_path = STATIC_GTFS_CACHE_INDEX.with_suffix(".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, STATIC_GTFS_CACHE_INDEX)
+
+
+def load_cached_stop_trip_index(meta, stop_ids=None):
+    """Return the stop trip index (StaticGTFSData) for the cached zip and stop_ids (default STOP_IDS).
+    The persisted index is reused if it was built from the same download for the same stops,
+    otherwise it is rebuilt from the zip and saved again.
+    """
+    stop_ids = stop_ids or STOP_IDS
+    try:
+        with open(STATIC_GTFS_CACHE_INDEX, 'r') as f:
+            data = json.load(f)
+        if data.get("downloaded_at") == meta.get("downloaded_at") and data.get("stop_ids") == sorted(stop_ids):
+            trips = {
+                trip_id: StopTrip(route_id, headsign, service_id, tuple((stop_id, arrival) for stop_id, arrival in stop_times))
+                for trip_id, (route_id, headsign, service_id, stop_times) in data["trips"].items()
+            }
+            return StaticGTFSData(trips, data["calendar"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    
+    static_data = build_stop_trip_index(STATIC_GTFS_CACHE_ZIP, stop_ids)
+    save_stop_trip_index(static_data, meta, stop_ids)
+    return static_data
+
+
+def download_to_file(session, url, path, headers, timeout):
+    """Stream a GET response to disk in chunks instead of buffering it in memory.
+    Returns the response; the body is only written for a 200 response.
+    """
+    with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304:
+            return response
+        response.raise_for_status()
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=STATIC_GTFS_CHUNK_SIZE):
+                f.write(chunk)
+        return response
+
+
+def load_static_gtfs_data(require_trips=False, stop_ids=None):
     """
-    Load and cache static GTFS data to build a mapping of trip_id to headsign.
-    This is used to filter realtime arrivals by destination/direction.
-    Returns a dictionary mapping trip_id to headsign.
+    Load and cache static GTFS data to build the stop-scoped trip index.
+    Only trips that call at stop_ids (default the monitored stops) are kept, with their route,
+    headsign and scheduled arrival time. This is used to filter realtime
+    arrivals by destination/direction.
+    Returns StaticGTFSData, or None if the refresh failed.
+    
+    The zip is kept on disk together with its ETag/Last-Modified headers, so an
+    unchanged feed is revalidated with a single conditional GET (304 Not Modified).
+    A new download only replaces the cached copy once its index has been built;
+    with require_trips=True an index without any trips for the monitored stops
+    is rejected as well.
     """
-    trip_to_headsign = {}
+    meta = read_static_cache_meta()
+    stop_ids = stop_ids or STOP_IDS
+    stops_str = ", ".join(sorted(stop_ids))
+    load_start = time.perf_counter()
     
     try:
-        print("[INFO] Loading static GTFS data for headsign mapping...")
-        session = requests.Session()
-        session.mount("https://", DH_KeyAdapter())
+        log.info("Loading static GTFS data for headsign mapping...")
+        session = new_api_session()
         
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
         
-        # Download the static GTFS zip file
-        response = session.get(STATIC_GTFS_URL, headers=headers, timeout=30)
-        response.raise_for_status()
+        # Revalidate the cached copy instead of downloading it again
+        if meta.get("etag"):
+            headers['If-None-Match'] = meta["etag"]
+        if meta.get("last_modified"):
+            headers['If-Modified-Since'] = meta["last_modified"]
         
-        # Extract and parse the trips.txt file
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
-            # Read trips.txt to get trip_id -> headsign mapping
-            with zip_file.open('trips.txt') as f:
-                reader = csv.DictReader(io.TextIOWrapper(f, encoding='utf-8'))
-                for row in reader:
-                    trip_id = row.get('trip_id')
-                    headsign = row.get('trip_headsign', '')
-                    if trip_id:
-                        trip_to_headsign[trip_id] = headsign
+        # Spool the static GTFS zip file to disk next to the cached copy
+        STATIC_GTFS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = STATIC_GTFS_CACHE_ZIP.with_suffix(".tmp")
+        response = download_to_file(session, STATIC_GTFS_URL, tmp_path, headers, timeout=30)
+        
+        if response.status_code == 304 and meta:
+            log.info("Static GTFS data not modified since last download, using cached copy.")
+            static_data = load_cached_stop_trip_index(meta, stop_ids)
+            meta["checked_at"] = clock_time()
+            write_static_cache_meta(meta)
+        else:
+            # Build the index straight from the spooled zip
+            static_data = build_stop_trip_index(tmp_path, stop_ids)
+            with zipfile.ZipFile(tmp_path) as zip_file:
+                feed_version = read_feed_version(zip_file)
+            
+            if require_trips and not static_data.trips:
+                raise ValueError(f"downloaded feed has no trips serving stop {stops_str}")
+            
+            if meta and meta.get("feed_version") != feed_version:
+                log.info(f"Static GTFS feed version changed: {meta.get('feed_version') or 'unknown'} -> {feed_version or 'unknown'}")
+            
+            # Drop the old metadata before promoting the zip: a crash in between must not pair the
+            # new zip with the old ETag, or the next conditional request could get a 304 for it
+            STATIC_GTFS_CACHE_META.unlink(missing_ok=True)
+            os.replace(tmp_path, STATIC_GTFS_CACHE_ZIP)
+            now = clock_time()
+            meta = {
+                "etag": response.headers.get('ETag', ""),
+                "last_modified": response.headers.get('Last-Modified', ""),
+                "feed_version": feed_version,
+                "downloaded_at": now,
+                "checked_at": now,
+            }
+            write_static_cache_meta(meta)
+            save_stop_trip_index(static_data, meta, stop_ids)
         
-        print(f"[INFO] Loaded {len(trip_to_headsign)} trip-headsign mappings from static GTFS data.")
-        return trip_to_headsign
+        STATIC_LOAD_SECONDS.observe(time.perf_counter() - load_start)
+        log.info(f"Loaded {len(static_data.trips)} trips serving stop {stops_str} from static GTFS data.")
+        return static_data
     
     except Exception as e:
-        print(f"[ERROR] Failed to load static GTFS data: {e}")
-        print("[WARNING] Headsign filtering will be disabled.")
-        return {}
+        log.error(f"Failed to load static GTFS data: {e}")
+        STATIC_GTFS_CACHE_ZIP.with_suffix(".tmp").unlink(missing_ok=True)
+        return None
+
+
+# Global cache for the stop-scoped static GTFS data.
+# The data is only ever replaced as a whole, so readers holding a reference keep a consistent copy.
+_STATIC_GTFS_DATA = None
+_STATIC_GTFS_DATA_TIMESTAMP = None
+
+# Background refresh state
+_STATIC_REFRESH_THREAD = None
+_STATIC_REFRESH_LOCK = threading.Lock()
+# Held while the monitored stops or the data built for them are swapped, so a refresh for stops
+# that reload_config() has just replaced can never install its index
+_STATIC_SWAP_LOCK = threading.Lock()
+_STATIC_REFRESH_FAILURES = 0
+_STATIC_REFRESH_RETRY_AT = 0
+_STATIC_WARM_START_DONE = False
+
+# Delays (in seconds) before retrying after consecutive static GTFS refresh failures
+STATIC_GTFS_RETRY_DELAYS = (60, 300, 900, 1800, 3600)
+
+
+def refresh_static_gtfs_data():
+    """Refresh the static GTFS data and swap it in once it has been built.
+    Runs on the background refresh thread. On failure the previous data is kept
+    and the next attempt is scheduled according to STATIC_GTFS_RETRY_DELAYS.
+    If reload_config() changed the monitored stops meanwhile, the index built for the old
+    stops is discarded and the refresh is repeated for the new ones.
+    """
+    global _STATIC_GTFS_DATA, _STATIC_GTFS_DATA_TIMESTAMP, _STATIC_REFRESH_FAILURES, _STATIC_REFRESH_RETRY_AT
+    
+    while True:
+        stop_ids = STOP_IDS
+        previous = _STATIC_GTFS_DATA
+        static_data = load_static_gtfs_data(require_trips=bool(previous and previous.trips), stop_ids=stop_ids)
+        with _STATIC_SWAP_LOCK:
+            if stop_ids != STOP_IDS:
+                log.info("Monitored stops changed during the static GTFS refresh, refreshing again for the new stops.")
+                continue
+            if static_data is not None:
+                # Swap in the new data in a single assignment
+                _STATIC_GTFS_DATA = static_data
+                _STATIC_GTFS_DATA_TIMESTAMP = clock_time()
+                _STATIC_REFRESH_FAILURES = 0
+                _STATIC_REFRESH_RETRY_AT = 0
+                return
+        break
+    
+    _STATIC_REFRESH_FAILURES += 1
+    delay = STATIC_GTFS_RETRY_DELAYS[min(_STATIC_REFRESH_FAILURES, len(STATIC_GTFS_RETRY_DELAYS)) - 1]
+    _STATIC_REFRESH_RETRY_AT = clock_time() + delay
+    if previous and previous.trips:
+        log.warning(f"Keeping previous static GTFS data ({len(previous.trips)} trips). Retrying in {delay} seconds.")
+    else:
+        log.warning(f"Headsign filtering unavailable until static GTFS data loads. Retrying in {delay} seconds.")
+
+
+def start_static_refresh():
+    """Start a background static GTFS refresh unless one is already running."""
+    global _STATIC_REFRESH_THREAD
+    
+    with _STATIC_REFRESH_LOCK:
+        if _STATIC_REFRESH_THREAD is not None and _STATIC_REFRESH_THREAD.is_alive():
+            return
+        _STATIC_REFRESH_THREAD = threading.Thread(target=refresh_static_gtfs_data, name="static-gtfs-refresh", daemon=True)
+        _STATIC_REFRESH_THREAD.start()
 
 
-# Global cache for trip-to-headsign mapping
-_TRIP_TO_HEADSIGN = None
-_TRIP_TO_HEADSIGN_TIMESTAMP = None
+def get_static_gtfs_data():
+    """
+    Get the stop-scoped static GTFS data (StaticGTFSData), or None if it has never been loaded.
+    Never blocks on the network: the last good data is returned while expired
+    data is refreshed in the background (stale-while-revalidate).
+    On the first call the on-disk cache is loaded, however old, so a restart starts warm.
+    """
+    global _STATIC_GTFS_DATA, _STATIC_GTFS_DATA_TIMESTAMP, _STATIC_WARM_START_DONE
+    
+    current_time = clock_time()
+    
+    # Start from the on-disk cache before anything has been downloaded
+    if _STATIC_GTFS_DATA is None and not _STATIC_WARM_START_DONE:
+        _STATIC_WARM_START_DONE = True
+        meta = read_static_cache_meta()
+        if meta:
+            try:
+                _STATIC_GTFS_DATA = load_cached_stop_trip_index(meta)
+                # Age the in-memory copy from when the disk cache was last validated
+                _STATIC_GTFS_DATA_TIMESTAMP = min(current_time, meta.get("checked_at", 0))
+                log.info(f"Loaded {len(_STATIC_GTFS_DATA.trips)} trips serving stop {', '.join(sorted(STOP_IDS))} from static GTFS cache"
+                         f" (feed version: {meta.get('feed_version') or 'unknown'}).")
+            except Exception as e:
+                log.warning(f"Static GTFS cache is unusable: {e}")
+    
+    # Refresh in the background if the cache is empty or has expired
+    expired = _STATIC_GTFS_DATA is None or (current_time - _STATIC_GTFS_DATA_TIMESTAMP) > STATIC_GTFS_REFRESH_INTERVAL
+    if expired and current_time >= _STATIC_REFRESH_RETRY_AT:
+        start_static_refresh()
+    
+    return _STATIC_GTFS_DATA
+
+
+def get_stop_trip_index():
+    """
+    Get the stop-scoped trip index (trip_id -> StopTrip) from cached static GTFS data.
+    Returns an empty dictionary until static GTFS data has been loaded once.
+    """
+    static_data = get_static_gtfs_data()
+    return static_data.trips if static_data is not None else {}
+
 
 def get_trip_headsign(trip_id):
     """
     Get the headsign for a given trip_id using cached static GTFS data.
     Returns the headsign (as string) or empty string if not found.
-    Loads the data on first call and refreshes if cache has expired.
     """
-    global _TRIP_TO_HEADSIGN, _TRIP_TO_HEADSIGN_TIMESTAMP
+    stop_trip = get_stop_trip_index().get(trip_id)
+    return stop_trip.headsign if stop_trip else ""
+
+
+class ScheduleTimetable:
+    """Scheduled arrivals at the monitored stops, used when realtime data is unavailable.
+    Arrival times are grouped per (stop_id, route_id, headsign) into sorted arrays once per
+    service day, so each lookup is a binary search. An empty headsign groups all headsigns
+    of a route.
+    """
+    def __init__(self, static_data):
+        self.calendar = static_data.calendar
+        # (stop_id, route_id, headsign) -> [(arrival seconds, service_id, trip_id, headsign)]
+        self.patterns = {}
+        for trip_id, trip in static_data.trips.items():
+            for stop_id, arrival in trip.stop_times:
+                if arrival is None:
+                    continue
+                entry = (arrival, trip.service_id, trip_id, trip.headsign)
+                self.patterns.setdefault((stop_id, trip.route_id, trip.headsign), []).append(entry)
+                if trip.headsign:
+                    self.patterns.setdefault((stop_id, trip.route_id, ""), []).append(entry)
+        for entries in self.patterns.values():
+            entries.sort()
+        # Service date -> {pattern key: (sorted timestamps, [(trip_id, headsign)])}
+        self.days = {}
+    
+    def service_runs(self, service_id, service_date):
+        """Return True if service_id operates on service_date according to the calendar."""
+        service = self.calendar.get(service_id)
+        if service is None:
+            return False
+        day = service_date.strftime("%Y%m%d")
+        if day in service["removed"]:
+            return False
+        if day in service["added"]:
+            return True
+        days = service.get("days", "")
+        return (service.get("start", "") <= day <= service.get("end", "")
+                and len(days) == 7 and days[service_date.weekday()] == "1")
+    
+    def get_day(self, service_date):
+        """Return the timetable arrays for one service date, building them on first use."""
+        day = self.days.get(service_date)
+        if day is None:
+            # GTFS times count from noon minus 12 hours, which stays correct across DST changes
+            noon = datetime.combine(service_date, datetime_time(12), tzinfo=LOCAL_TZ)
+            base = noon.timestamp() - 12 * 3600
+            running = {}
+            day = {}
+            for key, entries in self.patterns.items():
+                timestamps = []
+                trips = []
+                for arrival, service_id, trip_id, headsign in entries:
+                    if service_id not in running:
+                        running[service_id] = self.service_runs(service_id, service_date)
+                    if running[service_id]:
+                        timestamps.append(base + arrival)
+                        trips.append((trip_id, headsign))
+                day[key] = (timestamps, trips)
+            
+            # Only yesterday, today and tomorrow are ever needed
+            for old_date in [d for d in self.days if abs((d - service_date).days) > 2]:
+                del self.days[old_date]
+            self.days[service_date] = day
+        return day
+    
+    def next_arrivals(self, stop_id, route_id, headsign, after_timestamp, count=1):
+        """Return up to count scheduled (timestamp, trip_id, headsign) tuples after after_timestamp."""
+        key = (stop_id, route_id, headsign or "")
+        if key not in self.patterns:
+            return []
+        
+        today = datetime.fromtimestamp(after_timestamp, tz=LOCAL_TZ).date()
+        results = []
+        # Trips after midnight may belong to yesterday's service day (times past 24:00:00)
+        for offset in (-1, 0, 1):
+            timestamps, trips = self.get_day(today + timedelta(days=offset)).get(key, ([], []))
+            start = bisect.bisect_right(timestamps, after_timestamp)
+            for i in range(start, min(start + count, len(timestamps))):
+                results.append((timestamps[i], trips[i][0], trips[i][1]))
+        results.sort()
+        return results[:count]
+    
+    def previous_arrival(self, stop_id, route_id, headsign, before_timestamp):
+        """Return the last scheduled timestamp at or before before_timestamp, or None."""
+        key = (stop_id, route_id, headsign or "")
+        if key not in self.patterns:
+            return None
+        
+        today = datetime.fromtimestamp(before_timestamp, tz=LOCAL_TZ).date()
+        latest = None
+        for offset in (-1, 0):
+            timestamps, _ = self.get_day(today + timedelta(days=offset)).get(key, ([], []))
+            i = bisect.bisect_right(timestamps, before_timestamp)
+            if i and (latest is None or timestamps[i - 1] > latest):
+                latest = timestamps[i - 1]
+        return latest
+
+
+# Timetable built from the current static GTFS data
+_SCHEDULE_TIMETABLE = None
+
+# How soon to retry the realtime feed (in seconds) while showing scheduled arrivals
+SCHEDULE_FALLBACK_RETRY_INTERVAL = 60
+
+# Service gap sleep: seconds after the last scheduled arrival before sleeping (late buses still count)
+SERVICE_GAP_GRACE = 900
+# Seconds before the first scheduled arrival to wake, so early realtime predictions are picked up
+SERVICE_GAP_WAKE_LEAD = 1800
+# Shortest sleep worth entering sleep mode for (seconds)
+SERVICE_GAP_MIN_SLEEP = 1800
+
+
+def get_schedule_timetable():
+    """Return the timetable for the current static GTFS data, or None if it is not loaded yet."""
+    global _SCHEDULE_TIMETABLE
+    
+    static_data = get_static_gtfs_data()
+    if static_data is None:
+        return None
+    
+    # Rebuild the timetable whenever new static data has been swapped in
+    if _SCHEDULE_TIMETABLE is None or _SCHEDULE_TIMETABLE.calendar is not static_data.calendar:
+        _SCHEDULE_TIMETABLE = ScheduleTimetable(static_data)
+    return _SCHEDULE_TIMETABLE
+
+
+def get_service_gap(now_timestamp):
+    """
+    Find the gap in scheduled service around now_timestamp for the configured displays.
+    Returns (last arrival before now, wake time) if service has ended and the next scheduled
+    arrival is far enough off to sleep until SERVICE_GAP_WAKE_LEAD before it, otherwise None.
+    With no scheduled arrival in sight (e.g. no service tomorrow) there is no gap to sleep through.
+    """
+    timetable = get_schedule_timetable()
+    if timetable is None:
+        return None
+    
+    last_arrival = None
+    next_arrival = None
+    for display in DISPLAYS:
+        previous = timetable.previous_arrival(display.stop_id, display.route_id, display.headsign, now_timestamp)
+        if previous is not None and (last_arrival is None or previous > last_arrival):
+            last_arrival = previous
+        upcoming = timetable.next_arrivals(display.stop_id, display.route_id, display.headsign, now_timestamp)
+        if upcoming and (next_arrival is None or upcoming[0][0] < next_arrival):
+            next_arrival = upcoming[0][0]
     
-    current_time = time.time()
+    if next_arrival is None:
+        return None
+    if last_arrival is not None and now_timestamp < last_arrival + SERVICE_GAP_GRACE:
+        return None
+    wake_time = next_arrival - SERVICE_GAP_WAKE_LEAD
+    if wake_time - now_timestamp < SERVICE_GAP_MIN_SLEEP:
+        return None
+    return last_arrival, wake_time
+
+
+def get_scheduled_arrivals(count=2):
+    """
+    Get the next scheduled arrivals for each display subscription from the static timetable.
+    Returns arrival dicts in the same format as fetch_bus_arrivals(), marked with "scheduled": True.
+    """
+    timetable = get_schedule_timetable()
+    if timetable is None:
+        return []
     
-    # Load or refresh if cache is empty or has expired
-    if _TRIP_TO_HEADSIGN is None or (current_time - _TRIP_TO_HEADSIGN_TIMESTAMP) > STATIC_GTFS_REFRESH_INTERVAL:
-        _TRIP_TO_HEADSIGN = load_static_gtfs_data()
-        _TRIP_TO_HEADSIGN_TIMESTAMP = current_time
+    now_timestamp = clock_time()
+    arrivals = []
+    seen = set()  # Displays with overlapping subscriptions share arrivals
+    for display in DISPLAYS:
+        for timestamp, trip_id, headsign in timetable.next_arrivals(
+                display.stop_id, display.route_id, display.headsign, now_timestamp, count):
+            if (trip_id, display.stop_id) in seen:
+                continue
+            seen.add((trip_id, display.stop_id))
+            arrivals.append({
+                "time": datetime.fromtimestamp(timestamp, tz=timezone.utc),
+                "route_id": display.route_id,
+                "stop_id": display.stop_id,
+                "trip_id": trip_id,
+                "headsign": headsign,
+                "timestamp": timestamp,
+                "scheduled": True
+            })
     
-    return _TRIP_TO_HEADSIGN.get(trip_id, "")
+    arrivals.sort(key=lambda x: x["timestamp"])
+    return arrivals
+
 
+# Transport adapter class allowing the weak DH keys of the GRT servers, created by new_api_session()
+_DH_KEY_ADAPTER = None
 
-class DH_KeyAdapter(HTTPAdapter):
-    """Custom adapter to allow weak DH keys for older servers"""
-    def init_poolmanager(self, *args, **kwargs):
-        ctx = create_urllib3_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        ctx.set_ciphers('DEFAULT@SECLEVEL=1')
-        kwargs['ssl_context'] = ctx
-        return super().init_poolmanager(*args, **kwargs)
+
+def new_api_session():
+    """Create a requests session for the GRT servers.
+    requests and urllib3 are imported here on first use instead of at startup: together they are
+    the slowest imports of the program, and nothing needs them before the first fetch, which runs
+    in a worker thread while the displays already show the cached arrivals.
+    """
+    global _DH_KEY_ADAPTER
+    import requests
+    
+    if _DH_KEY_ADAPTER is None:
+        import urllib3
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.ssl_ import create_urllib3_context
+        
+        # Disable SSL warnings
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        
+        class DH_KeyAdapter(HTTPAdapter):
+            """Custom adapter to allow weak DH keys for older servers"""
+            def init_poolmanager(self, *args, **kwargs):
+                ctx = create_urllib3_context()
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+                ctx.set_ciphers('DEFAULT@SECLEVEL=1')
+                kwargs['ssl_context'] = ctx
+                return super().init_poolmanager(*args, **kwargs)
+        
+        _DH_KEY_ADAPTER = DH_KeyAdapter
+    
+    session = requests.Session()
+    session.mount("https://", _DH_KEY_ADAPTER())
+    return session
 
 
 def get_api_session():
@@ -293,7 +1072,7 @@ def get_api_session():
     
     # Reset session after 3 consecutive failures to try fresh connection
     if _API_SESSION_FAILURE_COUNT >= 3:
-        print(f"[WARNING] Session had {_API_SESSION_FAILURE_COUNT} consecutive failures. Resetting connection...")
+        log.warning(f"Session had {_API_SESSION_FAILURE_COUNT} consecutive failures. Resetting connection...")
         if _API_SESSION is not None:
             try:
                 _API_SESSION.close()
@@ -301,438 +1080,1818 @@ def get_api_session():
                 pass
         _API_SESSION = None
         _API_SESSION_FAILURE_COUNT = 0
+        SESSION_RESETS.inc()
     
     if _API_SESSION is None:
-        _API_SESSION = requests.Session()
-        _API_SESSION.mount("https://", DH_KeyAdapter())
+        _API_SESSION = new_api_session()
     return _API_SESSION
 
 
+# Touch sensor sampling period (seconds) and number of equal samples that make a debounced state change
+SENSOR_POLL_INTERVAL = 0.01
+SENSOR_DEBOUNCE_SAMPLES = 2
+
+
 class CapacitiveSensorManager:
-    """Manages TTP223 capacitive sensor for refresh trigger"""
-    def __init__(self, callback=None, debug=False):
-        self.available = GPIO_AVAILABLE
+    """Manages TTP223 capacitive sensor for refresh trigger.
+    A background thread samples the sensor every SENSOR_POLL_INTERVAL, so presses are seen while the
+    main loop is busy fetching or sleeping. gpio defaults to RPi.GPIO; a fake backend can be passed in.
+    """
+    def __init__(self, callback=None, debug=False, gpio=None):
+        self.gpio = gpio if gpio is not None else (GPIO if GPIO_AVAILABLE else None)
+        self.available = self.gpio is not None
         self.callback = callback
         self.debug = debug
         self.last_state = 0
+        self.raw_state = 0
+        self.stable_samples = 0
         self.state_change_count = 0
+        self.press_count = 0
+        self._thread = None
+        self._stop_event = threading.Event()
         
         if self.available:
             try:
                 # Try to set GPIO mode, but don't fail if already set
                 try:
-                    GPIO.setmode(GPIO.BCM)
+                    self.gpio.setmode(self.gpio.BCM)
                 except RuntimeError:
                     # GPIO mode already set, this is fine
                     pass
                 
-                GPIO.setup(SENSOR_PIN, GPIO.IN)
+                self.gpio.setup(SENSOR_PIN, self.gpio.IN)
                 
                 # Try to remove any existing event detection on this pin first
                 try:
-                    GPIO.remove_event_detect(SENSOR_PIN)
+                    self.gpio.remove_event_detect(SENSOR_PIN)
                 except RuntimeError:
                     pass  # No existing event, that's fine
                 
                 # Read initial state
-                self.last_state = GPIO.input(SENSOR_PIN)
+                self.last_state = self.raw_state = self.gpio.input(SENSOR_PIN)
                 
                 # Use polling instead of event detection to avoid conflicts
-                print(f"[INFO] Capacitive sensor initialized on pin {SENSOR_PIN} (polling mode).")
-                print(f"[INFO] Initial sensor state: {self.last_state}")
+                log.info(f"Capacitive sensor initialized on pin {SENSOR_PIN} (polling every {SENSOR_POLL_INTERVAL * 1000:.0f} ms).")
+                log.info(f"Initial sensor state: {self.last_state}")
             except Exception as e:
-                print(f"[ERROR] Failed to initialize capacitive sensor: {e}")
-                import traceback
-                traceback.print_exc()
+                log.exception(f"Failed to initialize capacitive sensor: {e}")
                 self.available = False
     
+    def start(self):
+        """Start sampling the sensor in a background thread."""
+        if not self.available or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sensor", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        # time.sleep() costs about half the CPU of Event.wait(timeout) at this rate
+        while self.available and not self._stop_event.is_set():
+            time.sleep(SENSOR_POLL_INTERVAL)
+            self.check_sensor()
+    
     def check_sensor(self):
-        """Poll the sensor and trigger callback if pressed (rising edge detected)"""
+        """Take one sample and trigger callback on a debounced press (rising edge).
+        A state change counts once the new level has been read SENSOR_DEBOUNCE_SAMPLES times in a row.
+        """
         if not self.available:
             return
         
         try:
-            current_state = GPIO.input(SENSOR_PIN)
+            current_state = self.gpio.input(SENSOR_PIN)
+            if current_state != self.raw_state:
+                self.raw_state = current_state
+                self.stable_samples = 1
+            else:
+                self.stable_samples += 1
+            
+            if self.stable_samples != SENSOR_DEBOUNCE_SAMPLES or current_state == self.last_state:
+                return
             
             # Log state changes in debug mode
-            if self.debug and current_state != self.last_state:
+            if self.debug:
                 self.state_change_count += 1
-                print(f"[DEBUG] Sensor state change #{self.state_change_count}: {self.last_state} -> {current_state}")
+                log.debug(f"Sensor state change #{self.state_change_count}: {self.last_state} -> {current_state}")
             
             # Detect rising edge (0 -> 1) - sensor goes HIGH when touched
-            if current_state == 1 and self.last_state == 0:
-                print("\n[INFO] Refresh button pressed!")
+            if current_state == 1:
+                self.press_count += 1
+                log.info("Refresh button pressed!")
                 if self.callback:
                     self.callback()
             
             # Also detect falling edge (1 -> 0) in case sensor is active-low
-            elif current_state == 0 and self.last_state == 1 and self.debug:
-                print("[DEBUG] Sensor falling edge detected (active-low test)")
+            elif self.debug:
+                log.debug("Sensor falling edge detected (active-low test)")
             
             self.last_state = current_state
         except Exception as e:
-            print(f"[ERROR] Error reading capacitive sensor: {e}")
+            log.error(f"Error reading capacitive sensor: {e}")
             self.available = False
     
     def cleanup(self):
-        """Clean up GPIO resources"""
+        """Stop the sampling thread and clean up GPIO resources"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
         if self.available:
             try:
                 # Don't call GPIO.cleanup() here as it conflicts with TM1637
                 # Just let the system clean up when the program exits
                 pass
             except Exception as e:
-                print(f"[ERROR] Error cleaning up GPIO: {e}")
+                log.error(f"Error cleaning up GPIO: {e}")
+
+# Segment patterns for the digits 0-9 (bit 0 = segment A ... bit 6 = segment G)
+_DIGIT_SEGMENTS = bytes((0x3F, 0x06, 0x5B, 0x4F, 0x66, 0x6D, 0x7D, 0x07, 0x7F, 0x6F))
+# The MSB of the second digit drives the colon
+SEGMENT_COLON = 0x80
+FRAME_DASHES = bytes((0x40, 0x40, 0x40, 0x40))
+FRAME_BLANK = bytes(4)
+
+
+def encode_time_frame(time_obj, colon=True):
+    """Return the 4 segment bytes showing time_obj as H:MM / HH:MM, without a leading zero."""
+    h0, h1 = divmod(time_obj.hour, 10)
+    m0, m1 = divmod(time_obj.minute, 10)
+    return bytes((
+        _DIGIT_SEGMENTS[h0] if h0 else 0,
+        _DIGIT_SEGMENTS[h1] | (SEGMENT_COLON if colon else 0),
+        _DIGIT_SEGMENTS[m0],
+        _DIGIT_SEGMENTS[m1],
+    ))
+
+
+class TM1637Backend:
+    """Display backend driving a real TM1637 module through raspberrypi-tm1637.
+    Backends take whole segment frames; fake_hardware.FakeTM1637 implements the same interface.
+    """
+    def __init__(self, clk, dio, brightness=DAY_BRIGHTNESS):
+        self.tm = TM1637(clk=clk, dio=dio)
+        self.tm.brightness(brightness)  # 0-7 brightness levels
+    
+    def write(self, segments):
+        self.tm.write(segments)
+    
+    def set_brightness(self, level):
+        self.tm.brightness(level)
+
 
 class TM1637DisplayManager:
-    """Manages two TM1637 4-digit 7-segment displays"""
-    def __init__(self):
-        self.display1 = None
-        self.display2 = None
-        self.available = TM1637_AVAILABLE
+    """Manages one TM1637 4-digit 7-segment display per display subscription.
+    The last frame written to each display is kept, and a display is only written when its
+    frame changes, so the once-per-second render costs no GPIO traffic most of the time.
+    backends defaults to a TM1637Backend per display; fakes can be passed in for testing.
+    """
+    def __init__(self, backends=None):
+        self.backends = []
+        self.available = TM1637_AVAILABLE or backends is not None
         self.current_brightness = DAY_BRIGHTNESS
-        print(f"[INFO] TM1637_AVAILABLE: {TM1637_AVAILABLE}")
+        self.frames = []
+        log.info(f"TM1637_AVAILABLE: {TM1637_AVAILABLE}")
         
-        if self.available:
+        if backends is not None:
+            self.backends = list(backends)
+            for backend in self.backends:
+                backend.set_brightness(DAY_BRIGHTNESS)
+        elif self.available:
             try:
-                self.display1 = TM1637(clk=DISPLAY1_CLK, dio=DISPLAY1_DIO)
-                self.display2 = TM1637(clk=DISPLAY2_CLK, dio=DISPLAY2_DIO)
-                self.display1.brightness(DAY_BRIGHTNESS)  # 0-7 brightness levels
-                self.display2.brightness(DAY_BRIGHTNESS)
-                print("[INFO] TM1637 displays initialized on pins (CLK/DIO): ({}/{}), ({}/{}).".format(
-                    DISPLAY1_CLK, DISPLAY1_DIO, DISPLAY2_CLK, DISPLAY2_DIO))
+                for display in DISPLAYS:
+                    self.backends.append(TM1637Backend(display.clk, display.dio))
+                log.info("TM1637 displays initialized on pins (CLK/DIO): {}.".format(
+                    ", ".join(f"({display.clk}/{display.dio})" for display in DISPLAYS)))
                 if ENABLE_SUNSET_DIMMING and ASTRAL_AVAILABLE:
                     sunset = get_sunset_time()
                     if sunset:
-                        print(f"[INFO] Sunset dimming enabled. Sunset time: {sunset.strftime('%H:%M')} (day brightness: {DAY_BRIGHTNESS}, night brightness: {NIGHT_BRIGHTNESS})")
+                        log.info(f"Sunset dimming enabled. Sunset time: {sunset.strftime('%H:%M')} (day brightness: {DAY_BRIGHTNESS}, night brightness: {NIGHT_BRIGHTNESS})")
             except Exception as e:
-                print(f"[ERROR] Failed to initialize displays: {e}")
+                log.error(f"Failed to initialize displays: {e}")
                 self.available = False
     
-    def update_brightness_for_time(self):
-        """Update display brightness based on current time relative to sunset.
+    def update_brightness_for_time(self, timestamp=None):
+        """Set the display brightness scheduled for timestamp (default now) by sunset dimming.
         Returns True if brightness was changed, False otherwise.
         """
-        print(f"[DEBUG] update_brightness_for_time called: available={self.available}, ENABLE_SUNSET_DIMMING={ENABLE_SUNSET_DIMMING}, ASTRAL_AVAILABLE={ASTRAL_AVAILABLE}")
         if not self.available or not ENABLE_SUNSET_DIMMING or not ASTRAL_AVAILABLE:
-            print(f"[DEBUG] Skipping brightness update (available={self.available}, dimming_enabled={ENABLE_SUNSET_DIMMING}, astral_available={ASTRAL_AVAILABLE})")
             return False
         
         try:
-            now = datetime.now(LOCAL_TZ)
-            
-            # Get sunrise and sunset for today
-            sunrise_today = get_sunrise_time(now)
-            sunset_today = get_sunset_time(now)
-            
-            if sunrise_today is None or sunset_today is None:
-                print(f"[DEBUG] Sunrise/sunset calculation returned None")
-                return False
-            
-            # Determine if it's night or day
-            is_night = False
-            
-            if now >= sunset_today:
-                # After today's sunset - it's night
-                is_night = True
-                print(f"[DEBUG] After sunset: {sunset_today.strftime('%H:%M:%S')}")
-            elif now < sunrise_today:
-                # Before today's sunrise - still night from yesterday
-                is_night = True
-                print(f"[DEBUG] Before sunrise: {sunrise_today.strftime('%H:%M:%S')}, still night from yesterday")
-            else:
-                # Between sunrise and sunset - it's day
-                print(f"[DEBUG] Between sunrise ({sunrise_today.strftime('%H:%M:%S')}) and sunset ({sunset_today.strftime('%H:%M:%S')})")
-            
-            # Determine target brightness
-            target_brightness = NIGHT_BRIGHTNESS if is_night else DAY_BRIGHTNESS
-            
-            # Debug output
-            print(f"[DEBUG] Brightness check: now={now.strftime('%H:%M:%S')}, is_night={is_night}, target={target_brightness}, current={self.current_brightness}")
+            if timestamp is None:
+                timestamp = clock_time()
+            target_brightness = get_brightness_at(timestamp)
             
             # Update brightness if it changed
-            if target_brightness != self.current_brightness:
-                self.current_brightness = target_brightness
-                self.display1.brightness(target_brightness)
-                self.display2.brightness(target_brightness)
-                time_str = now.strftime('%H:%M:%S')
-                state = "night" if target_brightness == NIGHT_BRIGHTNESS else "day"
-                print(f"[INFO] [{time_str}] Brightness updated to {target_brightness} ({state} mode)")
+            if self.set_brightness(target_brightness):
+                if target_brightness == NIGHT_BRIGHTNESS:
+                    state = "night mode"
+                elif target_brightness == DAY_BRIGHTNESS:
+                    state = "day mode"
+                else:
+                    state = "ramping"
+                log.info(f"Brightness updated to {target_brightness} ({state})")
                 return True
             return False
         except Exception as e:
-            print(f"[ERROR] Failed to update brightness: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"Failed to update brightness: {e}")
             return False
     
-    def show_arrivals(self, arrival1=None, arrival2=None):
-        """Display arrival times on the two displays.
-        arrival1, arrival2: arrival dicts with 'time' and 'route_id' keys, or None if no bus.
+    def set_brightness(self, level):
+        """Set every display to brightness level. Returns True if it changed."""
+        if not self.available or level == self.current_brightness:
+            return False
+        self.current_brightness = level
+        try:
+            for backend in self.backends:
+                backend.set_brightness(level)
+        except Exception as e:
+            log.error(f"Failed to update displays: {e}")
+        return True
+    
+    def show_arrivals(self, arrivals):
+        """Display arrival times, one per display.
+        arrivals: list in DISPLAYS order of arrival dicts with 'time' and 'route_id' keys, or None if no bus.
+        Scheduled (not live) arrivals are shown without the colon.
         """
         if not self.available:
             return
         
         try:
-            # Display 1: Show first arrival time as HHMM
-            if arrival1:
-                local_time = arrival1["time"].astimezone(LOCAL_TZ)
-                time_obj = local_time.time()
-                self.display1.time(time_obj, colon=True, leading_zero=False)
-            else:
-                self.display1.show("----")
-            
-            # Display 2: Show second arrival time as HHMM
-            if arrival2:
-                local_time = arrival2["time"].astimezone(LOCAL_TZ)
-                time_obj = local_time.time()
-                self.display2.time(time_obj, colon=True, leading_zero=False)
-            else:
-                self.display2.show("----")
+            frames = []
+            for arrival in arrivals:
+                # Show the arrival time as HHMM
+                if arrival:
+                    local_time = arrival["time"].astimezone(LOCAL_TZ)
+                    frames.append(encode_time_frame(local_time.time(), colon=not arrival.get("scheduled")))
+                else:
+                    frames.append(FRAME_DASHES)
+            self.show_frames(frames)
         except Exception as e:
-            print(f"[ERROR] Failed to update displays: {e}")
-            import traceback
-            traceback.print_exc()
-
-
-def fetch_bus_arrivals(debug=False):
-    """
-    Fetch and parse bus arrival times for the specified stop.
-    Returns a list of tuples (arrival_time, route_id, trip_id).
-    """
-    global _API_SESSION_FAILURE_COUNT
+            log.exception(f"Failed to update displays: {e}")
     
-    max_retries = 3
-    retry_delay = 1  # Start with 1 second delay
+    def show_frames(self, frames):
+        """Write each frame (4 segment bytes) to its display if it differs from what is shown."""
+        if len(self.frames) != len(self.backends):
+            self.frames = [None] * len(self.backends)
+        for i, (backend, frame) in enumerate(zip(self.backends, frames)):
+            if frame == self.frames[i]:
+                continue
+            # Forget the frame first so a failed write is retried on the next render
+            self.frames[i] = None
+            backend.write(frame)
+            self.frames[i] = frame
     
-    for attempt in range(max_retries):
+    def sleep(self, arrivals=None):
+        """Blank the displays for sleep mode, or with SLEEP_DISPLAY = dim show arrivals at the lowest brightness."""
+        if not self.available:
+            return
+        
         try:
-            # Get reusable API session
-            session = get_api_session()
-            
-            # Add User-Agent header (required by many servers)
+            if SLEEP_DISPLAY == "dim" and arrivals:
+                for backend in self.backends:
+                    backend.set_brightness(0)
+                self.show_arrivals(arrivals)
+            else:
+                self.show_frames([FRAME_BLANK] * len(self.backends))
+        except Exception as e:
+            log.error(f"Failed to update displays: {e}")
+    
+    def wake(self):
+        """Restore the brightness in use before sleep mode."""
+        if not self.available:
+            return
+        
+        try:
+            for backend in self.backends:
+                backend.set_brightness(self.current_brightness)
+        except Exception as e:
+            log.error(f"Failed to update displays: {e}")
+
+
+# A realtime prediction for one trip at one of the monitored stops
+StopTimePrediction = namedtuple("StopTimePrediction", ["trip_id", "route_id", "stop_id", "timestamp"])
+
+
+def _read_varint(data, pos):
+    """Decode a protobuf varint at data[pos]. Returns (value, position after the varint)."""
+    value = data[pos]
+    pos += 1
+    if value < 0x80:
+        return value, pos
+    value &= 0x7f
+    shift = 7
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _encode_varint(value):
+    """Encode a non-negative integer as a protobuf varint."""
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _skip_field(data, pos, wire_type):
+    """Return the position after a non-length-delimited field value starting at data[pos]."""
+    if wire_type == 0:
+        while data[pos] & 0x80:
+            pos += 1
+        return pos + 1
+    if wire_type == 1:
+        return pos + 8
+    if wire_type == 5:
+        return pos + 4
+    raise ValueError(f"unsupported protobuf wire type {wire_type}")
+
+
+def _iter_fields(data, pos, end):
+    """Yield (field_number, wire_type, value, value_end) for each field of the message in data[pos:end].
+    For length-delimited fields value is the start offset of the payload, otherwise the decoded number.
+    """
+    while pos < end:
+        # Keys and lengths are almost always a single byte, so decode that case inline
+        key = data[pos]
+        if key < 0x80:
+            pos += 1
+        else:
+            key, pos = _read_varint(data, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+            yield key >> 3, wire_type, value, pos
+        elif wire_type == 2:
+            length = data[pos]
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = _read_varint(data, pos)
+            if pos + length > end:
+                raise ValueError("truncated protobuf field")
+            yield key >> 3, wire_type, pos, pos + length
+            pos += length
+        elif wire_type == 1:
+            yield key >> 3, wire_type, None, pos + 8
+            pos += 8
+        elif wire_type == 5:
+            yield key >> 3, wire_type, None, pos + 4
+            pos += 4
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire_type}")
+
+
+def _scan_stop_time_event_time(data, pos, end):
+    """Return the time field of a StopTimeEvent (0 if absent, as with the protobuf bindings)."""
+    for field, wire_type, value, _ in _iter_fields(data, pos, end):
+        if field == 2 and wire_type == 0:
+            return value
+    return 0
+
+
+def _scan_trip_update(data, pos, end, stop_ids, route_ids, needles, predictions):
+    """Collect predictions at stop_ids from a TripUpdate, skipping stop_time_updates for other stops."""
+    trip_id = route_id = ""
+    trip_seen = False
+    matches = []
+    # Position of the next possible monitored stop ID; stop_time_updates before it are skipped undecoded
+    hit = min((found for found in (data.find(needle, pos, end) for needle in needles) if found != -1), default=end)
+    
+    while pos < end:
+        key = data[pos]
+        if key < 0x80:
+            pos += 1
+        else:
+            key, pos = _read_varint(data, pos)
+        wire_type = key & 7
+        if wire_type != 2:
+            pos = _skip_field(data, pos, wire_type)
+            continue
+        length = data[pos]
+        if length < 0x80:
+            pos += 1
+        else:
+            length, pos = _read_varint(data, pos)
+        value, pos = pos, pos + length
+        if pos > end:
+            raise ValueError("truncated protobuf field")
+        field = key >> 3
+        
+        if field == 2:
+            # StopTimeUpdate: only decode it if it can contain one of the monitored stop IDs
+            if hit >= pos:
+                if hit == end and trip_seen:
+                    break  # No monitored stop in the rest of this trip update
+                continue
+            stop_id = None
+            arrival = departure = None
+            for stu_field, stu_wire_type, stu_value, stu_value_end in _iter_fields(data, value, pos):
+                if stu_wire_type != 2:
+                    continue
+                if stu_field == 4:
+                    stop_id = data[stu_value:stu_value_end].decode('utf-8')
+                elif stu_field == 2:
+                    arrival = _scan_stop_time_event_time(data, stu_value, stu_value_end)
+                elif stu_field == 3:
+                    departure = _scan_stop_time_event_time(data, stu_value, stu_value_end)
+            if stop_id in stop_ids and (arrival is not None or departure is not None):
+                # Prefer arrival over departure
+                matches.append((stop_id, arrival if arrival is not None else departure))
+            hit = min((found for found in (data.find(needle, pos, end) for needle in needles) if found != -1), default=end)
+        elif field == 1:
+            # TripDescriptor: trip_id = 1, route_id = 5
+            trip_seen = True
+            for trip_field, trip_wire_type, trip_value, trip_value_end in _iter_fields(data, value, pos):
+                if trip_wire_type == 2 and trip_field == 1:
+                    trip_id = data[trip_value:trip_value_end].decode('utf-8')
+                elif trip_wire_type == 2 and trip_field == 5:
+                    route_id = data[trip_value:trip_value_end].decode('utf-8')
+            if route_ids is not None and route_id not in route_ids:
+                return
+    
+    if route_ids is not None and route_id not in route_ids:
+        return
+    for stop_id, timestamp in matches:
+        predictions.append(StopTimePrediction(trip_id, route_id, stop_id, timestamp))
+
+
+def scan_trip_updates(data, stop_ids, route_ids=None):
+    """
+    Extract predictions for stop_ids from a serialized GTFS-realtime FeedMessage
+    by scanning the protobuf wire format directly.
+    Entities whose bytes never mention a monitored stop ID are skipped without being
+    decoded, trips on routes outside route_ids (if given) are dropped as soon as their
+    TripDescriptor has been read, and only matching stop_time_updates are decoded.
+    Returns (header timestamp, entity count, list of StopTimePrediction).
+    Raises ValueError or IndexError if the data is not a valid FeedMessage.
+    """
+    needles = [b'\x22' + _encode_varint(len(stop_id.encode('utf-8'))) + stop_id.encode('utf-8') for stop_id in stop_ids]
+    header_timestamp = 0
+    entity_count = 0
+    predictions = []
+    
+    for field, wire_type, value, value_end in _iter_fields(data, 0, len(data)):
+        if wire_type != 2:
+            continue
+        if field == 2:
+            # FeedEntity: trip_update = 3
+            entity_count += 1
+            if not any(data.find(needle, value, value_end) != -1 for needle in needles):
+                continue
+            for entity_field, entity_wire_type, entity_value, entity_value_end in _iter_fields(data, value, value_end):
+                if entity_field == 3 and entity_wire_type == 2:
+                    _scan_trip_update(data, entity_value, entity_value_end, stop_ids, route_ids, needles, predictions)
+        elif field == 1:
+            # FeedHeader: timestamp = 3
+            for header_field, header_wire_type, header_value, _ in _iter_fields(data, value, value_end):
+                if header_field == 3 and header_wire_type == 0:
+                    header_timestamp = header_value
+    
+    return header_timestamp, entity_count, predictions
+
+
+def parse_trip_updates(data, stop_ids, route_ids=None):
+    """
+    Extract predictions for stop_ids from a serialized GTFS-realtime FeedMessage
+    using the full protobuf bindings. Same result as scan_trip_updates(); used as a
+    fallback if the wire-format scanner cannot handle the feed, so the bindings are only
+    imported when it is needed.
+    """
+    from google.transit import gtfs_realtime_pb2
+    
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(data)
+    
+    predictions = []
+    for entity in feed.entity:
+        if entity.HasField("trip_update"):
+            trip_update = entity.trip_update
+            route_id = trip_update.trip.route_id
+            if route_ids is not None and route_id not in route_ids:
+                continue
+            for stop_time_update in trip_update.stop_time_update:
+                if stop_time_update.stop_id in stop_ids:
+                    # Prefer arrival over departure
+                    if stop_time_update.HasField("arrival"):
+                        timestamp = stop_time_update.arrival.time
+                    elif stop_time_update.HasField("departure"):
+                        timestamp = stop_time_update.departure.time
+                    else:
+                        continue
+                    predictions.append(StopTimePrediction(trip_update.trip.trip_id, route_id, stop_time_update.stop_id, timestamp))
+    
+    return feed.header.timestamp, len(feed.entity), predictions
+
+
+def read_feed_header_timestamp(data):
+    """Return FeedMessage.header.timestamp from a serialized feed without decoding its entities (0 if absent)."""
+    for field, wire_type, value, value_end in _iter_fields(data, 0, len(data)):
+        if field == 1 and wire_type == 2:
+            for header_field, header_wire_type, header_value, _ in _iter_fields(data, value, value_end):
+                if header_field == 3 and header_wire_type == 0:
+                    return header_value
+            return 0
+    return 0
+
+
+def extract_stop_predictions(data, stop_ids=None, route_ids=None):
+    """Extract predictions for the monitored stops and routes (or stop_ids and route_ids) from a
+    realtime feed, using the wire-format scanner and falling back to the protobuf bindings."""
+    stop_ids = STOP_IDS if stop_ids is None else stop_ids
+    route_ids = DESIRED_ROUTES if route_ids is None else route_ids
+    try:
+        return scan_trip_updates(data, stop_ids, route_ids)
+    except (ValueError, IndexError, UnicodeDecodeError) as e:
+        log.warning(f"Fast feed scan failed ({e}), falling back to full protobuf parse.")
+        return parse_trip_updates(data, stop_ids, route_ids)
+
+
+# Last processed realtime feed, used to skip re-processing a feed that has not changed.
+# The dictionary is never changed in place, only replaced as a whole, so a fetch running in a worker
+# thread keeps a consistent snapshot while the push subscriber resets the cache on the loop.
+_REALTIME_FEED_CACHE = {
+    "etag": "",
+    "last_modified": "",
+    "header_timestamp": 0,
+    "entity_count": 0,
+    "predictions": None,
+    "scope": None,  # (stop_ids, route_ids) the predictions were extracted for
+}
+
+
+def reset_realtime_feed_cache(header_timestamp=0):
+    """Forget the last processed feed, so the next fetch parses its feed afresh.
+    header_timestamp is the timestamp of the newest feed seen some other way (pushed predictions).
+    """
+    global _REALTIME_FEED_CACHE
+    _REALTIME_FEED_CACHE = {"etag": "", "last_modified": "", "header_timestamp": header_timestamp,
+                            "entity_count": 0, "predictions": None, "scope": None}
+
+# How often each realtime fetch short-circuit fired
+REALTIME_FEED_STATS = {
+    "requests": 0,          # Successful HTTP responses
+    "not_modified": 0,      # 304 responses, body skipped entirely
+    "unchanged_header": 0,  # Same header.timestamp as the last feed, previous predictions reused
+    "parsed": 0,            # Feeds that were actually scanned
+}
+
+
+# Fetch, parse and static GTFS metrics, served by the metrics endpoint and written to STATUS_FILE
+METRICS = MetricsRegistry()
+FETCH_SECONDS = METRICS.histogram("bustime_fetch_seconds", "Realtime feed HTTP request latency.",
+                                  (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+FETCH_BYTES = METRICS.counter("bustime_fetch_bytes_total", "Realtime feed bytes downloaded.")
+FETCH_ERRORS = METRICS.counter("bustime_fetch_errors_total", "Realtime fetches that failed (per attempt).")
+PARSE_SECONDS = METRICS.histogram("bustime_parse_seconds", "Realtime feed parse time.",
+                                  (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+FEED_ENTITIES = METRICS.gauge("bustime_feed_entities", "Entities in the last parsed realtime feed.")
+MATCHED_STOP_TIME_UPDATES = METRICS.gauge("bustime_matched_stop_time_updates",
+                                          "Stop time updates for the monitored stops and routes in the last parsed feed.")
+SESSION_RESETS = METRICS.counter("bustime_api_session_resets_total", "API sessions reset after consecutive failures.")
+for _name, _help in (("requests", "Realtime feed responses."),
+                     ("not_modified", "Realtime feed 304 Not Modified responses."),
+                     ("unchanged_header", "Realtime feeds skipped because header.timestamp was unchanged."),
+                     ("parsed", "Realtime feeds parsed.")):
+    METRICS.counter(f"bustime_feed_{_name}_total", _help, fn=lambda key=_name: REALTIME_FEED_STATS[key])
+METRICS.gauge("bustime_feed_age_seconds", "Age of the last realtime feed (from header.timestamp).",
+              fn=lambda: clock_time() - _REALTIME_FEED_CACHE["header_timestamp"] if _REALTIME_FEED_CACHE["header_timestamp"] else None)
+STATIC_LOAD_SECONDS = METRICS.histogram("bustime_static_load_seconds", "Static GTFS download (or revalidation) and index build time.",
+                                        (0.5, 1, 2.5, 5, 10, 30, 60, 120))
+CONFIG_RELOAD_SECONDS = METRICS.histogram("bustime_config_reload_seconds", "Time to apply a changed config.txt.",
+                                          (0.001, 0.01, 0.1, 0.5, 1, 2.5, 5, 10))
+METRICS.gauge("bustime_static_cache_age_seconds", "Time since the static GTFS data was last downloaded or revalidated.",
+              fn=lambda: clock_time() - _STATIC_GTFS_DATA_TIMESTAMP if _STATIC_GTFS_DATA_TIMESTAMP else None)
+METRICS.gauge("bustime_static_trips", "Trips serving the monitored stops in the static GTFS index.",
+              fn=lambda: len(_STATIC_GTFS_DATA.trips) if _STATIC_GTFS_DATA is not None else 0)
+
+
+def subscription_matches(subscription, stop_id, route_id, headsign):
+    """Return True if an arrival at stop_id on route_id with headsign belongs on the subscribed display."""
+    return (subscription.stop_id == stop_id and subscription.route_id == route_id
+            and (not subscription.headsign or subscription.headsign == headsign))
+
+
+def select_display_arrivals(arrivals):
+    """Return the next arrival (or None) for each display, in DISPLAYS order.
+    arrivals must be sorted by time; it is scanned once for all displays.
+    """
+    selected = [None] * len(DISPLAYS)
+    remaining = len(DISPLAYS)
+    for arrival in arrivals:
+        for i, display in enumerate(DISPLAYS):
+            if selected[i] is None and subscription_matches(display, arrival["stop_id"], arrival["route_id"], arrival["headsign"]):
+                selected[i] = arrival
+                remaining -= 1
+        if not remaining:
+            break
+    return selected
+
+
+def arrivals_from_predictions(predictions, debug=False):
+    """Turn predictions (StopTimePrediction) into the future arrivals wanted by the displays,
+    looking up each trip's headsign in the stop-scoped trip index.
+    Returns arrival dicts sorted by time, in the format fetch_bus_arrivals() returns.
+    """
+    # Collect arrival times for our stop
+    arrivals = []
+    matched_stop_count = len(predictions)
+
+    stop_trips = get_stop_trip_index()
+
+    for prediction in predictions:
+        # Look up the headsign in the stop-scoped trip index and keep the arrival
+        # if any display subscribed to this stop wants it
+        stop_trip = stop_trips.get(prediction.trip_id)
+        headsign = stop_trip.headsign if stop_trip else ""
+        if not any(subscription_matches(subscription, prediction.stop_id, prediction.route_id, headsign)
+                   for subscription in SUBSCRIPTIONS_BY_STOP.get(prediction.stop_id, ())):
+            continue
+
+        # Convert Unix timestamp to datetime (UTC-aware)
+        arrival_time = datetime.fromtimestamp(prediction.timestamp, tz=timezone.utc)
+
+        arrivals.append({
+            "time": arrival_time,
+            "route_id": prediction.route_id,
+            "stop_id": prediction.stop_id,
+            "trip_id": prediction.trip_id,
+            "headsign": headsign,
+            "timestamp": prediction.timestamp,
+            "scheduled": False
+        })
+
+    if debug:
+        log.debug(f"Matched stops for {', '.join(sorted(STOP_IDS))}: {matched_stop_count}, Arrivals found: {len(arrivals)}")
+        for arr in arrivals[:3]:  # Show first 3 arrivals
+            local_time = arr["time"].astimezone(LOCAL_TZ)
+            headsign_str = f", headsign: {arr['headsign']}" if arr['headsign'] else ""
+            log.debug(f"  Route {arr['route_id']}: {local_time} (UTC: {arr['time']}, timestamp: {arr['timestamp']}{headsign_str})")
+
+    # Sort by arrival time
+    arrivals.sort(key=lambda x: x["timestamp"])
+    
+    # Filter future arrivals only - use timestamp comparison (faster)
+    # Route and headsign filtering already happened per entity above
+    now_timestamp = clock_now(timezone.utc).timestamp()
+    future_arrivals = [a for a in arrivals if a["timestamp"] > now_timestamp]
+    
+    if debug and len(arrivals) > 0:
+        now = clock_now(timezone.utc)
+        now_local = now.astimezone(LOCAL_TZ)
+        log.debug(f"Current time - UTC: {now}, Local: {now_local}")
+        log.debug(f"Future arrivals (desired routes with headsign filtering): {len(future_arrivals)}")
+    
+    return future_arrivals
+
+
+def fetch_bus_arrivals(debug=False, archive=None, publisher=None):
+    """
+    Fetch and parse bus arrival times for the specified stop.
+    Returns a list of arrival dicts (time, route_id, stop_id, trip_id, headsign, timestamp, scheduled),
+    or None if the realtime feed could not be fetched or parsed.
+    With archive (a PredictionArchive), each newly parsed feed's predictions are appended to it.
+    With publisher (a PushPublisher), predictions are also extracted for its subscribers' stops
+    and routes; they are left in _REALTIME_FEED_CACHE for it to send.
+    """
+    global _API_SESSION_FAILURE_COUNT, _REALTIME_FEED_CACHE
+    import requests  # Deferred import, see new_api_session()
+    
+    max_retries = 3
+    retry_delay = 1  # Start with 1 second delay
+    
+    for attempt in range(max_retries):
+        try:
+            # Get reusable API session
+            session = get_api_session()
+            
+            # Add User-Agent header (required by many servers)
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
+            # Let the server skip the body if the feed has not changed since the last fetch
+            # (and the cached predictions cover the stops and routes wanted now)
+            feed_cache = _REALTIME_FEED_CACHE  # Read once: the cache may be replaced meanwhile
+            scope = (publisher.stop_ids, publisher.route_ids) if publisher is not None else (STOP_IDS, DESIRED_ROUTES)
+            reusable = feed_cache["predictions"] is not None and feed_cache["scope"] == scope
+            if reusable:
+                if feed_cache["etag"]:
+                    headers['If-None-Match'] = feed_cache["etag"]
+                if feed_cache["last_modified"]:
+                    headers['If-Modified-Since'] = feed_cache["last_modified"]
+            
             # Download the protobuf file
+            request_start = time.perf_counter()
             response = session.get(API_URL, headers=headers, timeout=10)
+            FETCH_SECONDS.observe(time.perf_counter() - request_start)
+            FETCH_BYTES.inc(len(response.content))
             response.raise_for_status()
-
-            # Parse the protobuf message
-            feed = gtfs_realtime_pb2.FeedMessage()
-            feed.ParseFromString(response.content)
-
-            # Collect arrival times for our stop
-            arrivals = []
-            total_entities = len(feed.entity)
-            matched_stop_count = 0
-
-            for entity in feed.entity:
-                if entity.HasField("trip_update"):
-                    trip_update = entity.trip_update
-                    
-                    # Check each stop time update
-                    for stop_time_update in trip_update.stop_time_update:
-                        if debug:
-                            print(f"  Stop ID in data: '{stop_time_update.stop_id}' (type: {type(stop_time_update.stop_id).__name__})")
-                        
-                        if str(stop_time_update.stop_id) == STOP_ID:
-                            matched_stop_count += 1
-                            # Get arrival time (prefer arrival over departure)
-                            if stop_time_update.HasField("arrival"):
-                                timestamp = stop_time_update.arrival.time
-                            elif stop_time_update.HasField("departure"):
-                                timestamp = stop_time_update.departure.time
-                            else:
-                                continue
-
-                            # Convert Unix timestamp to datetime (UTC-aware)
-                            arrival_time = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-                            route_id = trip_update.trip.route_id
-                            trip_id = trip_update.trip.trip_id
-                            
-                            # Get headsign from static GTFS data using trip_id
-                            headsign = get_trip_headsign(trip_id)
-
-                            arrivals.append({
-                                "time": arrival_time,
-                                "route_id": route_id,
-                                "trip_id": trip_id,
-                                "headsign": headsign,
-                                "timestamp": timestamp
-                            })
-
-            if debug:
-                print(f"Total entities: {total_entities}, Matched stops for {STOP_ID}: {matched_stop_count}, Arrivals found: {len(arrivals)}")
-                for arr in arrivals[:3]:  # Show first 3 arrivals
-                    local_time = arr["time"].astimezone(LOCAL_TZ)
-                    headsign_str = f", headsign: {arr['headsign']}" if arr['headsign'] else ""
-                    print(f"  Route {arr['route_id']}: {local_time} (UTC: {arr['time']}, timestamp: {arr['timestamp']}{headsign_str})")
-
-            # Sort by arrival time
-            arrivals.sort(key=lambda x: x["timestamp"])
-            
-            # Filter future arrivals only - use timestamp comparison (faster)
-            now_timestamp = datetime.now(timezone.utc).timestamp()
-            future_arrivals = [a for a in arrivals if a["timestamp"] > now_timestamp]
+            REALTIME_FEED_STATS["requests"] += 1
             
-            # Filter to only include arrivals for the desired routes and headsigns
-            filtered_arrivals = []
-            for a in future_arrivals:
-                if a["route_id"] in DESIRED_ROUTES:
-                    # Check if headsign filtering is required for this route
-                    desired_headsign = ROUTE_HEADSIGNS.get(a["route_id"])
-                    if not desired_headsign or a["headsign"] == desired_headsign:
-                        filtered_arrivals.append(a)
+            predictions, entity_count = feed_cache["predictions"], feed_cache["entity_count"]
+            if response.status_code == 304 and reusable:
+                REALTIME_FEED_STATS["not_modified"] += 1
+                if debug:
+                    log.debug("Feed not modified (304), reusing previous predictions.")
+            else:
+                header_timestamp = read_feed_header_timestamp(response.content)
+                if header_timestamp and header_timestamp == feed_cache["header_timestamp"] and reusable:
+                    REALTIME_FEED_STATS["unchanged_header"] += 1
+                    if debug:
+                        log.debug(f"Feed header timestamp unchanged ({header_timestamp}), reusing previous predictions.")
+                    header_timestamp = feed_cache["header_timestamp"]
+                else:
+                    # Extract predictions for our stop without decoding the whole feed
+                    parse_start = time.perf_counter()
+                    header_timestamp, entity_count, predictions = extract_stop_predictions(response.content, *scope)
+                    PARSE_SECONDS.observe(time.perf_counter() - parse_start)
+                    FEED_ENTITIES.set(entity_count)
+                    MATCHED_STOP_TIME_UPDATES.set(len(predictions))
+                    REALTIME_FEED_STATS["parsed"] += 1
+                    if archive is not None:
+                        archived = predictions
+                        if publisher is not None:
+                            archived = [p for p in predictions if p.stop_id in STOP_IDS and p.route_id in DESIRED_ROUTES]
+                        try:
+                            archive.append(clock_time(), header_timestamp, archived)
+                        except (OSError, ValueError) as e:
+                            log.error(f"Failed to archive predictions: {e}")
+                _REALTIME_FEED_CACHE = {
+                    "etag": response.headers.get('ETag', ""),
+                    "last_modified": response.headers.get('Last-Modified', ""),
+                    "header_timestamp": header_timestamp,
+                    "entity_count": entity_count,
+                    "predictions": predictions,
+                    "scope": scope,
+                }
             
-            if debug and len(arrivals) > 0:
-                now = datetime.now(timezone.utc)
-                now_local = now.astimezone(LOCAL_TZ)
-                print(f"Current time - UTC: {now}, Local: {now_local}")
-                print(f"Future arrivals (all routes): {len(future_arrivals)}")
-                print(f"Future arrivals (desired routes with headsign filtering): {len(filtered_arrivals)}")
+            future_arrivals = arrivals_from_predictions(predictions, debug)
+            if debug:
+                log.debug(f"Total entities: {entity_count}")
+                log.debug("Feed requests: {requests}, not modified: {not_modified}, unchanged header: {unchanged_header}, parsed: {parsed}".format(**REALTIME_FEED_STATS))
             
             # Success! Reset failure counter
             _API_SESSION_FAILURE_COUNT = 0
-            return filtered_arrivals
+            return future_arrivals
             
         except requests.exceptions.ConnectionError as e:
             _API_SESSION_FAILURE_COUNT += 1
+            FETCH_ERRORS.inc()
             if attempt < max_retries - 1:
-                print(f"Connection error (attempt {attempt + 1}/{max_retries}): {e}")
-                print(f"Retrying in {retry_delay} seconds...")
+                log.warning(f"Connection error (attempt {attempt + 1}/{max_retries}): {e}. Retrying in {retry_delay} seconds...")
                 time.sleep(retry_delay)
                 retry_delay *= 2  # Exponential backoff
                 continue
             else:
-                print(f"Failed to connect after {max_retries} attempts: {e}")
-                return []
+                log.error(f"Failed to connect after {max_retries} attempts: {e}")
+                return None
         except requests.RequestException as e:
             _API_SESSION_FAILURE_COUNT += 1
-            print(f"Error fetching data from API: {e}")
-            return []
+            FETCH_ERRORS.inc()
+            log.error(f"Error fetching data from API: {e}")
+            return None
         except Exception as e:
             _API_SESSION_FAILURE_COUNT += 1
-            print(f"Error parsing feed: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+            FETCH_ERRORS.inc()
+            log.exception(f"Error parsing feed: {e}")
+            return None
     
-    return []
+    return None
 
 
-def main():
-    """Main entry point with continuous countdown and periodic refresh."""
-    refresh_interval = REFRESH_INTERVAL  # Read from config file
-    last_fetch_time = 0
-    last_brightness_check_time = 0  # Track when we last checked brightness
-    arrivals = []
-    debug_mode = "--debug" in sys.argv
-    display_manager = TM1637DisplayManager()
+# A bus closer than this (seconds) is tracked closely; until then polls wait for it to get there
+POLL_NEAR_WINDOW = 300
+# Inside the window, fraction of the time until the bus arrives to wait before polling again
+ADAPTIVE_REFRESH_FRACTION = 0.5
+# Seconds to wait after the producer's expected publish time before polling
+POLL_ALIGN_MARGIN = 5
+# Shortest producer cadence considered when learning it from header.timestamp deltas (seconds)
+POLL_MIN_CADENCE = 10
+# Number of header.timestamp deltas and staleness samples kept
+POLL_HISTORY_SIZE = 20
+POLL_STALENESS_SAMPLES = 1000
+# How often the scheduler logs its statistics (seconds)
+POLL_REPORT_INTERVAL = 3600
+# Requests of the daily budget that can be saved up while no bus is near, as seconds' worth of it
+POLL_BUDGET_WINDOW = 3600
+
+
+def _percentile(sorted_values, fraction):
+    """Return the value at fraction (0-1) of a sorted list, or 0 if it is empty."""
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class PollScheduler:
+    """Decides when to poll the realtime feed next.
+    While the next live arrival on any display is more than POLL_NEAR_WINDOW away, the next poll
+    is when it enters the window; inside the window the interval is a fraction of the time left,
+    so polls bunch up while a bus approaches. Intervals are clamped to
+    [MIN_REFRESH_INTERVAL, MAX_REFRESH_INTERVAL]; with no live arrivals the longest is used. The poll
+    time is then moved to just after the producer's next expected publish, using the cadence learned
+    from header.timestamp deltas. Request counts and data staleness are tracked for reporting.
     
-    # Set up refresh trigger flag
-    refresh_flag = {"triggered": False}
+    Polls are paid for from a budget that fills at MAX_REQUESTS_PER_DAY per day and holds at most
+    POLL_BUDGET_WINDOW's worth, so the requests saved while no bus is near pay for the bursts
+    while one approaches. It starts, and restarts after service gap sleep, with the first poll plus
+    POLL_NEAR_WINDOW's worth, so the polls while the first bus approaches are never slower than
+    the fixed interval; nothing is saved up during the sleep itself, so a day still stays close to
+    the budget. Manual refreshes are not charged.
+    """
+    def __init__(self, adaptive=True):
+        self.adaptive = adaptive
+        self.next_poll_time = 0
+        self.last_header_timestamp = 0
+        self.header_deltas = deque(maxlen=POLL_HISTORY_SIZE)
+        self.requests = 0
+        self.started_at = clock_time()
+        # Age of the feed when it was fetched, and of the previous feed when it was replaced
+        self.fetch_ages = deque(maxlen=POLL_STALENESS_SAMPLES)
+        self.replaced_ages = deque(maxlen=POLL_STALENESS_SAMPLES)
+        self.budget = self.initial_budget()
+        self.budget_time = self.started_at
     
-    def on_refresh_button():
-        """Callback when refresh button is pressed"""
-        refresh_flag["triggered"] = True
+    @staticmethod
+    def initial_budget():
+        """Return the budget to start polling with: the first poll plus POLL_NEAR_WINDOW's worth."""
+        return 1 + MAX_REQUESTS_PER_DAY / 86400 * POLL_NEAR_WINDOW
     
-    # Initialize capacitive sensor with debug mode
-    sensor_manager = CapacitiveSensorManager(callback=on_refresh_button, debug=debug_mode)
+    def charge(self, now):
+        """Take one request from the budget, after adding what has accrued since the last one."""
+        rate = MAX_REQUESTS_PER_DAY / 86400
+        self.budget = min(rate * POLL_BUDGET_WINDOW, self.budget + (now - self.budget_time) * rate) - 1
+        self.budget_time = now
     
-    try:
+    def resume(self, now):
+        """Resume polling after a pause (service gap sleep) without crediting the budget for it,
+        since the fixed interval would not have polled then either. It restarts with initial_budget(),
+        like a fresh start, so the first bus after the gap is followed as closely as any other.
+        """
+        self.budget = self.initial_budget()
+        self.budget_time = now
+    
+    def earliest_poll(self, now):
+        """Return the earliest time the budget allows the next poll (now if it is unlimited)."""
+        if not self.adaptive or not MAX_REQUESTS_PER_DAY:
+            return now
+        accrued = self.budget + (now - self.budget_time) * MAX_REQUESTS_PER_DAY / 86400
+        return now + max(0, (1 - accrued) * 86400 / MAX_REQUESTS_PER_DAY)
+    
+    def cadence(self):
+        """Return the producer's update interval in seconds, or None until it has been observed.
+        Polls are usually several publishes apart, so each delta is a multiple of the cadence; the
+        estimate is the largest divisor of the smallest delta that all recent deltas are
+        (within 10%) multiples of.
+        """
+        if len(self.header_deltas) < 2:
+            return None
+        smallest = min(self.header_deltas)
+        for divisor in range(1, int(smallest // POLL_MIN_CADENCE) + 1):
+            candidate = smallest / divisor
+            tolerance = max(1, candidate * 0.1)
+            if all(abs(delta - round(delta / candidate) * candidate) <= tolerance for delta in self.header_deltas):
+                return candidate
+        return smallest
+    
+    def due(self, now):
+        return now >= self.next_poll_time
+    
+    def poll_now(self):
+        self.next_poll_time = 0
+    
+    def retry_in(self, now, delay):
+        self.next_poll_time = now + delay
+    
+    def interval_for(self, now, arrivals):
+        """Return the base polling interval for the displayed arrivals."""
+        if not self.adaptive:
+            return REFRESH_INTERVAL
+        live = [a["timestamp"] for a in arrivals if a is not None and not a.get("scheduled")]
+        if not live:
+            return MAX_REFRESH_INTERVAL
+        time_until = min(live) - now
+        if time_until > POLL_NEAR_WINDOW:
+            interval = time_until - POLL_NEAR_WINDOW
+        else:
+            interval = time_until * ADAPTIVE_REFRESH_FRACTION
+        return max(MIN_REFRESH_INTERVAL, min(MAX_REFRESH_INTERVAL, interval))
+    
+    def align(self, now, target):
+        """Move target to the nearest expected publish time (plus margin) that is still in the future.
+        A cadence longer than the interval may only be an artefact of the poll spacing, so polls are
+        left unaligned until faster polling has shown the real cadence.
+        """
+        cadence = self.cadence()
+        if not cadence or not self.last_header_timestamp or cadence > target - now:
+            return target
+        anchor = self.last_header_timestamp + POLL_ALIGN_MARGIN
+        slot = max(round((target - anchor) / cadence), math.floor((now - anchor) / cadence) + 1)
+        return anchor + slot * cadence
+    
+    def record_fetch(self, now, header_timestamp, arrivals, manual=False):
+        """Record a successful fetch and schedule the next poll.
+        arrivals is the per-display selection shown after this fetch; manual fetches are not charged to the budget.
+        """
+        self.requests += 1
+        if not manual:
+            self.charge(now)
+        if header_timestamp:
+            if self.last_header_timestamp:
+                self.replaced_ages.append(max(0, now - self.last_header_timestamp))
+                delta = header_timestamp - self.last_header_timestamp
+                if delta > 0:
+                    self.header_deltas.append(delta)
+            self.fetch_ages.append(max(0, now - header_timestamp))
+            self.last_header_timestamp = header_timestamp
+        
+        interval = self.interval_for(now, arrivals)
+        if self.adaptive:
+            self.next_poll_time = max(self.align(now, now + interval), self.earliest_poll(now))
+        else:
+            self.next_poll_time = now + interval
+        return self.next_poll_time - now
+    
+    def record_failure(self, now, delay, manual=False):
+        """Record a failed fetch and retry after delay seconds (or when the budget allows)."""
+        self.requests += 1
+        if not manual:
+            self.charge(now)
+        self.retry_in(now, max(delay, self.earliest_poll(now) - now))
+    
+    def stats(self):
+        """Return request count and staleness percentiles as a dict."""
+        elapsed = max(1, clock_time() - self.started_at)
+        fetch_ages = sorted(self.fetch_ages)
+        replaced_ages = sorted(self.replaced_ages)
+        return {
+            "uptime": elapsed,
+            "requests": self.requests,
+            "requests_per_day": self.requests * 86400 / elapsed,
+            "cadence": self.cadence(),
+            "fetch_age_p50": _percentile(fetch_ages, 0.5),
+            "fetch_age_p90": _percentile(fetch_ages, 0.9),
+            "fetch_age_max": fetch_ages[-1] if fetch_ages else 0,
+            "replaced_age_p50": _percentile(replaced_ages, 0.5),
+            "replaced_age_p90": _percentile(replaced_ages, 0.9),
+            "replaced_age_max": replaced_ages[-1] if replaced_ages else 0,
+        }
+    
+    def report(self):
+        stats = self.stats()
+        cadence = f"{stats['cadence']:.0f}s" if stats["cadence"] else "unknown"
+        rate = f" ({stats['requests_per_day']:.0f}/day)" if stats["uptime"] >= POLL_REPORT_INTERVAL else ""
+        log.info(f"Realtime polling: {stats['requests']} requests{rate}, producer cadence {cadence}")
+        log.info(f"  Data age at fetch p50/p90/max: {stats['fetch_age_p50']:.0f}/{stats['fetch_age_p90']:.0f}/{stats['fetch_age_max']:.0f}s, "
+                 f"before replacement: {stats['replaced_age_p50']:.0f}/{stats['replaced_age_p90']:.0f}/{stats['replaced_age_max']:.0f}s")
+
+
+# How often the static GTFS task checks whether the static data has expired (seconds)
+STATIC_GTFS_CHECK_INTERVAL = 60
+# How often config.txt is checked for changes, and how long it must stay unchanged before it is
+# reloaded so a file that is still being saved is not read half-written (seconds; 0 = never reload)
+CONFIG_CHECK_INTERVAL = 5
+CONFIG_SETTLE_TIME = 1
+# Longest the brightness task sleeps between checks of the wall clock (seconds)
+BRIGHTNESS_MAX_SLEEP = 3600
+# How often the loop lag monitor samples the event loop (seconds), and samples kept
+LOOP_LAG_INTERVAL = 1.0
+LOOP_LAG_SAMPLES = 3600
+# How often the daemon status served at /status is refreshed (seconds)
+STATUS_PUBLISH_INTERVAL = 5
+
+# Longest Cache-Control max-age of JSON API responses (seconds); shorter when the next poll is sooner
+API_MAX_AGE = 60
+
+# The arrivals on display are saved here every ARRIVALS_SNAPSHOT_INTERVAL seconds and on shutdown,
+# so after a restart or power blip they are shown again before the first fetch completes
+ARRIVALS_SNAPSHOT_FILE = STATIC_GTFS_CACHE_DIR / "arrivals.json"
+ARRIVALS_SNAPSHOT_INTERVAL = 300
+# Snapshots saved longer ago than this are not shown (seconds)
+ARRIVALS_SNAPSHOT_MAX_AGE = 3600
+
+# Pushed predictions (PUSH_MODE): how often a healthy publisher sends a heartbeat, how long a
+# subscriber trusts a silent publisher before fetching the feed itself, and how often it reconnects
+# (seconds); a subscriber that falls further behind than PUSH_MAX_BUFFER unsent bytes is dropped
+PUSH_HEARTBEAT_INTERVAL = 30
+PUSH_TIMEOUT = 90
+PUSH_RECONNECT_INTERVAL = 30
+PUSH_MAX_BUFFER = 256 * 1024
+
+
+class ArrivalState:
+    """Arrivals and wake-up events shared between the tasks of the asyncio main loop.
+    Only touched from the event loop thread; blocking work runs in worker threads and hands
+    its results back through here.
+    """
+    def __init__(self):
+        self.arrivals = []
+        self.sleeping = False           # In a service gap: nothing is fetched or rendered
+        self.manual_refresh = False     # The pending refresh was requested with the button
+        self.refresh = asyncio.Event()  # Fetch now (button press, or the arrivals shown have passed)
+        self.changed = asyncio.Event()  # Arrivals or sleep state changed, render now
+        self.pushed_until = 0           # Pushed predictions stand in for fetches until then (PUSH_MODE = subscribe)
+        self.reconfigured = asyncio.Event()  # config.txt was reloaded, recompute the brightness schedule
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a task that sleeps for LOOP_LAG_INTERVAL.
+    Lag means some step is blocking the loop, and with it the countdown and the button.
+    """
+    def __init__(self):
+        self.samples = deque(maxlen=LOOP_LAG_SAMPLES)
+    
+    async def run(self):
+        loop = asyncio.get_running_loop()
         while True:
-            current_time = time.time()
-            
-            # Update brightness based on sunset time (check once per minute)
-            # This runs early so it executes regardless of arrival status
-            time_since_last_check = current_time - last_brightness_check_time
-            if time_since_last_check >= 60:
-                print(f"[DEBUG] Checking brightness (last check was {time_since_last_check:.1f}s ago)")
-                display_manager.update_brightness_for_time()
-                last_brightness_check_time = current_time
-            
-            # Fetch new arrivals every 3 minutes, on first run, or when button is pressed
-            should_refresh = (
-                current_time - last_fetch_time >= refresh_interval or 
-                last_fetch_time == 0 or 
-                refresh_flag["triggered"]
-            )
-            
-            if should_refresh:
-                if refresh_flag["triggered"]:
-                    print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Manual refresh triggered by button press.")
-                    refresh_flag["triggered"] = False
-                else:
-                    print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Fetching bus arrivals for stop {STOP_ID}...")
+            start = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.samples.append(max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+    
+    def stats(self):
+        """Return loop lag percentiles in milliseconds."""
+        samples = sorted(self.samples)
+        return {
+            "samples": len(samples),
+            "lag_p50_ms": _percentile(samples, 0.5) * 1000,
+            "lag_p99_ms": _percentile(samples, 0.99) * 1000,
+            "lag_max_ms": samples[-1] * 1000 if samples else 0,
+        }
+    
+    def report(self):
+        stats = self.stats()
+        log.info(f"Event loop lag p50/p99/max: {stats['lag_p50_ms']:.1f}/{stats['lag_p99_ms']:.1f}/{stats['lag_max_ms']:.1f} ms "
+                 f"over {stats['samples']} samples")
+
+
+class PushPublisher:
+    """Sends the predictions of every newly parsed feed to subscribed signs (PUSH_MODE = publish).
+    A subscriber connects over TCP and sends one JSON line, {"subscribe": [[stop_id, route_id], ...]}.
+    It then gets one JSON line per parsed feed, {"feed_timestamp": ..., "predictions": [[trip_id,
+    route_id, stop_id, timestamp], ...]}, with only the predictions for its subscriptions, and a
+    {"feed_timestamp": ...} heartbeat every PUSH_HEARTBEAT_INTERVAL while this sign's fetches succeed.
+    stop_ids and route_ids cover this sign's displays and every subscription; fetch_bus_arrivals()
+    extracts predictions for all of them.
+    """
+    def __init__(self, on_new_scope=None):
+        self.subscribers = {}  # StreamWriter -> frozenset of (stop_id, route_id)
+        self.stop_ids = frozenset(STOP_IDS)
+        self.route_ids = frozenset(DESIRED_ROUTES)
+        self.predictions = None  # Last predictions sent
+        self.feed_timestamp = 0
+        self.healthy = False     # The last fetch succeeded, so heartbeats are honest
+        self.on_new_scope = on_new_scope  # Called when a subscriber needs stops or routes not fetched yet
+        self.messages_sent = 0
+        self.bytes_sent = 0
+    
+    async def handle(self, reader, writer):
+        """Serve one subscriber connection until it closes.
+        Each line the subscriber sends replaces its subscriptions (a sign resubscribes after a config reload).
+        """
+        peer = writer.get_extra_info("peername")
+        timeout = 10  # For the first subscription; afterwards lines only come on changes
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=timeout)
+                if not line:
+                    break
+                subscriptions = frozenset((str(stop_id), str(route_id)) for stop_id, route_id in json.loads(line)["subscribe"])
+                self.subscribers[writer] = subscriptions
+                timeout = None
+                log.info(f"Push subscriber {peer} subscribed to {', '.join(f'{stop_id}/{route_id}' for stop_id, route_id in sorted(subscriptions))}.")
+                if not self.update_scope() and self.healthy and self.predictions is not None:
+                    # The last feed already covers the subscriptions; otherwise the fetch just requested sends them
+                    self._send(writer, subscriptions)
+        except (OSError, ValueError, KeyError, TypeError, asyncio.TimeoutError) as e:
+            log.warning(f"Dropping push subscriber {peer}: {e!r}")
+        except asyncio.CancelledError:
+            pass  # Returning normally when cancelled at shutdown keeps asyncio from logging the cancellation
+        finally:
+            if self.subscribers.pop(writer, None) is not None:
+                log.info(f"Push subscriber {peer} disconnected.")
+            writer.close()
+            self.update_scope()
+    
+    def update_scope(self):
+        """Recompute stop_ids and route_ids from STOP_IDS, DESIRED_ROUTES and the subscriptions.
+        Returns True if they grew (and on_new_scope was called).
+        """
+        stop_ids = frozenset(STOP_IDS).union(stop_id for subscriptions in self.subscribers.values() for stop_id, _ in subscriptions)
+        route_ids = frozenset(DESIRED_ROUTES).union(route_id for subscriptions in self.subscribers.values() for _, route_id in subscriptions)
+        grew = not (stop_ids <= self.stop_ids and route_ids <= self.route_ids)
+        self.stop_ids, self.route_ids = stop_ids, route_ids
+        if grew and self.on_new_scope is not None:
+            self.on_new_scope()
+        return grew
+    
+    def publish(self, predictions, feed_timestamp):
+        """Record a successful fetch and send predictions to every subscriber if they are from a new feed."""
+        self.healthy = True
+        if predictions is self.predictions:
+            return  # Unchanged feed; the heartbeat tells subscribers it is still current
+        self.predictions = predictions
+        self.feed_timestamp = feed_timestamp
+        for writer, subscriptions in list(self.subscribers.items()):
+            self._send(writer, subscriptions)
+    
+    def _send(self, writer, subscriptions):
+        records = [list(p) for p in self.predictions if (p.stop_id, p.route_id) in subscriptions]
+        self._write(writer, {"feed_timestamp": self.feed_timestamp, "predictions": records})
+    
+    def _write(self, writer, message):
+        if writer.transport.get_write_buffer_size() > PUSH_MAX_BUFFER:
+            # Closing ends handle()'s read, which removes the subscriber
+            log.warning(f"Dropping push subscriber {writer.get_extra_info('peername')}: not reading.")
+            writer.close()
+            return
+        data = json.dumps(message, separators=(",", ":")).encode() + b"\n"
+        writer.write(data)
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
+    
+    async def heartbeat_task(self):
+        """Tell subscribers every PUSH_HEARTBEAT_INTERVAL that the last predictions are still current."""
+        while True:
+            await asyncio.sleep(PUSH_HEARTBEAT_INTERVAL)
+            if self.healthy:
+                for writer in list(self.subscribers):
+                    self._write(writer, {"feed_timestamp": self.feed_timestamp})
+    
+    def next_arrivals(self, now):
+        """Return the next predicted arrival per subscription as {"timestamp": ...} dicts.
+        Added to this sign's own arrivals for PollScheduler.record_fetch(), so a subscriber's bus
+        that is about to arrive gets the same close polling as one of this sign's own.
+        """
+        wanted = set().union(*self.subscribers.values())
+        earliest = {}
+        for p in self.predictions or ():
+            key = (p.stop_id, p.route_id)
+            if key in wanted and now < p.timestamp < earliest.get(key, float("inf")):
+                earliest[key] = p.timestamp
+        return [{"timestamp": timestamp} for timestamp in earliest.values()]
+    
+    def close(self):
+        for writer in list(self.subscribers):
+            writer.close()
+
+
+def arrival_document(arrival):
+    """Return an arrival as a JSON API object, with its local time in ISO 8601 format."""
+    return {
+        "route_id": arrival["route_id"],
+        "stop_id": arrival["stop_id"],
+        "trip_id": arrival.get("trip_id", ""),
+        "headsign": arrival["headsign"],
+        "timestamp": arrival["timestamp"],
+        "time": arrival["time"].astimezone(LOCAL_TZ).isoformat(),
+        "scheduled": bool(arrival.get("scheduled")),
+    }
+
+
+def publish_api_documents(documents, arrivals, scheduler, source):
+    """Publish arrivals to the JSON API: /arrivals per display and /board per stop.
+    source says where the arrivals came from: "realtime", "schedule", "snapshot" or "push".
+    Both documents carry when the sign last updated them, the feed header timestamp (how old the
+    realtime data is) and when the sign polls next.
+    """
+    meta = {
+        "source": source,
+        "updated_at": clock_time(),
+        "feed_timestamp": _REALTIME_FEED_CACHE["header_timestamp"] or None,
+        "next_poll": scheduler.next_poll_time,
+    }
+    items = [(arrival, arrival_document(arrival)) for arrival in arrivals]
+    displays = []
+    for display in DISPLAYS:
+        displays.append({
+            "display": display.number,
+            "stop_id": display.stop_id,
+            "route_id": display.route_id,
+            "headsign": display.headsign,
+            "arrivals": [item for arrival, item in items
+                         if subscription_matches(display, arrival["stop_id"], arrival["route_id"], arrival["headsign"])],
+        })
+    stops = {stop_id: [item for arrival, item in items if arrival["stop_id"] == stop_id] for stop_id in sorted(STOP_IDS)}
+    documents.publish({
+        "/arrivals": dict(meta, displays=displays),
+        "/board": dict(meta, stops=stops),
+    })
+
+
+def save_arrivals_snapshot(arrivals):
+    """Atomically write the arrivals (without their datetime) to ARRIVALS_SNAPSHOT_FILE."""
+    data = {
+        "saved_at": clock_time(),
+        "stop_ids": sorted(STOP_IDS),
+        "arrivals": [{key: value for key, value in arrival.items() if key != "time"} for arrival in arrivals],
+    }
+    ARRIVALS_SNAPSHOT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = ARRIVALS_SNAPSHOT_FILE.with_suffix(".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, ARRIVALS_SNAPSHOT_FILE)
+
+
+def load_arrivals_snapshot():
+    """Return the still-future arrivals from ARRIVALS_SNAPSHOT_FILE, in fetch_bus_arrivals() format.
+    Returns an empty list if there is no usable snapshot for the monitored stops, or it is older than
+    ARRIVALS_SNAPSHOT_MAX_AGE (or from the future, as when the clock is not yet set after boot).
+    """
+    try:
+        with open(ARRIVALS_SNAPSHOT_FILE, 'r') as f:
+            data = json.load(f)
+        now = clock_time()
+        if data["stop_ids"] != sorted(STOP_IDS) or not 0 <= now - data["saved_at"] <= ARRIVALS_SNAPSHOT_MAX_AGE:
+            return []
+        return [dict(arrival, time=datetime.fromtimestamp(arrival["timestamp"], tz=timezone.utc))
+                for arrival in data["arrivals"] if arrival["timestamp"] > now]
+    except (OSError, ValueError, KeyError, TypeError):
+        return []
+
+
+async def sleep_through_service_gap(last_arrival, wake_time, display_manager, state):
+    """
+    Stop polling the realtime feed until wake_time, shortly before scheduled service resumes.
+    The displays are blanked (or dimmed, showing the first scheduled arrivals) and rendering stops;
+    a touch (state.refresh) ends the sleep early.
+    Returns (seconds slept, CPU seconds used while asleep).
+    """
+    start_time = clock_time()
+    start_cpu = time.process_time()
+    last_str = datetime.fromtimestamp(last_arrival, tz=LOCAL_TZ).strftime('%H:%M') if last_arrival else "none"
+    wake_str = datetime.fromtimestamp(wake_time, tz=LOCAL_TZ).strftime('%H:%M')
+    log.info(f"No scheduled service (last arrival: {last_str}), sleeping until {wake_str}.")
+    
+    state.sleeping = True
+    state.arrivals = []
+    display_manager.sleep(await asyncio.to_thread(get_scheduled_arrivals) if SLEEP_DISPLAY == "dim" else None)
+    try:
+        await asyncio.wait_for(state.refresh.wait(), timeout=max(0, wake_time - clock_time()))
+    except asyncio.TimeoutError:
+        pass
+    display_manager.wake()
+    display_manager.update_brightness_for_time()
+    state.sleeping = False
+    state.changed.set()
+    
+    return clock_time() - start_time, time.process_time() - start_cpu
+
+
+def format_arrivals_summary(arrivals):
+    """Return the next arrival for each display as one line, e.g. "Route 12: 05:42 PM (Fairview); Route 19: 05:50 PM"."""
+    parts = []
+    for arrival in [a for a in select_display_arrivals(arrivals or []) if a is not None]:
+        local_time = arrival["time"].astimezone(LOCAL_TZ)
+        time_str = local_time.strftime("%I:%M %p")
+        headsign_str = f" ({arrival['headsign']})" if arrival['headsign'] else ""
+        stop_str = f" at stop {arrival['stop_id']}" if len(STOP_IDS) > 1 else ""
+        scheduled_str = " [scheduled]" if arrival.get("scheduled") else ""
+        parts.append(f"Route {arrival['route_id']}{stop_str}: {time_str}{headsign_str}{scheduled_str}")
+    return "; ".join(parts)
+
+
+async def fetch_task(state, scheduler, display_manager, debug=False, archive=None, api_documents=None, publisher=None):
+    """Fetch realtime arrivals whenever the scheduler or a refresh request says so.
+    The HTTP request and parsing (and appending to archive) run in a worker thread, so a slow
+    server or SD card never stalls the loop. Each result is published to api_documents if given,
+    and each feed's predictions are sent to the subscribers of publisher (a PushPublisher) if given.
+    While predictions are pushed to this sign (state.pushed_until), only a button press fetches.
+    """
+    start_time = clock_time()
+    slept_time = 0  # Wall and CPU seconds spent in service gap sleep
+    slept_cpu = 0
+    last_summary = None
+    
+    # Load the cached static GTFS index (or start downloading it) before the first fetch,
+    # while the render task already shows any arrivals from the snapshot
+    await asyncio.to_thread(get_stop_trip_index)
+    
+    while True:
+        # Wait until the next poll is due or a refresh is requested
+        if not state.refresh.is_set():
+            try:
+                await asyncio.wait_for(state.refresh.wait(), timeout=max(0, scheduler.next_poll_time - clock_time()))
+            except asyncio.TimeoutError:
+                pass
+        manual = state.manual_refresh
+        state.manual_refresh = False
+        state.refresh.clear()
+        current_time = clock_time()
+        
+        # Predictions pushed by the publisher sign replace polling until it goes silent
+        if not manual and current_time < state.pushed_until:
+            scheduler.retry_in(current_time, state.pushed_until - current_time)
+            continue
+        
+        # Outside scheduled service, sleep instead of polling unless a live bus is still due
+        # (a publisher keeps polling: its subscribers' stops may still have service)
+        if SERVICE_GAP_SLEEP and publisher is None and not manual and not any(
+                not a.get("scheduled") and a["timestamp"] > current_time for a in state.arrivals):
+            gap = await asyncio.to_thread(get_service_gap, current_time)
+            if gap:
+                # CPU use per second while awake, to estimate what sleeping saved
+                awake_time = current_time - start_time - slept_time
+                awake_cpu_rate = (time.process_time() - slept_cpu) / awake_time if awake_time > 0 else 0
+                skipped_interval = scheduler.interval_for(current_time, [])
                 
-                arrivals = fetch_bus_arrivals(debug=debug_mode)
-                last_fetch_time = current_time
+                gap_time, gap_cpu = await sleep_through_service_gap(*gap, display_manager, state)
+                slept_time += gap_time
+                slept_cpu += gap_cpu
+                log.info(f"Slept {gap_time / 3600:.1f} h: about {gap_time / skipped_interval:.0f} requests skipped, "
+                         f"CPU {gap_cpu:.1f} s (about {max(0, awake_cpu_rate * gap_time - gap_cpu):.1f} s saved).")
                 
-                if not arrivals:
-                    print("No upcoming arrivals found.")
-                    print("Retrying in 3 minutes...")
-                    # Clear displays when no data
-                    display_manager.show_arrivals(arrival1=None, arrival2=None)
-                    
-                    # Wait 30 seconds before next attempt, but poll sensor frequently
-                    wait_time = 30
-                    while wait_time > 0:
-                        sensor_manager.check_sensor()
-                        if refresh_flag["triggered"]:
-                            break
-                        time.sleep(1)
-                        wait_time -= 1
+                # A touch that ended the sleep is still pending and is handled as a manual refresh
+                scheduler.resume(clock_time())
+                scheduler.poll_now()
+                continue
+        
+        if manual:
+            log.info("Manual refresh triggered by button press.")
+        else:
+            log.debug(f"Fetching bus arrivals for stop {', '.join(sorted(STOP_IDS))}...")
+        
+        arrivals = await asyncio.to_thread(fetch_bus_arrivals, debug, archive, publisher)
+        source = "realtime"
+        
+        if arrivals is None:
+            # Realtime feed unavailable: fall back to the timetable and retry the feed sooner
+            scheduler.record_failure(current_time, SCHEDULE_FALLBACK_RETRY_INTERVAL, manual)
+            if publisher is not None:
+                publisher.healthy = False
+            arrivals = await asyncio.to_thread(get_scheduled_arrivals)
+            source = "schedule"
+            if arrivals:
+                log.warning("Realtime data unavailable, showing scheduled arrivals.")
+        else:
+            selected = select_display_arrivals(arrivals)
+            if publisher is not None:
+                publisher.publish(_REALTIME_FEED_CACHE["predictions"], _REALTIME_FEED_CACHE["header_timestamp"])
+                selected += publisher.next_arrivals(current_time)
+            next_poll = scheduler.record_fetch(current_time, _REALTIME_FEED_CACHE["header_timestamp"], selected, manual)
+            log.debug(f"Next refresh in {next_poll:.0f} seconds.")
+        
+        state.arrivals = arrivals
+        state.changed.set()
+        if api_documents is not None:
+            publish_api_documents(api_documents, arrivals, scheduler, source)
+        
+        # Log the next arrival for each display at INFO only when it changed since the last fetch
+        summary = format_arrivals_summary(arrivals)
+        level = logging.INFO if summary != last_summary or manual else logging.DEBUG
+        last_summary = summary
+        if not arrivals:
+            log.log(level, f"No upcoming arrivals found. Retrying in {max(0, scheduler.next_poll_time - clock_time()):.0f} seconds...")
+        else:
+            log.log(level, f"Updated arrivals for stop {', '.join(sorted(STOP_IDS))}: {summary}")
+
+
+def push_subscriptions():
+    """Return the (stop_id, route_id) pairs of the displays, as sent to the publisher."""
+    return sorted({(display.stop_id, display.route_id) for display in DISPLAYS})
+
+
+async def push_subscriber_task(state, scheduler, api_documents=None):
+    """Receive the predictions for this sign's displays from PUSH_PUBLISHER (PUSH_MODE = subscribe).
+    Every message extends state.pushed_until by PUSH_TIMEOUT, which keeps fetch_task from polling
+    the feed; if the publisher goes silent or the connection drops, fetch_task polls again at once
+    and keeps doing so until a reconnect (every PUSH_RECONNECT_INTERVAL) succeeds.
+    """
+    while True:
+        writer = None
+        subscriptions = push_subscriptions()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(PUSH_PUBLISHER, PUSH_PORT), timeout=10)
+            writer.write(json.dumps({"subscribe": subscriptions}).encode() + b"\n")
+            await writer.drain()
+            log.info(f"Subscribed to predictions from {PUSH_PUBLISHER}:{PUSH_PORT}.")
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=PUSH_TIMEOUT)
+                if not line:
+                    raise ConnectionError("connection closed by publisher")
+                message = json.loads(line)
+                state.pushed_until = clock_time() + PUSH_TIMEOUT
+                if push_subscriptions() != subscriptions:
+                    # The displays changed with a config reload; the publisher answers the new subscriptions
+                    subscriptions = push_subscriptions()
+                    writer.write(json.dumps({"subscribe": subscriptions}).encode() + b"\n")
                     continue
-                else:
-                    # Print the updated arrivals when successfully fetched
-                    now = datetime.now(timezone.utc)
-                    print(f"[{now.strftime('%H:%M:%S')}] Updated arrivals for stop {STOP_ID}:")
-                    
-                    # Find and print arrivals for specific routes
-                    arrival_route12 = next((a for a in arrivals if a["route_id"] == DISPLAY1_ROUTE), None)
-                    arrival_route19 = next((a for a in arrivals if a["route_id"] == DISPLAY2_ROUTE), None)
-                    
-                    # Print the next arrivals
-                    for arrival in [a for a in [arrival_route12, arrival_route19] if a is not None]:
-                        local_time = arrival["time"].astimezone(LOCAL_TZ)
-                        time_str = local_time.strftime("%I:%M %p")
-                        route_id = arrival["route_id"]
-                        headsign_str = f" ({arrival['headsign']})" if arrival['headsign'] else ""
-                        print(f"  Route {route_id}: {time_str}{headsign_str}")
-            
-            # Check if any arrivals have passed
-            future_arrivals = [a for a in arrivals if a["time"] > datetime.now(timezone.utc)]
-            
-            if not future_arrivals:
+                if "predictions" in message:
+                    # The pushed feed is now the last one seen; a fallback fetch parses its feed afresh
+                    reset_realtime_feed_cache(message["feed_timestamp"])
+                    predictions = [StopTimePrediction(*record) for record in message["predictions"]]
+                    state.arrivals = await asyncio.to_thread(arrivals_from_predictions, predictions)
+                    state.changed.set()
+                    if api_documents is not None:
+                        publish_api_documents(api_documents, state.arrivals, scheduler, "push")
+        except (OSError, ValueError, KeyError, TypeError, asyncio.TimeoutError) as e:
+            if state.pushed_until:
+                log.warning(f"Lost pushed predictions from {PUSH_PUBLISHER}:{PUSH_PORT} ({e!r}), fetching the feed directly.")
+                state.pushed_until = 0
+                scheduler.poll_now()
+                state.refresh.set()
+            else:
+                log.debug(f"Could not subscribe to {PUSH_PUBLISHER}:{PUSH_PORT}: {e!r}")
+        finally:
+            if writer is not None:
+                writer.close()
+        await asyncio.sleep(PUSH_RECONNECT_INTERVAL)
+
+
+async def render_task(state, scheduler, display_manager):
+    """Update the displays at the start of every second, or as soon as the arrivals change."""
+    while True:
+        state.changed.clear()
+        if not state.sleeping:
+            now = clock_now(timezone.utc)
+            future_arrivals = [a for a in state.arrivals if a["time"] > now]
+            if future_arrivals:
+                # Update TM1637 displays with the next arrival for each display subscription
+                display_manager.show_arrivals(select_display_arrivals(future_arrivals))
+            else:
                 # Clear displays when no future arrivals
-                display_manager.show_arrivals(arrival1=None, arrival2=None)
-                last_fetch_time = 0
-                sensor_manager.check_sensor()  # Poll sensor even when no arrivals
-                time.sleep(1)
-                continue
-            
-            # Find arrivals for specific routes
-            arrival_route12 = next((a for a in future_arrivals if a["route_id"] == DISPLAY1_ROUTE), None)
-            arrival_route19 = next((a for a in future_arrivals if a["route_id"] == DISPLAY2_ROUTE), None)
-            
-            # Update TM1637 displays with arrival times for specific routes
-            display_manager.show_arrivals(
-                arrival1=arrival_route12,
-                arrival2=arrival_route19
-            )
-            
-            # Check sensor for button press
-            sensor_manager.check_sensor()
-            
-            # Sleep without printing every iteration
-            time.sleep(1)
+                display_manager.show_arrivals([None] * len(DISPLAYS))
+                if state.arrivals:
+                    # The arrivals on display have all passed
+                    state.arrivals = []
+                    scheduler.poll_now()
+                    state.refresh.set()
+        
+        # Nothing changes on screen while asleep until the state does
+        timeout = None if state.sleeping else 1 - clock_time() % 1
+        try:
+            await asyncio.wait_for(state.changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def brightness_task(state, display_manager):
+    """Apply sunset dimming at the precomputed brightness transitions.
+    Sleeps until the next transition, waking at least every BRIGHTNESS_MAX_SLEEP in case the
+    wall clock was stepped (e.g. by NTP after boot on a Pi without a real-time clock), and
+    whenever config.txt is reloaded.
+    """
+    while True:
+        state.reconfigured.clear()
+        delay = None
+        if ENABLE_SUNSET_DIMMING and ASTRAL_AVAILABLE:
+            if not state.sleeping:
+                display_manager.update_brightness_for_time()
+            current_time = clock_time()
+            transition = get_next_brightness_transition(current_time)
+            delay = transition[0] - current_time if transition else BRIGHTNESS_MAX_SLEEP
+            delay = min(max(0, delay), BRIGHTNESS_MAX_SLEEP)
+        elif not state.sleeping:
+            # Without dimming (or after a reload turned it off) the displays stay at day brightness
+            display_manager.set_brightness(DAY_BRIGHTNESS)
+        try:
+            await asyncio.wait_for(state.reconfigured.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def static_refresh_task():
+    """Keep the static GTFS data fresh independently of realtime fetches.
+    get_static_gtfs_data() only starts the background download thread when the data has expired.
+    """
+    while True:
+        await asyncio.sleep(STATIC_GTFS_CHECK_INTERVAL)
+        await asyncio.to_thread(get_static_gtfs_data)
+
+
+def is_live_config_key(key):
+    """Return True if reload_config() applies a change to key without a restart."""
+    return key in _LIVE_SETTINGS or (key.startswith("DISPLAY") and key.endswith(("_ROUTE", "_STOP_ID", "_HEADSIGN")))
+
+
+async def reload_config(state, scheduler, publisher=None):
+    """Load config.txt again and apply the changed settings that do not need a restart.
+    Everything derived from them is built before anything is swapped in: the display subscriptions,
+    route filters and, if the monitored stops changed, the stop trip index (rebuilt from the cached
+    static GTFS zip, without a download). The swap happens without an await in between, so no task
+    sees a mix of old and new settings; the sun times are recomputed on first use.
+    Returns (changed keys, changed keys that only take effect after a restart).
+    Raises ValueError or OSError, keeping the running configuration, if config.txt is invalid.
+    """
+    global CONFIG, _LIVE_SETTINGS, _OBSERVER, _STATIC_GTFS_DATA
+    
+    config = await asyncio.to_thread(load_config)
+    changed = {key for key in CONFIG.keys() | config.keys() if CONFIG.get(key) != config.get(key)}
+    if not changed:
+        return changed, set()
+    settings = read_live_settings(config)
+    # The displays are set up on their pins once at startup
+    if [(d.number, d.clk, d.dio) for d in settings["DISPLAYS"]] != [(d.number, d.clk, d.dio) for d in DISPLAYS]:
+        raise ValueError("the number of displays or their pins changed, restart to apply")
+    
+    static_data = _STATIC_GTFS_DATA
+    stops_changed = settings["STOP_IDS"] != STOP_IDS
+    if stops_changed and static_data is not None:
+        meta = read_static_cache_meta()
+        try:
+            static_data = await asyncio.to_thread(load_cached_stop_trip_index, meta, settings["STOP_IDS"])
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            log.warning(f"Could not rebuild the stop trip index from the static GTFS cache ({e}), downloading it again.")
+            static_data = None
+    
+    # Swap in the new settings and everything derived from them
+    CONFIG = config
+    with _STATIC_SWAP_LOCK:
+        _LIVE_SETTINGS = settings
+        globals().update(settings)
+        if stops_changed and static_data is not None:
+            _STATIC_GTFS_DATA = static_data
+    if stops_changed and static_data is None:
+        start_static_refresh()
+    _OBSERVER = None
+    if ASTRAL_AVAILABLE and ENABLE_SUNSET_DIMMING:
+        _OBSERVER = Observer(latitude=LOCATION_LATITUDE, longitude=LOCATION_LONGITUDE, elevation=0)
+    _SUN_TIMES.clear()
+    set_level("bustime", _CLI_LOG_LEVEL or LOG_LEVEL)
+    scheduler.adaptive = ADAPTIVE_REFRESH
+    if publisher is not None:
+        publisher.update_scope()
+    
+    # Fetch now so the displays follow the new subscriptions (a subscriber fetches directly once,
+    # until the publisher answers its new subscriptions), and recompute the brightness schedule
+    state.pushed_until = 0
+    scheduler.poll_now()
+    state.refresh.set()
+    state.reconfigured.set()
+    return changed, {key for key in changed if not is_live_config_key(key)}
+
+
+def config_file_signature():
+    """Return (modification time, size) of config.txt, or None if it cannot be read."""
+    try:
+        stat = CONFIG_PATH.stat()
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+async def config_watch_task(state, scheduler, publisher=None):
+    """Reload config.txt whenever it changes, checking every CONFIG_CHECK_INTERVAL."""
+    signature = config_file_signature()
+    while True:
+        await asyncio.sleep(CONFIG_CHECK_INTERVAL)
+        current = config_file_signature()
+        if current is None or current == signature:
+            continue
+        await asyncio.sleep(CONFIG_SETTLE_TIME)
+        if config_file_signature() != current:
+            continue  # Still being written; picked up on a later check
+        signature = current
+        
+        start = time.perf_counter()
+        try:
+            changed, restart_keys = await reload_config(state, scheduler, publisher)
+        except (OSError, ValueError) as e:
+            log.error(f"Ignoring changed config.txt, keeping the running configuration: {e}")
+            continue
+        if not changed:
+            continue
+        elapsed = time.perf_counter() - start
+        CONFIG_RELOAD_SECONDS.observe(elapsed)
+        log.info(f"Reloaded config.txt in {elapsed * 1000:.1f} ms: {', '.join(sorted(changed))} changed.")
+        if restart_keys:
+            log.warning(f"Restart to apply {', '.join(sorted(restart_keys))}.")
+
+
+async def sensor_task(state, presses):
+    """Turn button presses from the sensor thread into refresh requests."""
+    while True:
+        await presses.get()
+        state.manual_refresh = True
+        state.refresh.set()
+
+
+async def snapshot_task(state):
+    """Save the arrivals to ARRIVALS_SNAPSHOT_FILE every ARRIVALS_SNAPSHOT_INTERVAL if they changed."""
+    saved = state.arrivals
+    while True:
+        await asyncio.sleep(ARRIVALS_SNAPSHOT_INTERVAL)
+        # Each fetch replaces the list, so an unchanged list means nothing new to save
+        if state.arrivals is not saved:
+            saved = state.arrivals
+            try:
+                await asyncio.to_thread(save_arrivals_snapshot, saved)
+            except OSError as e:
+                log.error(f"Failed to save arrivals snapshot: {e}")
+
+
+def report_archive(archive):
+    """Log the archive size and the headway and drift quantiles per stop and route."""
+    polls, arrivals, stats = archive.summary_stats()
+    log.info(f"Prediction archive: {archive.size() / 1024:.0f} KB, {polls} polls and "
+             f"{arrivals} arrivals since start")
+    for key, entry in stats.items():
+        values = [entry["headway_p50"], entry["headway_p90"], entry["drift_p50"], entry["drift_p90"]]
+        cells = [f"{value / 60:.1f}" if value is not None else "-" for value in values]
+        log.info(f"  {key}: {entry['arrivals']} arrivals, headway p50 {cells[0]} / p90 {cells[1]} min, "
+                 f"drift p50 {cells[2]} / p90 {cells[3]} min")
+
+
+async def report_task(scheduler, lag_monitor, archive=None):
+    """Log polling, loop lag and archive statistics every POLL_REPORT_INTERVAL."""
+    while True:
+        await asyncio.sleep(POLL_REPORT_INTERVAL)
+        scheduler.report()
+        lag_monitor.report()
+        if archive is not None:
+            report_archive(archive)
+
+
+def daemon_status(state, scheduler, lag_monitor, archive=None):
+    """Return the next arrival per display, sleep state and polling statistics for the status endpoint and file."""
+    displays = []
+    for display, arrival in zip(DISPLAYS, select_display_arrivals(state.arrivals)):
+        displays.append({
+            "display": display.number,
+            "stop_id": display.stop_id,
+            "route_id": display.route_id,
+            "headsign": display.headsign,
+            "next_arrival": arrival["timestamp"] if arrival else None,
+            "scheduled": bool(arrival and arrival.get("scheduled")),
+        })
+    return {
+        "sleeping": state.sleeping,
+        "next_poll": scheduler.next_poll_time,
+        "displays": displays,
+        "polling": scheduler.stats(),
+        "loop_lag": lag_monitor.stats(),
+        "archive": archive.summary_stats()[2] if archive is not None else None,
+    }
+
+
+# Daemon status published by the event loop for the metrics server thread; only ever replaced as a whole
+_DAEMON_STATUS = {}
+
+
+def published_daemon_status():
+    """Return the last daemon status published by status_task (safe to call from any thread)."""
+    return _DAEMON_STATUS
+
+
+async def status_task(state, scheduler, lag_monitor, archive=None):
+    """Publish the daemon status every STATUS_PUBLISH_INTERVAL for /status, and write it with the
+    metrics to STATUS_FILE (if set) every STATUS_FILE_INTERVAL.
+    """
+    global _DAEMON_STATUS
+    written = None
+    while True:
+        # ArrivalState and the scheduler belong to the loop, so the snapshot is taken here
+        _DAEMON_STATUS = status = daemon_status(state, scheduler, lag_monitor, archive)
+        now = asyncio.get_running_loop().time()
+        if STATUS_FILE and (written is None or now - written >= STATUS_FILE_INTERVAL):
+            written = now
+            try:
+                await asyncio.to_thread(METRICS.write_status, STATUS_FILE, status)
+            except OSError as e:
+                log.error(f"Failed to write status file: {e}")
+        await asyncio.sleep(min(STATUS_PUBLISH_INTERVAL, max(1, STATUS_FILE_INTERVAL)) if STATUS_FILE else STATUS_PUBLISH_INTERVAL)
+
+
+def dump_recent_log(ring):
+    """Write the in-memory log records to RECENT_LOG_FILE."""
+    try:
+        count = ring.dump(RECENT_LOG_FILE)
+        log.info(f"Wrote {count} recent log records to {RECENT_LOG_FILE}")
+    except OSError as e:
+        log.error(f"Failed to write recent log records: {e}")
+
+
+async def run_daemon(debug=False, ring=None, backends=None, gpio=None):
+    """Run the fetch, render, brightness, static refresh and sensor tasks until cancelled.
+    With ring (the logging RingBufferHandler), SIGUSR1 dumps the recent log records.
+    SIGTERM cancels the daemon like Ctrl-C, so the arrivals snapshot is saved on shutdown.
+    backends and gpio replace the TM1637 displays and RPi.GPIO (see fake_hardware.py).
+    """
+    loop = asyncio.get_running_loop()
+    if ring is not None and hasattr(signal, "SIGUSR1"):
+        loop.add_signal_handler(signal.SIGUSR1, dump_recent_log, ring)
+    if threading.current_thread() is threading.main_thread():
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    state = ArrivalState()
+    # Show the arrivals saved by the last run right away; the first fetch revalidates them
+    state.arrivals = load_arrivals_snapshot()
+    if state.arrivals:
+        log.info(f"Showing {len(state.arrivals)} arrivals from the snapshot saved by the last run.")
+    scheduler = PollScheduler(adaptive=ADAPTIVE_REFRESH)
+    lag_monitor = LoopLagMonitor()
+    display_manager = TM1637DisplayManager(backends=backends)
+    archive = PredictionArchive(ARCHIVE_DIR, ARCHIVE_MAX_BYTES, LOCAL_TZ) if ARCHIVE_DIR else None
+    
+    # The sensor thread hands presses to the loop; call_soon_threadsafe wakes it immediately
+    presses = asyncio.Queue()
+    sensor_manager = CapacitiveSensorManager(
+        callback=lambda: loop.call_soon_threadsafe(presses.put_nowait, clock_time()), debug=debug, gpio=gpio)
+    sensor_manager.start()
+    
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            metrics_server = start_metrics_server(METRICS, METRICS_BIND, METRICS_PORT,
+                                                  status=published_daemon_status)
+            log.info(f"Metrics available at http://{METRICS_BIND}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            log.error(f"Failed to start metrics endpoint on {METRICS_BIND}:{METRICS_PORT}: {e}")
+    
+    api_documents = api_server = None
+    if API_PORT:
+        api_documents = JSONDocuments()
+        publish_api_documents(api_documents, state.arrivals, scheduler, "snapshot")
+        try:
+            api_server = start_api_server(api_documents, API_BIND, API_PORT, API_WORKERS,
+                                          max_age=lambda: max(0, min(API_MAX_AGE, int(scheduler.next_poll_time - clock_time()))))
+            log.info(f"Arrivals API available at http://{API_BIND}:{API_PORT}/arrivals and /board")
+        except OSError as e:
+            log.error(f"Failed to start arrivals API on {API_BIND}:{API_PORT}: {e}")
+    
+    publisher = push_server = None
+    if PUSH_MODE == "publish":
+        def fetch_for_new_subscriber():
+            scheduler.poll_now()
+            state.refresh.set()
+        publisher = PushPublisher(on_new_scope=fetch_for_new_subscriber)
+        try:
+            push_server = await asyncio.start_server(publisher.handle, PUSH_BIND, PUSH_PORT)
+            log.info(f"Publishing predictions to subscribed signs on {PUSH_BIND}:{PUSH_PORT}")
+        except OSError as e:
+            log.error(f"Failed to publish predictions on {PUSH_BIND}:{PUSH_PORT}: {e}")
+            publisher = None
     
-    except KeyboardInterrupt:
-        print("\n\nBus arrival monitor stopped.")
+    tasks = [
+        asyncio.create_task(fetch_task(state, scheduler, display_manager, debug, archive, api_documents, publisher), name="fetch"),
+        asyncio.create_task(render_task(state, scheduler, display_manager), name="render"),
+        asyncio.create_task(brightness_task(state, display_manager), name="brightness"),
+        asyncio.create_task(static_refresh_task(), name="static"),
+        asyncio.create_task(sensor_task(state, presses), name="sensor"),
+        asyncio.create_task(lag_monitor.run(), name="loop-lag"),
+        asyncio.create_task(report_task(scheduler, lag_monitor, archive), name="report"),
+        asyncio.create_task(snapshot_task(state), name="snapshot"),
+    ]
+    if CONFIG_CHECK_INTERVAL:
+        tasks.append(asyncio.create_task(config_watch_task(state, scheduler, publisher), name="config"))
+    if publisher is not None:
+        tasks.append(asyncio.create_task(publisher.heartbeat_task(), name="push-heartbeat"))
+    if PUSH_MODE == "subscribe":
+        tasks.append(asyncio.create_task(push_subscriber_task(state, scheduler, api_documents), name="push-subscriber"))
+    if STATUS_FILE or metrics_server is not None:
+        tasks.append(asyncio.create_task(status_task(state, scheduler, lag_monitor, archive), name="status"))
+    try:
+        # Tasks only return by raising; surface the first failure instead of running half a daemon
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
     finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            save_arrivals_snapshot(state.arrivals)
+        except OSError as e:
+            log.error(f"Failed to save arrivals snapshot: {e}")
         sensor_manager.cleanup()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if api_server is not None:
+            api_server.shutdown()
+            api_server.server_close()
+        if push_server is not None:
+            push_server.close()
+            publisher.close()
+            log.info(f"Pushed {publisher.messages_sent} messages ({publisher.bytes_sent / 1024:.0f} KB) to subscribed signs.")
+        scheduler.report()
+        lag_monitor.report()
+        if archive is not None:
+            archive.close()
+            report_archive(archive)
+
+
+def main():
+    """Main entry point with continuous countdown and periodic refresh."""
+    global _CLI_LOG_LEVEL
+    debug_mode = "--debug" in sys.argv
+    if debug_mode:
+        _CLI_LOG_LEVEL = "DEBUG"
+    ring = setup_logging("bustime", _CLI_LOG_LEVEL or LOG_LEVEL, LOG_FILE or None,
+                         LOG_MAX_BYTES, LOG_BACKUP_COUNT)
+    log_configuration()
+    try:
+        asyncio.run(run_daemon(debug=debug_mode, ring=ring))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        log.info("Bus arrival monitor stopped.")
+    except Exception:
+        log.exception("Bus arrival monitor crashed.")
+        dump_recent_log(ring)
+        raise
 
 
 if __name__ == "__main__":
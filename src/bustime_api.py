@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Local network JSON API for bus_arrival_times.py.
+The event loop publishes the current arrivals as documents after every fetch; HTTP requests are
+answered from the last published documents on a small pool of worker threads, so a request never
+causes an upstream fetch and never runs on the event loop.
+
+Responses carry an ETag (clients can revalidate with If-None-Match and get a 304) and a
+Cache-Control max-age of the time until the sign's next poll, so well-behaved clients do not ask
+for data the sign cannot have yet.
+"""
+
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Connections that may wait for a free worker, per worker
+QUEUED_PER_WORKER = 4
+
+
+class JSONDocuments:
+    """Documents by path, replaced as a whole by publish() and encoded at most once per publish.
+    publish() is a single assignment, so it is cheap enough to call from the event loop; the
+    JSON encoding and hashing happen on the first request for each document after a publish.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.encoded = {}  # path -> (documents dict it was encoded from, body, etag)
+        self.lock = threading.Lock()
+
+    def publish(self, documents):
+        """Replace all documents with documents ({path: JSON-ready object})."""
+        self.documents = documents
+
+    def get(self, path):
+        """Return (body, etag) for the current document at path, or None if there is none."""
+        documents = self.documents
+        if path not in documents:
+            return None
+        cached = self.encoded.get(path)
+        if cached is not None and cached[0] is documents:
+            return cached[1], cached[2]
+        with self.lock:
+            cached = self.encoded.get(path)
+            if cached is None or cached[0] is not documents:
+                body = json.dumps(documents[path], separators=(",", ":")).encode()
+                cached = (documents, body, f'"{hashlib.sha1(body).hexdigest()[:16]}"')
+                self.encoded[path] = cached
+        return cached[1], cached[2]
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """HTTPServer that handles each connection on a fixed pool of worker threads.
+    Unlike ThreadingHTTPServer, a burst of clients cannot start more threads than the pool has,
+    which keeps them from starving the event loop thread of the GIL on a single-core Pi.
+    At most max_queued connections wait for a free worker; more are answered with a 503 and
+    closed, so clients that stall or flood cannot pile up accepted sockets without limit.
+    """
+
+    def __init__(self, address, handler, workers, max_queued=None):
+        super().__init__(address, handler)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-http")
+        self.max_pending = workers + (QUEUED_PER_WORKER * workers if max_queued is None else max_queued)
+        self.pending = 0  # Connections handed to the pool and not finished yet
+        self.rejected = 0
+        self.pending_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self.pending_lock:
+            accept = self.pending < self.max_pending
+            if accept:
+                self.pending += 1
+            else:
+                self.rejected += 1
+        if not accept:
+            try:
+                request.send(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        future = self.executor.submit(self._process_request, request, client_address)
+        future.add_done_callback(lambda future: self._request_done(future, request))
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def _request_done(self, future, request):
+        with self.pending_lock:
+            self.pending -= 1
+        if future.cancelled():
+            # Queued when the server closed: the worker never got to close it
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _APIRequestHandler(BaseHTTPRequestHandler):
+    documents = None
+    max_age = None
+    timeout = 10  # Drop clients that stall instead of holding a worker
+
+    def do_GET(self):
+        entry = self.documents.get(self.path.split("?", 1)[0].rstrip("/") or "/")
+        if entry is None:
+            self.send_error(404)
+            return
+        body, etag = entry
+        not_modified = etag in self.headers.get("If-None-Match", "")
+        self.send_response(304 if not_modified else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", f"max-age={self.max_age()}")
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Every phone refresh would otherwise be printed
+
+
+def start_api_server(documents, host, port, workers, max_age):
+    """Serve documents (JSONDocuments) on http://host:port/<path> with workers threads.
+    max_age() returns the Cache-Control max-age in seconds for the current response.
+    Returns the server; call shutdown() and server_close() on it to stop.
+    """
+    handler = type("APIRequestHandler", (_APIRequestHandler,), {"documents": documents, "max_age": staticmethod(max_age)})
+    server = ThreadPoolHTTPServer((host, port), handler, workers)
+    threading.Thread(target=server.serve_forever, name="api-http", daemon=True).start()
+    return server
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Append-only archive of the realtime predictions fetched by bus_arrival_times.py.
+
+Each parsed feed's predictions for the monitored stops are appended to a binary segment
+file per local day (predictions-YYYYMMDD.bin); the oldest segments are deleted to keep the
+archive under a size limit. Headway and prediction drift quantiles are updated as polls are
+appended, in constant memory.
+
+Segment format (little-endian): the magic b"BTPA\\x01", then records of
+    b"S" <uint8 length> <utf-8 bytes>                   define the next string id (0, 1, ...)
+    b"P" <uint32 fetch time> <uint32 feed header timestamp> <uint16 count>
+         count x <uint16 trip id> <uint16 route id> <uint16 stop id> <int32 predicted - header timestamp>
+String ids are per segment, so every segment can be read on its own. A record cut short by a
+crash is ignored by readers and truncated away when the segment is reopened for writing; a file
+that does not start with the magic is moved aside (to <name>.corrupt) rather than appended to.
+
+Usage:
+    python3 bustime_archive.py ARCHIVE_DIR     Print headway and drift quantiles for the whole archive
+"""
+
+import sys
+import bisect
+import struct
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+
+ARCHIVE_MAGIC = b"BTPA\x01"
+_POLL_HEADER = struct.Struct("<IIH")
+_PREDICTION = struct.Struct("<HHHi")
+_MAX_STRINGS = 0xFFFF
+
+log = logging.getLogger("bustime")
+
+# A trip's prediction is final once its predicted time is this far in the past (seconds)
+ARRIVAL_GRACE = 120
+# Gaps between arrivals longer than this are service breaks, not headways (seconds)
+MAX_HEADWAY = 3 * 3600
+# Quantiles kept for each summary
+SUMMARY_QUANTILES = (0.5, 0.9)
+
+
+class P2Quantile:
+    """Streaming estimate of one quantile in constant memory (the P-square algorithm of Jain and Chlamtac).
+    Five markers track the minimum, the quantile, the maximum and two points between them.
+    """
+
+    def __init__(self, fraction):
+        self.fraction = fraction
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * fraction, 1 + 4 * fraction, 3 + 2 * fraction, 5]
+        self.increments = [0, fraction / 2, fraction, (1 + fraction) / 2, 1]
+
+    def add(self, value):
+        self.count += 1
+        heights = self.heights
+        if len(heights) < 5:
+            bisect.insort(heights, value)
+            return
+
+        positions = self.positions
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = bisect.bisect_right(heights, value) - 1
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            offset = self.desired[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or (offset <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i, step):
+        heights, positions = self.heights, self.positions
+        return heights[i] + step / (positions[i + 1] - positions[i - 1]) * (
+            (positions[i] - positions[i - 1] + step) * (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i])
+            + (positions[i + 1] - positions[i] - step) * (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1]))
+
+    def value(self):
+        """Return the current estimate, or None before any value was added."""
+        if not self.heights:
+            return None
+        if self.count <= 5:
+            return self.heights[min(len(self.heights) - 1, int(self.fraction * len(self.heights)))]
+        return self.heights[2]
+
+
+class PredictionSummary:
+    """Headway and prediction drift quantiles per (stop, route), updated one poll at a time.
+    A trip's prediction is final once its predicted time is ARRIVAL_GRACE in the past; its drift is
+    the final prediction minus the first one seen (positive = the bus came later than first predicted)
+    and its headway is the time since the previous final arrival on the same route at the same stop.
+    Memory is bounded by the trips in the feed at once, not by how long the summary runs.
+    """
+
+    def __init__(self):
+        self.active = {}         # (trip_id, stop_id) -> [route_id, first prediction, last prediction]
+        self.last_arrival = {}   # (stop_id, route_id) -> last final arrival
+        self.headways = {}       # (stop_id, route_id) -> [P2Quantile per SUMMARY_QUANTILES]
+        self.drifts = {}
+        self.polls = 0
+        self.arrivals = 0
+
+    def add_poll(self, fetch_time, predictions):
+        """Add one poll's predictions, as (trip_id, route_id, stop_id, predicted timestamp) tuples."""
+        self.polls += 1
+        active = self.active
+        for trip_id, route_id, stop_id, predicted in predictions:
+            entry = active.get((trip_id, stop_id))
+            if entry is None:
+                active[(trip_id, stop_id)] = [route_id, predicted, predicted]
+            else:
+                entry[2] = predicted
+
+        finished = [(entry[2], key, entry) for key, entry in active.items() if entry[2] + ARRIVAL_GRACE < fetch_time]
+        for arrival, key, (route_id, first, last) in sorted(finished):
+            del active[key]
+            stop_id = key[1]
+            route_key = (stop_id, route_id)
+            self.arrivals += 1
+            self._add(self.drifts, route_key, last - first)
+            previous = self.last_arrival.get(route_key)
+            self.last_arrival[route_key] = arrival
+            if previous is not None and 0 < arrival - previous <= MAX_HEADWAY:
+                self._add(self.headways, route_key, arrival - previous)
+
+    @staticmethod
+    def _add(estimates, key, value):
+        quantiles = estimates.get(key)
+        if quantiles is None:
+            quantiles = estimates[key] = [P2Quantile(fraction) for fraction in SUMMARY_QUANTILES]
+        for quantile in quantiles:
+            quantile.add(value)
+
+    def stats(self):
+        """Return {"stop/route": {"arrivals", "headway_p50", "headway_p90", "drift_p50", "drift_p90"}} in seconds."""
+        stats = {}
+        for key in sorted(set(self.headways) | set(self.drifts)):
+            entry = {"arrivals": self.drifts[key][0].count if key in self.drifts else 0}
+            for name, estimates in (("headway", self.headways), ("drift", self.drifts)):
+                for fraction, quantile in zip(SUMMARY_QUANTILES, estimates.get(key, [None] * len(SUMMARY_QUANTILES))):
+                    entry[f"{name}_p{fraction * 100:.0f}"] = quantile.value() if quantile else None
+            stats[f"{key[0]}/{key[1]}"] = entry
+        return stats
+
+
+def read_segment(path):
+    """Yield (fetch time, header timestamp, [(trip_id, route_id, stop_id, predicted timestamp)]) for each poll in a segment.
+    Stops quietly at a record cut short by a crash.
+    """
+    for poll, _, _ in _scan_segment(path):
+        if poll is not None:
+            yield poll
+
+
+def _scan_segment(path):
+    """Yield (poll or None, string table, offset after the record) for each complete record in a segment."""
+    data = Path(path).read_bytes()
+    if not data.startswith(ARCHIVE_MAGIC):
+        return
+    strings = []
+    pos = len(ARCHIVE_MAGIC)
+    while pos < len(data):
+        kind = data[pos:pos + 1]
+        if kind == b"S":
+            if pos + 2 > len(data) or pos + 2 + data[pos + 1] > len(data):
+                return
+            end = pos + 2 + data[pos + 1]
+            strings.append(data[pos + 2:end].decode("utf-8"))
+            pos = end
+            yield None, strings, pos
+        elif kind == b"P":
+            if pos + 1 + _POLL_HEADER.size > len(data):
+                return
+            fetch_time, header_timestamp, count = _POLL_HEADER.unpack_from(data, pos + 1)
+            start = pos + 1 + _POLL_HEADER.size
+            end = start + count * _PREDICTION.size
+            if end > len(data):
+                return
+            predictions = [(strings[trip], strings[route], strings[stop], header_timestamp + offset)
+                           for trip, route, stop, offset in _PREDICTION.iter_unpack(data[start:end])]
+            pos = end
+            yield (fetch_time, header_timestamp, predictions), strings, pos
+        else:
+            return
+
+
+class PredictionArchive:
+    """Appends polls to daily segment files in directory, keeping the archive under max_bytes.
+    Segments are named after the local date (in tz) of the fetch time.
+    """
+
+    def __init__(self, directory, max_bytes, tz=None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.tz = tz
+        self.summary = PredictionSummary()
+        # The summary is updated by the fetch thread and read by the daemon's event loop
+        self.summary_lock = threading.Lock()
+        self.path = None
+        self.file = None
+        self.string_ids = {}
+        self.bytes_written = 0
+        self.total_bytes = 0
+
+    def segments(self):
+        """Return the segment paths, oldest first."""
+        return sorted(self.directory.glob("predictions-*.bin"))
+
+    def size(self):
+        return sum(path.stat().st_size for path in self.segments())
+
+    def append(self, fetch_time, header_timestamp, predictions):
+        """Append one poll of StopTimePrediction-like records (trip_id, route_id, stop_id, timestamp).
+        Raises OSError or ValueError if the poll could not be archived; the segment is left as it
+        was before the poll in either case.
+        """
+        path = self.directory / f"predictions-{datetime.fromtimestamp(fetch_time, self.tz).strftime('%Y%m%d')}.bin"
+        if path != self.path:
+            self._open(path)
+
+        # String ids first seen in this poll only join the table once the record is written,
+        # so a poll that fails halfway cannot leave ids behind that the segment never defines
+        new_ids = {}
+        record = bytearray()
+        try:
+            entries = []
+            for prediction in predictions:
+                refs = [self._string_id(value, record, new_ids) for value in (prediction.trip_id, prediction.route_id, prediction.stop_id)]
+                entries.append(_PREDICTION.pack(*refs, prediction.timestamp - header_timestamp))
+            record += b"P" + _POLL_HEADER.pack(int(fetch_time), header_timestamp, len(entries)) + b"".join(entries)
+        except struct.error as e:
+            raise ValueError(f"poll out of range for the archive format: {e}") from e
+
+        # One write per poll, so a crash can only cut the last record short
+        try:
+            self.file.write(record)
+            self.file.flush()
+        except OSError:
+            # Part of the record may have reached the file; reopening truncates it away
+            self.close()
+            self.path = None
+            raise
+        self.string_ids.update(new_ids)
+        self.bytes_written += len(record)
+        self.total_bytes += len(record)
+        if self.total_bytes > self.max_bytes:
+            self.enforce_limit()
+
+        polled = [(p.trip_id, p.route_id, p.stop_id, p.timestamp) for p in predictions]
+        with self.summary_lock:
+            self.summary.add_poll(fetch_time, polled)
+
+    def summary_stats(self):
+        """Return (polls, arrivals, summary stats), safe to call while another thread appends."""
+        with self.summary_lock:
+            return self.summary.polls, self.summary.arrivals, self.summary.stats()
+
+    def _string_id(self, value, record, new_ids):
+        """Return the id of value, adding its definition to record and new_ids if it has none yet."""
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = new_ids.get(value)
+        if string_id is None:
+            string_id = len(self.string_ids) + len(new_ids)
+            if string_id >= _MAX_STRINGS:
+                raise ValueError(f"too many distinct trip, route and stop ids in {self.path.name}")
+            # Cut to the 255 byte length limit without splitting a UTF-8 character
+            encoded = value.encode("utf-8")[:255].decode("utf-8", "ignore").encode("utf-8")
+            new_ids[value] = string_id
+            record += b"S" + bytes((len(encoded),)) + encoded
+        return string_id
+
+    def _open(self, path):
+        """Switch to the segment at path, picking up its string table if it already exists."""
+        self.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.string_ids = {}
+        end = 0
+        if path.exists():
+            with open(path, "rb") as f:
+                head = f.read(len(ARCHIVE_MAGIC))
+            if head == ARCHIVE_MAGIC:
+                strings = []
+                end = len(ARCHIVE_MAGIC)
+                for _, strings, end in _scan_segment(path):
+                    pass
+                self.string_ids = {value: i for i, value in enumerate(strings)}
+            elif not ARCHIVE_MAGIC.startswith(head):
+                # Not a segment (a crash while writing the magic leaves a prefix of it, which is rewritten)
+                aside = path.with_name(path.name + ".corrupt")
+                log.warning(f"{path.name} is not a prediction archive segment, moving it to {aside.name}")
+                path.replace(aside)
+        self.file = open(path, "r+b" if end else "wb")
+        if end:
+            # Drop a record cut short by a crash
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file.write(ARCHIVE_MAGIC)
+        self.path = path
+        self.enforce_limit()
+
+    def enforce_limit(self):
+        """Delete the oldest segments, never the current one, until the archive fits in max_bytes."""
+        segments = self.segments()
+        total = sum(path.stat().st_size for path in segments)
+        for path in segments:
+            if total <= self.max_bytes or path == self.path:
+                break
+            total -= path.stat().st_size
+            path.unlink()
+        self.total_bytes = total
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def summarize(directory):
+    """Stream every segment in directory through a PredictionSummary and print the quantiles."""
+    summary = PredictionSummary()
+    segments = sorted(Path(directory).glob("predictions-*.bin"))
+    for path in segments:
+        for fetch_time, _, predictions in read_segment(path):
+            summary.add_poll(fetch_time, predictions)
+    size = sum(path.stat().st_size for path in segments)
+    print(f"{len(segments)} segments, {size / 1024:.0f} KB, {summary.polls} polls, {summary.arrivals} arrivals")
+    print(f"\n{'stop/route':<16}{'arrivals':>9}{'headway p50':>13}{'p90':>7}{'drift p50':>11}{'p90':>7}  (seconds)")
+    print("-" * 63)
+    for key, entry in summary.stats().items():
+        values = [entry["headway_p50"], entry["headway_p90"], entry["drift_p50"], entry["drift_p90"]]
+        cells = [f"{value:.0f}" if value is not None else "-" for value in values]
+        print(f"{key:<16}{entry['arrivals']:>9}{cells[0]:>13}{cells[1]:>7}{cells[2]:>11}{cells[3]:>7}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__.split("Usage:")[1].rstrip())
+        sys.exit(1)
+    summarize(sys.argv[1])
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Logging setup for bus_arrival_times.py.
+Records go to the console and to a size-rotated log file whose old copies are gzip-compressed.
+Repeated messages from the same line of code are rate limited, and the most recent records
+(including debug records) are kept in memory so they can be dumped when something goes wrong.
+"""
+
+import os
+import sys
+import gzip
+import shutil
+import logging
+import logging.handlers
+from collections import deque
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Records allowed per call site in each rate limit window, and the window length (seconds)
+RATE_LIMIT_BURST = 5
+RATE_LIMIT_PERIOD = 600
+
+# Records kept in memory for dumping
+RING_BUFFER_CAPACITY = 1000
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most burst records through per call site (file and line) every period seconds.
+    Only records at level or above are limited, so routine progress messages are never dropped.
+    The first record from a call site after a window with dropped records says how many were dropped.
+    """
+
+    def __init__(self, burst=RATE_LIMIT_BURST, period=RATE_LIMIT_PERIOD, level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.level = level
+        self.windows = {}  # (pathname, lineno) -> [window start, records seen]
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.pathname, record.lineno)
+        window = self.windows.get(key)
+        if window is None or record.created - window[0] >= self.period:
+            dropped = window[1] - self.burst if window is not None and window[1] > self.burst else 0
+            self.windows[key] = [record.created, 1]
+            if dropped:
+                record.msg = f"{record.msg} ({dropped} similar messages suppressed)"
+            return True
+        window[1] += 1
+        if window[1] > self.burst:
+            self.suppressed += 1
+            return False
+        return True
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the last capacity records in memory; dump() writes them out formatted."""
+
+    def __init__(self, capacity=RING_BUFFER_CAPACITY):
+        super().__init__(logging.DEBUG)
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        # Render the traceback now so the record does not keep frames alive
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+    def lines(self):
+        return [self.format(record) for record in list(self.records)]
+
+    def dump(self, path):
+        """Write the buffered records to path, replacing it. Returns the number of records written."""
+        lines = self.lines()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n" if lines else "")
+        os.replace(temp_path, path)
+        return len(lines)
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that gzips rotated files (bustime.log.1.gz, bustime.log.2.gz, ...)."""
+
+    def __init__(self, filename, max_bytes, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.namer = lambda name: name + ".gz"
+        self.rotator = _gzip_rotator
+
+
+def parse_level(level, default=logging.INFO):
+    """Return the logging level for a name such as "DEBUG" or "warning", or default if unknown."""
+    value = logging.getLevelName(str(level).strip().upper())
+    return value if isinstance(value, int) else default
+
+
+def setup_logging(name, level="INFO", log_file=None, max_bytes=1024 * 1024, backup_count=5, console=True):
+    """Configure the named logger and return its RingBufferHandler.
+    level applies to the console and log file; the ring buffer always keeps debug records.
+    Calling it again replaces the previous handlers.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    for log_filter in list(logger.filters):
+        logger.removeFilter(log_filter)
+    logger.addFilter(RateLimitFilter())
+
+    formatter = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
+    level = parse_level(level)
+    handlers = []
+    if console:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    if log_file:
+        handlers.append(CompressedRotatingFileHandler(log_file, max_bytes, backup_count))
+    for handler in handlers:
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+
+    ring = RingBufferHandler()
+    ring.setFormatter(formatter)
+    logger.addHandler(ring)
+    return ring
+
+
+def set_level(name, level):
+    """Change the console and log file level of a logger configured by setup_logging()."""
+    level = parse_level(level)
+    for handler in logging.getLogger(name).handlers:
+        if not isinstance(handler, RingBufferHandler):
+            handler.setLevel(level)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Counters, gauges and histograms for bus_arrival_times.py.
+Metrics are exposed in the Prometheus text format on a small local HTTP endpoint
+(/metrics, plus /status for the same data as JSON) and written to a JSON status file.
+
+Recording a value is a few attribute updates with no locking: each metric is only
+updated from one thread at a time (the fetch worker or the static GTFS refresh thread),
+and readers only ever see a slightly stale value.
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    """A value that only goes up. With fn, the value is read from fn() when collected."""
+    kind = "counter"
+
+    def __init__(self, name, help_text, fn=None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        return self.fn() if self.fn else self.value
+
+    def samples(self):
+        yield self.name, "", self.get()
+
+    def snapshot(self):
+        return self.get()
+
+
+class Gauge(Counter):
+    """A value that can go up and down. With fn, the value is read from fn() when collected."""
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """Counts observations in fixed buckets (upper bounds), plus their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{self.name}_bucket", f'{{le="{bound:g}"}}', cumulative
+        yield f"{self.name}_bucket", '{le="+Inf"}', self.count
+        yield f"{self.name}_sum", "", self.sum
+        yield f"{self.name}_count", "", self.count
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0,
+            "buckets": {f"{bound:g}": count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+def _format_value(value):
+    if value is None or value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if isinstance(value, float) else str(int(value))
+
+
+class MetricsRegistry:
+    """Named metrics in registration order, rendered as Prometheus text or a JSON-ready dict."""
+
+    def __init__(self):
+        self.metrics = []
+        self.started_at = time.time()
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, fn=None):
+        return self._register(Counter(name, help_text, fn))
+
+    def gauge(self, name, help_text, fn=None):
+        return self._register(Gauge(name, help_text, fn))
+
+    def histogram(self, name, help_text, buckets):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def render_prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Return {metric name: value} (histograms as count/sum/mean/buckets)."""
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def write_status(self, path, status=None):
+        """Atomically write the metrics, and optional extra status fields, to path as JSON."""
+        document = {"updated_at": time.time(), "uptime": time.time() - self.started_at}
+        document.update(status or {})
+        document["metrics"] = self.snapshot()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=1, default=str)
+        os.replace(temp_path, path)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = None
+    status = None
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = self.registry.render_prometheus().encode()
+            content_type = PROMETHEUS_CONTENT_TYPE
+        elif path == "/status":
+            document = dict(self.status() if self.status else {})
+            document["metrics"] = self.registry.snapshot()
+            body = json.dumps(document, default=str).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every 15-60 s would otherwise fill stderr
+
+
+def start_metrics_server(registry, host, port, status=None):
+    """Serve registry on http://host:port/metrics (and /status, adding status() fields) from a daemon thread.
+    Returns the server; call shutdown() on it to stop.
+    """
+    handler = type("MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": registry, "status": staticmethod(status) if status else None})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
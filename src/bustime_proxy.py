@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Caching proxy for the GRT realtime and static GTFS endpoints.
+Run it on one machine and point the API_URL and STATIC_GTFS_URL of every sign, script and dev
+laptop at it (http://<proxy>:<port>/rt and /static). GRT then sees one realtime request per feed
+update and one static revalidation per PROXY_STATIC_REFRESH_INTERVAL, however many clients there
+are. The proxy itself fetches PROXY_API_URL and PROXY_STATIC_GTFS_URL, so it can share
+config.txt with a sign on the same Pi.
+
+- The realtime feed is cached until the producer's next update is due: its header timestamp plus
+  the update cadence learned from previous headers. While the producer is late, GRT is asked
+  again at most every PROXY_RETRY_TTL seconds.
+- Concurrent requests for an expired resource share one upstream request.
+- The static zip is kept on disk and revalidated upstream with a conditional request.
+- Clients get ETags (If-None-Match is answered with 304) and a Cache-Control max-age of the
+  remaining TTL. If GRT is unreachable, the last good copy is served.
+
+Usage:
+    python3 bustime_proxy.py [--port PORT]
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler
+
+import bus_arrival_times as bus
+from bustime_api import ThreadPoolHTTPServer
+from bustime_logging import setup_logging
+
+log = logging.getLogger("bustime")
+
+# Re-ask GRT this often while the feed has not been updated when expected (seconds)
+PROXY_RETRY_TTL = 5
+# Header timestamp differences kept to learn the producer's update cadence
+PROXY_CADENCE_SAMPLES = 10
+# How often proxy statistics are logged (seconds)
+PROXY_REPORT_INTERVAL = 3600
+PROXY_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+
+class SingleFlight:
+    """Runs at most one call at a time; callers that arrive meanwhile wait for it and share its result."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.future = None
+
+    def do(self, fn):
+        with self.lock:
+            future = self.future
+            leader = future is None
+            if leader:
+                future = self.future = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.future = None
+
+
+def _etag_for(body):
+    return f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+
+
+class RealtimeCache:
+    """The realtime feed in memory, valid until the producer is expected to have replaced it."""
+
+    def __init__(self, url):
+        self.url = url
+        self.session = None
+        self.flight = SingleFlight()
+        self.current = None         # (body, ETag sent to clients), only ever replaced as a whole
+        self.upstream_etag = ""     # Validators for revalidating with GRT
+        self.upstream_last_modified = ""
+        self.header_timestamp = 0
+        self.expires_at = 0
+        self.cadences = deque(maxlen=PROXY_CADENCE_SAMPLES)
+        self.upstream_requests = 0
+        self.upstream_errors = 0
+
+    def cadence(self):
+        """Median seconds between feed updates, or None until two updates were seen."""
+        if not self.cadences:
+            return None
+        return max(bus.POLL_MIN_CADENCE, sorted(self.cadences)[len(self.cadences) // 2])
+
+    def get(self):
+        """Return (body, etag, seconds the copy stays fresh), fetching from GRT if it has expired."""
+        if self.current is None or bus.clock_time() >= self.expires_at:
+            try:
+                self.flight.do(self._refresh)
+            except Exception as e:
+                if self.current is None:
+                    raise
+                log.warning(f"Realtime feed unavailable, serving the cached copy: {e}")
+        body, etag = self.current
+        return body, etag, max(0, self.expires_at - bus.clock_time())
+
+    def _refresh(self):
+        # Another request may have refreshed it while this one waited for the lock
+        now = bus.clock_time()
+        if self.current is not None and now < self.expires_at:
+            return
+        if self.session is None:
+            self.session = bus.new_api_session()
+        headers = dict(PROXY_HEADERS)
+        if self.current is not None and self.upstream_etag:
+            headers['If-None-Match'] = self.upstream_etag
+        if self.current is not None and self.upstream_last_modified:
+            headers['If-Modified-Since'] = self.upstream_last_modified
+        self.upstream_requests += 1
+        try:
+            response = self.session.get(self.url, headers=headers, timeout=10)
+            response.raise_for_status()
+        except Exception:
+            self.upstream_errors += 1
+            self.expires_at = now + PROXY_RETRY_TTL
+            raise
+
+        if response.status_code != 304:
+            header_timestamp = bus.read_feed_header_timestamp(response.content)
+            if header_timestamp > self.header_timestamp:
+                if self.header_timestamp:
+                    self.cadences.append(header_timestamp - self.header_timestamp)
+                self.header_timestamp = header_timestamp
+            # One assignment, so handler threads never see the new body with the old ETag or the reverse
+            self.current = (response.content, _etag_for(response.content))
+            self.upstream_etag = response.headers.get('ETag', "")
+            self.upstream_last_modified = response.headers.get('Last-Modified', "")
+
+        # Fresh until the next update is due; if it is already overdue, check again shortly
+        cadence = self.cadence()
+        next_update = self.header_timestamp + cadence + bus.POLL_ALIGN_MARGIN if cadence and self.header_timestamp else 0
+        self.expires_at = next_update if next_update > now + PROXY_RETRY_TTL else now + PROXY_RETRY_TTL
+        log.debug(f"Realtime feed {'not modified' if response.status_code == 304 else 'fetched'} "
+                  f"(header {self.header_timestamp}), fresh for {self.expires_at - now:.0f} s")
+
+
+class StaticCache:
+    """The static GTFS zip on disk, revalidated with GRT every refresh_interval seconds."""
+
+    def __init__(self, url, cache_dir, refresh_interval):
+        self.url = url
+        self.path = cache_dir / "static_gtfs.zip"
+        self.meta_path = cache_dir / "static_gtfs_meta.json"
+        self.refresh_interval = refresh_interval
+        self.session = None
+        self.flight = SingleFlight()
+        # Held while the zip is replaced and its meta published, and while a handler opens the zip
+        # and reads its ETag, so the two always belong together
+        self.swap_lock = threading.Lock()
+        self.upstream_requests = 0
+        self.upstream_errors = 0
+        self.meta = {}
+        try:
+            if self.path.exists():
+                with open(self.meta_path, 'r') as f:
+                    self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = {}
+
+    def get(self):
+        """Return (the zip opened for reading, etag, seconds the copy stays fresh), revalidating it with GRT if it is due.
+        The caller closes the file.
+        """
+        if not self.meta or bus.clock_time() - self.meta.get("checked_at", 0) >= self.refresh_interval:
+            try:
+                self.flight.do(self._refresh)
+            except Exception as e:
+                if not self.meta:
+                    raise
+                log.warning(f"Static GTFS feed unavailable, serving the cached copy: {e}")
+        with self.swap_lock:
+            meta = self.meta
+            zip_file = open(self.path, 'rb')
+        return zip_file, meta["etag"], max(0, meta.get("checked_at", 0) + self.refresh_interval - bus.clock_time())
+
+    def _refresh(self):
+        if self.meta and bus.clock_time() - self.meta.get("checked_at", 0) < self.refresh_interval:
+            return
+        if self.session is None:
+            self.session = bus.new_api_session()
+        headers = dict(PROXY_HEADERS)
+        if self.meta.get("upstream_etag"):
+            headers['If-None-Match'] = self.meta["upstream_etag"]
+        if self.meta.get("upstream_last_modified"):
+            headers['If-Modified-Since'] = self.meta["upstream_last_modified"]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        self.upstream_requests += 1
+        try:
+            response = bus.download_to_file(self.session, self.url, tmp_path, headers, timeout=60)
+        except Exception:
+            self.upstream_errors += 1
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        meta = dict(self.meta, checked_at=bus.clock_time())
+        downloaded = response.status_code != 304 or not self.meta
+        if downloaded:
+            digest = hashlib.sha1()
+            with open(tmp_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(bus.STATIC_GTFS_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            meta.update(etag=f'"{digest.hexdigest()[:16]}"', upstream_etag=response.headers.get('ETag', ""),
+                        upstream_last_modified=response.headers.get('Last-Modified', ""))
+        tmp_meta = self.meta_path.with_suffix(".tmp")
+        with open(tmp_meta, 'w') as f:
+            json.dump(meta, f)
+        with self.swap_lock:
+            if downloaded:
+                # Readers hold the old file open, so replacing it under them is safe. The old meta goes
+                # first: a crash before the new one is in place must not pair the new zip with the old ETag
+                self.meta_path.unlink(missing_ok=True)
+                os.replace(tmp_path, self.path)
+            os.replace(tmp_meta, self.meta_path)
+            self.meta = meta
+        if downloaded:
+            log.info(f"Static GTFS feed downloaded ({self.path.stat().st_size / 1024:.0f} KB)")
+
+
+class _ProxyRequestHandler(BaseHTTPRequestHandler):
+    realtime = None
+    static = None
+    stats = None
+    stats_lock = None  # The handlers run on several pool threads at once
+    timeout = 60
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        self._count("requests")
+        self.headers_sent = False
+        try:
+            if path == "/rt":
+                body, etag, fresh = self.realtime.get()
+                if self._send_headers(etag, fresh, "application/x-protobuf", len(body)):
+                    self.wfile.write(body)
+            elif path == "/static":
+                zip_file, etag, fresh = self.static.get()
+                with zip_file as f:
+                    if self._send_headers(etag, fresh, "application/zip", os.fstat(f.fileno()).st_size):
+                        shutil.copyfileobj(f, self.wfile, bus.STATIC_GTFS_CHUNK_SIZE)
+            else:
+                self.send_error(404)
+        except (ConnectionError, TimeoutError):
+            pass  # Client went away
+        except Exception as e:
+            self._count("errors")
+            log.error(f"Upstream request for {path} failed: {e}")
+            if self.headers_sent:
+                # Too late for an error status: cut the response short so the client sees it failed
+                self.close_connection = True
+            else:
+                self.send_error(502)
+
+    def _count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def _send_headers(self, etag, fresh, content_type, length):
+        """Send a 304 if the client has etag, else the headers of a 200. Returns True if the body should follow."""
+        not_modified = etag in self.headers.get("If-None-Match", "")
+        if not_modified:
+            self._count("not_modified")
+        self.headers_sent = True
+        self.send_response(304 if not_modified else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", f"max-age={int(fresh)}")
+        if not_modified:
+            self.end_headers()
+            return False
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        return True
+
+    def log_message(self, format, *args):
+        pass  # Every client poll would otherwise be printed
+
+
+def start_proxy_server(host, port, workers, realtime, static):
+    """Serve realtime (RealtimeCache) on /rt and static (StaticCache) on /static from a daemon thread.
+    Returns the server; its stats dict counts client requests, 304s and errors.
+    """
+    stats = {"requests": 0, "not_modified": 0, "errors": 0}
+    handler = type("ProxyRequestHandler", (_ProxyRequestHandler,),
+                   {"realtime": realtime, "static": static, "stats": stats, "stats_lock": threading.Lock()})
+    server = ThreadPoolHTTPServer((host, port), handler, workers)
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, name="proxy-http", daemon=True).start()
+    return server
+
+
+def log_proxy_stats(server, realtime, static):
+    stats = server.stats
+    log.info(f"Proxy: {stats['requests']} client requests ({stats['not_modified']} not modified, {stats['errors']} failed); "
+             f"GRT requests: realtime {realtime.upstream_requests} ({realtime.upstream_errors} failed), "
+             f"static {static.upstream_requests} ({static.upstream_errors} failed); feed cadence {realtime.cadence() or '?'} s")
+
+
+def main():
+    args = sys.argv[1:]
+    port = int(args[args.index("--port") + 1]) if "--port" in args else bus.PROXY_PORT
+    setup_logging("bustime", bus.LOG_LEVEL)
+
+    realtime = RealtimeCache(bus.PROXY_API_URL)
+    static = StaticCache(bus.PROXY_STATIC_GTFS_URL, bus.PROXY_CACHE_DIR, bus.PROXY_STATIC_REFRESH_INTERVAL)
+    server = start_proxy_server(bus.PROXY_BIND, port, bus.PROXY_WORKERS, realtime, static)
+    log.info(f"Proxying {bus.PROXY_API_URL} at http://{bus.PROXY_BIND}:{port}/rt and {bus.PROXY_STATIC_GTFS_URL} at /static")
+    try:
+        while True:
+            time.sleep(PROXY_REPORT_INTERVAL)
+            log_proxy_stats(server, realtime, static)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        log_proxy_stats(server, realtime, static)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+In-memory stand-ins for the Raspberry Pi hardware used by bus_arrival_times.py.
+They let the sensor and display code run, be benchmarked and be tested off-device.
+"""
+
+import time
+import threading
+
+# Bytes raspberrypi-tm1637 clocks out for write() of 4 segments and for brightness()
+TM1637_WRITE_BYTES = 7
+TM1637_BRIGHTNESS_BYTES = 2
+
+
+class FakeGPIO:
+    """Replacement for the RPi.GPIO module with input levels set from code.
+    Pass an instance as CapacitiveSensorManager(gpio=...).
+    """
+    BCM = 11
+    IN = 1
+    OUT = 0
+
+    def __init__(self):
+        self.mode = None
+        self.levels = {}
+        self.reads = 0
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction):
+        self.levels.setdefault(pin, 0)
+
+    def remove_event_detect(self, pin):
+        pass
+
+    def input(self, pin):
+        self.reads += 1
+        return self.levels.get(pin, 0)
+
+    def cleanup(self):
+        self.levels.clear()
+
+    def set_input(self, pin, level):
+        """Drive an input pin high (1) or low (0)."""
+        self.levels[pin] = level
+
+    def press(self, pin, duration):
+        """Hold pin high for duration seconds, like a touch on the TTP223, without blocking."""
+        self.set_input(pin, 1)
+        timer = threading.Timer(duration, self.set_input, args=(pin, 0))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+
+class FakeTM1637:
+    """In-memory display backend with the TM1637Backend interface.
+    Records the frame on display and counts writes, bytes clocked out and their time cost.
+    byte_cost is an assumed time per byte on the real GPIO bus; it is added to time_cost, not slept.
+    """
+
+    def __init__(self, byte_cost=0.0):
+        self.byte_cost = byte_cost
+        self.frame = None
+        self.level = None
+        self.writes = 0
+        self.brightness_writes = 0
+        self.bytes_sent = 0
+        self.busy_time = 0.0
+
+    def write(self, segments):
+        start = time.perf_counter()
+        self.frame = bytes(segments)
+        self.writes += 1
+        self.bytes_sent += TM1637_WRITE_BYTES
+        self.busy_time += time.perf_counter() - start
+
+    def set_brightness(self, level):
+        start = time.perf_counter()
+        self.level = level
+        self.brightness_writes += 1
+        self.bytes_sent += TM1637_BRIGHTNESS_BYTES
+        self.busy_time += time.perf_counter() - start
+
+    @property
+    def time_cost(self):
+        """Seconds spent in the backend plus the assumed bus time of everything written."""
+        return self.busy_time + self.bytes_sent * self.byte_cost
@@ -7,5 +7,6 @@ cd "$(dirname "$0")" || exit 1
 # Activate virtual environment
 source venv/bin/activate
 
-# Run the Python script and log output
-python3 bus_arrival_times.py >> bustime.log 2>&1
+# Run the Python script; it writes its own rotated bustime.log, so only keep stderr
+# (startup errors and crashes) here
+python3 bus_arrival_times.py > /dev/null 2>> bustime-error.log
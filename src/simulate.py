@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Record GRT feed snapshots and replay them through the bus_arrival_times.py daemon off-device.
+Replays run on an accelerated clock with fake TM1637 displays and a fake GPIO, so a full day
+of service plays back in about a minute. Use them to soak-test memory growth, display churn
+and poll scheduling over 24-hour cycles.
+
+    record      Save the static GTFS zip and every changed realtime feed from the live API
+    synthesize  Write a synthetic day of snapshots (no network needed)
+    replay      Serve the snapshots from a local HTTP server and run the daemon against them
+
+Usage:
+    python3 simulate.py record DIR [--interval SECONDS] [--hours H]
+    python3 simulate.py synthesize DIR [--hours H] [--seed N]
+    python3 simulate.py replay DIR [--hours H] [--speed X] [--verbose]
+"""
+
+import sys
+import gzip
+import time
+import bisect
+import random
+import asyncio
+import logging
+import selectors
+import tempfile
+import threading
+import requests
+from pathlib import Path
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from google.transit import gtfs_realtime_pb2
+
+import bus_arrival_times as bus
+from bustime_logging import setup_logging
+from fake_hardware import FakeGPIO, FakeTM1637
+from benchmark import make_synthetic_static_zip, current_rss_kb
+
+# Seconds between polls of the live API while recording
+RECORD_INTERVAL = 30
+
+# How often the replay prints a progress line (simulated seconds)
+REPLAY_REPORT_INTERVAL = 3600
+
+# Longest real wait for a worker thread or network event before the loop checks again (seconds)
+WARP_POLL_INTERVAL = 0.05
+
+# Headers sent to the GRT API, as by bus_arrival_times.py
+API_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+
+
+class WarpSelector(selectors.DefaultSelector):
+    """Selector for WarpEventLoop: instead of sleeping until the next timer, moves the clock forward to it."""
+    loop = None
+
+    def select(self, timeout=None):
+        loop = self.loop
+        if loop.busy:
+            # Blocking work is running in a worker thread: wait for it in real time with the clock stopped
+            return super().select(WARP_POLL_INTERVAL if timeout is None else min(timeout, WARP_POLL_INTERVAL))
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            return super().select(WARP_POLL_INTERVAL)
+        if loop.speed:
+            time.sleep(timeout / loop.speed)
+        loop.advance(timeout)
+        return []
+
+
+class WarpEventLoop(asyncio.SelectorEventLoop):
+    """Event loop on a simulated clock, starting at start (seconds since the epoch).
+    Whenever every task is waiting, the clock jumps to the next timer; while work submitted with
+    asyncio.to_thread() runs, the clock stands still, so fetches take no simulated time.
+    With speed, each jump also sleeps for its length divided by speed (speed 0 = as fast as possible).
+    """
+    def __init__(self, start, speed=0):
+        selector = WarpSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self.virtual_time = start
+        self.speed = speed
+        self.busy = 0
+        # Epoch seconds as floats are only precise to about 0.2 us; timers must still count as due
+        self._clock_resolution = 1e-6
+
+    def time(self):
+        return self.virtual_time
+
+    def advance(self, seconds):
+        self.virtual_time += seconds
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self.busy += 1
+        # Runs on the loop once the result is in, after the waiting task has been woken
+        future.add_done_callback(self._work_done)
+        return future
+
+    def _work_done(self, future):
+        self.busy -= 1
+
+
+class SimulatedTimeFilter(logging.Filter):
+    """Stamps log records with the simulated time instead of the real time."""
+    def filter(self, record):
+        record.created = bus.clock_time()
+        record.msecs = record.created % 1 * 1000
+        return True
+
+
+def list_snapshots(directory):
+    """Return sorted [(header timestamp, path)] for the recorded feeds in directory/feeds."""
+    snapshots = []
+    for path in (Path(directory) / "feeds").glob("*.pb.gz"):
+        try:
+            snapshots.append((int(path.name.split(".")[0]), path))
+        except ValueError:
+            continue
+    return sorted(snapshots)
+
+
+def save_snapshot(directory, header_timestamp, data):
+    path = Path(directory) / "feeds" / f"{header_timestamp}.pb.gz"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "wb", compresslevel=1) as f:
+        f.write(data)
+    return path
+
+
+def record(directory, interval=RECORD_INTERVAL, hours=24):
+    """Save the static GTFS zip, then every realtime feed with a new header timestamp, for hours."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    session = bus.get_api_session()
+    static_path = directory / "static_gtfs.zip"
+    if not static_path.exists():
+        bus.download_to_file(session, bus.STATIC_GTFS_URL, static_path, API_HEADERS, timeout=60)
+        print(f"Saved static GTFS data to {static_path}")
+
+    end_time = time.time() + hours * 3600
+    last_timestamp = None
+    saved = 0
+    while time.time() < end_time:
+        try:
+            response = session.get(bus.API_URL, headers=API_HEADERS, timeout=10)
+            response.raise_for_status()
+            header_timestamp = bus.read_feed_header_timestamp(response.content) or int(time.time())
+            if header_timestamp != last_timestamp:
+                save_snapshot(directory, header_timestamp, response.content)
+                last_timestamp = header_timestamp
+                saved += 1
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] Saved feed {header_timestamp} ({len(response.content) / 1024:.0f} KB, {saved} so far)")
+        except requests.RequestException as e:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Fetch failed: {e}")
+        time.sleep(interval)
+
+
+def synthesize(directory, hours=24, interval=RECORD_INTERVAL, num_trips=10000, filler=300, seed=1):
+    """Write a synthetic recording: a static GTFS zip and a realtime feed every interval seconds for hours,
+    starting at 04:00 today. Predictions for the monitored stops drift from the timetable by a random walk
+    in the hour before arrival;
+    the same filler trip updates for other stops bring each feed up to a realistic size.
+    """
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    static_path = directory / "static_gtfs.zip"
+    static_path.write_bytes(make_synthetic_static_zip(num_trips, seed=seed))
+    trips = bus.build_stop_trip_index(static_path, bus.STOP_IDS).trips
+
+    midnight = datetime.combine(datetime.now(bus.LOCAL_TZ).date(), datetime.min.time(), bus.LOCAL_TZ)
+    start = int((midnight + timedelta(hours=4)).timestamp())
+    visits = sorted((int(midnight.timestamp()) + offset, trip_id, stop_id)
+                    for trip_id, trip in trips.items() for stop_id, offset in trip.stop_times if offset is not None)
+    # Same stops again the next service day
+    visits += [(t + 86400, trip_id, stop_id) for t, trip_id, stop_id in visits]
+    delays = {}
+
+    filler_feed = gtfs_realtime_pb2.FeedMessage()
+    for i in range(filler):
+        entity = filler_feed.entity.add()
+        entity.id = f"filler-{i}"
+        entity.trip_update.trip.trip_id = f"{9000000 + i}"
+        entity.trip_update.trip.route_id = str(100 + i % 38)
+        for j in range(25):
+            stop_time_update = entity.trip_update.stop_time_update.add()
+            stop_time_update.stop_sequence = j + 1
+            stop_time_update.stop_id = f"{rng.randint(1000, 9999)}"
+            stop_time_update.arrival.time = start + 90 * j + rng.randint(0, 600)
+    filler_entities = filler_feed.SerializePartialToString()
+
+    for t in range(start, start + int(hours * 3600), interval):
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.header.gtfs_realtime_version = "2.0"
+        feed.header.timestamp = t
+        for scheduled, trip_id, stop_id in visits[bisect.bisect_left(visits, (t - 120,)):bisect.bisect_left(visits, (t + 3 * 3600,))]:
+            delay = delays.get(trip_id, 0)
+            if scheduled - t < 3600:
+                # Drift in the last hour before arrival
+                delay += rng.choice((-15, 0, 0, 0, 15))
+                delays[trip_id] = delay
+            entity = feed.entity.add()
+            entity.id = f"{trip_id}-{stop_id}"
+            entity.trip_update.trip.trip_id = trip_id
+            entity.trip_update.trip.route_id = trips[trip_id].route_id
+            stop_time_update = entity.trip_update.stop_time_update.add()
+            stop_time_update.stop_id = stop_id
+            stop_time_update.arrival.time = scheduled + delay
+        # Serialized messages concatenate like a merge, appending the filler entities
+        save_snapshot(directory, t, feed.SerializeToString() + filler_entities)
+    print(f"Wrote {int(hours * 3600 / interval)} feeds and {len(trips)} stop trips to {directory}")
+
+
+class ReplayServer:
+    """Local HTTP server standing in for the GRT API during a replay.
+    /rt serves the latest snapshot at or before the simulated time, with an ETag so unchanged
+    feeds get a 304; /static serves the recorded static GTFS zip.
+    """
+    def __init__(self, directory):
+        self.snapshots = list_snapshots(directory)
+        if not self.snapshots:
+            raise FileNotFoundError(f"No feeds recorded in {Path(directory) / 'feeds'}")
+        self.timestamps = [timestamp for timestamp, _ in self.snapshots]
+        self.static_zip = (Path(directory) / "static_gtfs.zip").read_bytes()
+        self.current = (None, b"")  # Last snapshot served, decompressed
+        self.lock = threading.Lock()
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path.startswith("/static"):
+                    etag, body = '"static"', server.static_zip
+                else:
+                    timestamp, body = server.snapshot_at(bus.clock_time())
+                    etag = f'"{timestamp}"'
+                    server.requests += 1
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def snapshot_at(self, timestamp):
+        """Return (header timestamp, feed bytes) of the latest snapshot at or before timestamp (else the first)."""
+        index = max(0, bisect.bisect_right(self.timestamps, timestamp) - 1)
+        with self.lock:
+            if self.current[0] != self.timestamps[index]:
+                with gzip.open(self.snapshots[index][1], "rb") as f:
+                    self.current = (self.timestamps[index], f.read())
+            return self.current
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+async def run_replay(server, backends, gpio, end_time):
+    """Run the daemon until end_time (simulated), printing a progress line every REPLAY_REPORT_INTERVAL."""
+    loop = asyncio.get_running_loop()
+    daemon = asyncio.create_task(bus.run_daemon(backends=backends, gpio=gpio))
+    start_rss = current_rss_kb()
+    print(f"{'time':<18}{'requests':>9}{'parsed':>8}{'writes':>8}{'brightness':>11}{'RSS MB':>8}")
+    while loop.time() < end_time and not daemon.done():
+        await asyncio.sleep(min(REPLAY_REPORT_INTERVAL, end_time - loop.time()))
+        print(f"{bus.clock_now(bus.LOCAL_TZ).strftime('%a %H:%M'):<18}{server.requests:>9}{bus.REALTIME_FEED_STATS['parsed']:>8}"
+              f"{sum(b.writes for b in backends):>8}{sum(b.brightness_writes for b in backends):>11}{current_rss_kb() / 1024:>8.1f}")
+    if daemon.done():
+        daemon.result()
+    daemon.cancel()
+    try:
+        await daemon
+    except asyncio.CancelledError:
+        pass
+    return start_rss
+
+
+def replay(directory, hours=None, speed=0, verbose=False):
+    """Replay the recording in directory through run_daemon() on an accelerated clock."""
+    server = ReplayServer(directory)
+    start = server.timestamps[0]
+    end_time = start + hours * 3600 if hours else server.timestamps[-1]
+
+    ring = setup_logging("bustime", "INFO" if verbose else "WARNING", console=True)
+    log_filter = SimulatedTimeFilter()
+    for handler in logging.getLogger("bustime").handlers:
+        handler.addFilter(log_filter)
+
+    loop = WarpEventLoop(start, speed)
+    bus.set_clock(loop.time)
+    # Everything the daemon touches outside the process points at the replay server or a scratch directory
+    bus.API_URL = f"{server.url}/rt"
+    bus.STATIC_GTFS_URL = f"{server.url}/static"
+    bus.METRICS_PORT = 0
+    bus.API_PORT = 0
+    bus.PUSH_MODE = "off"
+    bus.CONFIG_CHECK_INTERVAL = 0  # The replay runs the config it started with, whatever happens to config.txt
+    bus.STATUS_FILE = ""
+    backends = [FakeTM1637() for _ in bus.DISPLAYS]
+    gpio = FakeGPIO()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        bus.STATIC_GTFS_CACHE_DIR = Path(cache_dir)
+        bus.STATIC_GTFS_CACHE_ZIP = bus.STATIC_GTFS_CACHE_DIR / "static_gtfs.zip"
+        bus.STATIC_GTFS_CACHE_META = bus.STATIC_GTFS_CACHE_DIR / "static_gtfs_meta.json"
+        bus.STATIC_GTFS_CACHE_INDEX = bus.STATIC_GTFS_CACHE_DIR / "stop_index.json"
+        bus.ARRIVALS_SNAPSHOT_FILE = bus.STATIC_GTFS_CACHE_DIR / "arrivals.json"
+        bus.ARCHIVE_DIR = str(Path(cache_dir) / "archive")
+        # Load the static data up front, as a warm start from the on-disk cache would on the Pi
+        bus.refresh_static_gtfs_data()
+
+        real_start = time.perf_counter()
+        try:
+            start_rss = loop.run_until_complete(run_replay(server, backends, gpio, end_time))
+        finally:
+            loop.close()
+            server.close()
+            bus.set_clock(time.time)
+        archive_bytes = sum(path.stat().st_size for path in Path(bus.ARCHIVE_DIR).glob("*.bin"))
+
+    real_time = time.perf_counter() - real_start
+    simulated = end_time - start
+    print(f"\nReplayed {simulated / 3600:.1f} h in {real_time:.1f} s ({simulated / real_time:.0f}x real time)")
+    print(f"Requests: {server.requests} ({server.requests * 86400 / simulated:.0f}/day), feeds parsed: {bus.REALTIME_FEED_STATS['parsed']}, "
+          f"304: {bus.REALTIME_FEED_STATS['not_modified']}, unchanged header: {bus.REALTIME_FEED_STATS['unchanged_header']}")
+    print(f"Display writes: {sum(b.writes for b in backends)}, brightness changes: {sum(b.brightness_writes for b in backends)}")
+    print(f"RSS: {start_rss / 1024:.1f} MB at start, {current_rss_kb() / 1024:.1f} MB at end; "
+          f"{len(ring.records)} log records buffered")
+    print(f"Prediction archive: {archive_bytes / 1024:.0f} KB ({archive_bytes * 86400 / simulated / 1024:.0f} KB/day)")
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ("record", "synthesize", "replay"):
+        print("Usage:" + __doc__.split("Usage:")[1].rstrip())
+        sys.exit(1)
+    command, directory, options = args[0], args[1], args[2:]
+
+    def option(name, default, convert=float):
+        if name in options:
+            return convert(options[options.index(name) + 1])
+        return default
+
+    if command == "record":
+        record(directory, option("--interval", RECORD_INTERVAL, int), option("--hours", 24))
+    elif command == "synthesize":
+        synthesize(directory, option("--hours", 24), seed=option("--seed", 1, int))
+    else:
+        replay(directory, option("--hours", None), option("--speed", 0), "--verbose" in options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Explore any GRT stop: which routes and headsigns serve it and when the next buses arrive.
+Answers come from a persistent index of every stop, built once from the static GTFS zip that
+bus_arrival_times.py keeps in STATIC_GTFS_CACHE_DIR, and from a cached copy of the realtime
+feed, so a lookup takes milliseconds and needs no network while both are fresh. The daemon's
+cache is only read: the index, the realtime feed and, if the daemon's zip is missing or older
+than STATIC_GTFS_REFRESH_INTERVAL, a zip of the explorer's own are kept in an explorer/
+subdirectory, under a file lock. The realtime feed is downloaded again when the cached copy is
+older than REALTIME_MAX_AGE.
+
+Arrivals with a live prediction are shown first; the timetable fills in the rest (marked *).
+
+Usage:
+    python3 stop_explorer.py STOP_ID [STOP_ID ...] [--count N] [--offline]
+    python3 stop_explorer.py [--count N] [--offline]     (interactive: browse stops by ID or name)
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import sqlite3
+import zipfile
+import contextlib
+from datetime import datetime, timezone
+
+import bus_arrival_times as bus
+from bustime_logging import setup_logging
+
+# Arrivals shown per route and headsign
+ARRIVAL_COUNT = 3
+# Age of the cached realtime feed (by its header timestamp) up to which it is used without a download (seconds)
+REALTIME_MAX_AGE = 60
+# Stops listed for a name search in interactive mode
+SEARCH_LIMIT = 10
+
+INDEX_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE stops (stop_id TEXT PRIMARY KEY, name TEXT);
+CREATE TABLE trips (trip_id TEXT PRIMARY KEY, route_id TEXT, headsign TEXT, service_id TEXT) WITHOUT ROWID;
+CREATE TABLE stop_times (stop_id TEXT, trip_id TEXT, arrival INTEGER, PRIMARY KEY (stop_id, trip_id, arrival)) WITHOUT ROWID;
+CREATE TABLE calendar (service_id TEXT PRIMARY KEY, service TEXT);
+"""
+
+
+def cache_dir():
+    """Directory of the explorer's own files: its index, realtime feed and any static zip it downloaded.
+    The daemon's files in STATIC_GTFS_CACHE_DIR are only ever read, never written.
+    """
+    return bus.STATIC_GTFS_CACHE_DIR / "explorer"
+
+
+def index_path():
+    return cache_dir() / "stop_index.sqlite"
+
+
+def realtime_path():
+    return cache_dir() / "realtime_feed.pb"
+
+
+def own_zip_path():
+    return cache_dir() / "static_gtfs.zip"
+
+
+def own_meta_path():
+    return cache_dir() / "static_gtfs_meta.json"
+
+
+@contextlib.contextmanager
+def cache_lock():
+    """Hold an exclusive lock on the explorer's cache, so explorers running at once take turns writing it."""
+    cache_dir().mkdir(parents=True, exist_ok=True)
+    with open(cache_dir() / "lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def read_zip_meta(zip_path):
+    """Return the current metadata of the daemon's (STATIC_GTFS_CACHE_ZIP) or the explorer's own cached zip,
+    or an empty dictionary if it has none.
+    """
+    if zip_path == bus.STATIC_GTFS_CACHE_ZIP:
+        return bus.read_static_cache_meta()
+    try:
+        with open(own_meta_path(), 'r') as f:
+            return json.load(f) if zip_path.exists() else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def download_static_zip(meta):
+    """Revalidate (with meta's validators) or download the static GTFS zip into the explorer's cache.
+    Returns the new metadata. Call with cache_lock() held.
+    """
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    if meta.get("etag"):
+        headers['If-None-Match'] = meta["etag"]
+    if meta.get("last_modified"):
+        headers['If-Modified-Since'] = meta["last_modified"]
+    tmp_path = own_zip_path().with_suffix(".tmp")
+    response = bus.download_to_file(bus.new_api_session(), bus.STATIC_GTFS_URL, tmp_path, headers, timeout=30)
+    now = bus.clock_time()
+    if response.status_code == 304 and meta:
+        meta = dict(meta, checked_at=now)
+    else:
+        # The old validators must not outlive the zip they describe, even if this is interrupted
+        own_meta_path().unlink(missing_ok=True)
+        os.replace(tmp_path, own_zip_path())
+        meta = {
+            "etag": response.headers.get('ETag', ""),
+            "last_modified": response.headers.get('Last-Modified', ""),
+            "downloaded_at": now,
+            "checked_at": now,
+        }
+    tmp_meta = own_meta_path().with_suffix(".tmp")
+    with open(tmp_meta, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, own_meta_path())
+    return meta
+
+
+def ensure_static_zip(offline=False):
+    """Return (zip path, metadata) of the freshest cached static GTFS zip: the daemon's or the explorer's own.
+    If both are missing or older than STATIC_GTFS_REFRESH_INTERVAL, the explorer's own copy is
+    revalidated or downloaded first (unless offline). Returns (None, {}) if there is no zip at all.
+    """
+    sources = [(zip_path, read_zip_meta(zip_path)) for zip_path in (bus.STATIC_GTFS_CACHE_ZIP, own_zip_path())]
+    sources = sorted((source for source in sources if source[1]), key=lambda source: source[1].get("checked_at", 0), reverse=True)
+    fresh = [source for source in sources if bus.clock_time() - source[1].get("checked_at", 0) <= bus.STATIC_GTFS_REFRESH_INTERVAL]
+    # Of two fresh copies, keep using the one already indexed rather than indexing the other
+    for zip_path, meta in fresh:
+        db = _open_built_index(zip_path, meta)
+        if db is not None:
+            db.close()
+            return zip_path, meta
+    if fresh or (sources and offline):
+        return sources[0]
+    if offline:
+        return None, {}
+
+    import requests  # Deferred like in bus_arrival_times.py: a fresh cache needs no HTTP stack
+    with cache_lock():
+        # Another explorer may have downloaded it while this one waited for the lock
+        meta = read_zip_meta(own_zip_path())
+        if meta and bus.clock_time() - meta.get("checked_at", 0) <= bus.STATIC_GTFS_REFRESH_INTERVAL:
+            return own_zip_path(), meta
+        print("Checking the static GTFS data for updates..." if meta else "Downloading the static GTFS data...")
+        try:
+            return own_zip_path(), download_static_zip(meta)
+        except (requests.RequestException, OSError) as e:
+            print(f"Could not download the static GTFS data ({e}), using the cached copy.", file=sys.stderr)
+            return sources[0] if sources else (None, {})
+
+
+def build_index(path, zip_file, zip_path, meta):
+    """Build the all-stops index at path from the open static GTFS zip_file (zip_path, described by meta)."""
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.unlink(missing_ok=True)
+    db = sqlite3.connect(tmp_path)
+    try:
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.executescript(INDEX_SCHEMA)
+        columns = ('trip_id', 'stop_id', 'arrival_time', 'departure_time')
+        visits = ((stop_id, trip_id, bus.parse_gtfs_time(arrival or departure))
+                  for trip_id, stop_id, arrival, departure in bus.iter_gtfs_rows(zip_file, 'stop_times.txt', columns))
+        db.executemany("INSERT OR IGNORE INTO stop_times VALUES (?, ?, ?)",
+                       (visit for visit in visits if visit[0] and visit[1] and visit[2] is not None))
+        db.executemany("INSERT OR IGNORE INTO trips VALUES (?, ?, ?, ?)",
+                       (row for row in bus.iter_gtfs_rows(zip_file, 'trips.txt', ('trip_id', 'route_id', 'trip_headsign', 'service_id'))
+                        if row[0]))
+        db.executemany("INSERT INTO calendar VALUES (?, ?)",
+                       ((service_id, json.dumps(service)) for service_id, service in bus.read_gtfs_calendar(zip_file).items()))
+        if 'stops.txt' in zip_file.namelist():
+            db.executemany("INSERT OR IGNORE INTO stops VALUES (?, ?)",
+                           (row for row in bus.iter_gtfs_rows(zip_file, 'stops.txt', ('stop_id', 'stop_name')) if row[0]))
+        db.executemany("INSERT INTO meta VALUES (?, ?)",
+                       [("source", str(zip_path)), ("downloaded_at", meta.get("downloaded_at")),
+                        ("feed_version", meta.get("feed_version", ""))])
+        db.commit()
+    finally:
+        db.close()
+    os.replace(tmp_path, path)
+
+
+def _index_built_from(db):
+    """Return (source zip path, downloaded_at) of the download the index in db was built from."""
+    built_from = dict(db.execute("SELECT key, value FROM meta WHERE key IN ('source', 'downloaded_at')"))
+    return built_from.get("source"), built_from.get("downloaded_at")
+
+
+def _open_built_index(zip_path, meta):
+    """Return a read-only connection to the index if it was built from zip_path's download described by meta, else None."""
+    try:
+        db = sqlite3.connect(f"file:{index_path()}?mode=ro", uri=True)
+        if _index_built_from(db) == (str(zip_path), meta.get("downloaded_at")):
+            return db
+        db.close()
+    except sqlite3.Error:
+        pass
+    return None
+
+
+def open_index(zip_path, meta):
+    """Return a connection to the all-stops index for zip_path (described by meta), building it if it is
+    missing or was built from another download. Returns None if the zip was replaced since meta was read.
+    """
+    db = _open_built_index(zip_path, meta)
+    if db is not None:
+        return db
+
+    with cache_lock():
+        db = _open_built_index(zip_path, meta)
+        if db is not None:
+            return db
+        # The open zip stays readable if the daemon replaces it meanwhile; checking the metadata
+        # after opening it makes sure the index is labelled with the download it was built from
+        with zipfile.ZipFile(zip_path) as zip_file:
+            if read_zip_meta(zip_path).get("downloaded_at") != meta.get("downloaded_at"):
+                return None
+            print("Indexing every stop in the static GTFS data (once per download)...")
+            start = time.perf_counter()
+            build_index(index_path(), zip_file, zip_path, meta)
+            print(f"Indexed in {time.perf_counter() - start:.1f} s.")
+    return sqlite3.connect(f"file:{index_path()}?mode=ro", uri=True)
+
+
+def load_realtime_feed(offline=False):
+    """Return (feed bytes, header timestamp, how it was obtained), or (None, 0, reason) without a feed.
+    The cached copy is used while it is at most REALTIME_MAX_AGE old (or always, offline);
+    otherwise the feed is downloaded from API_URL and cached, falling back to the stale copy.
+    """
+    path = realtime_path()
+    try:
+        data = path.read_bytes()
+        header_timestamp = bus.read_feed_header_timestamp(data)
+    except (OSError, ValueError, IndexError):
+        data, header_timestamp = None, 0
+    if data is not None and (offline or bus.clock_time() - header_timestamp <= REALTIME_MAX_AGE):
+        return data, header_timestamp, "cached"
+    if offline:
+        return None, 0, "offline"
+
+    import requests  # Deferred like in bus_arrival_times.py: a cached feed needs no HTTP stack
+    try:
+        response = bus.new_api_session().get(bus.API_URL, headers={
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        }, timeout=10)
+        response.raise_for_status()
+        header_timestamp = bus.read_feed_header_timestamp(response.content)
+    except (requests.RequestException, ValueError, IndexError) as e:
+        if data is not None:
+            return data, header_timestamp, f"stale, download failed: {e}"
+        return None, 0, f"download failed: {e}"
+    with cache_lock():
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(response.content)
+        os.replace(tmp_path, path)
+    return response.content, header_timestamp, "downloaded"
+
+
+class StopExplorer:
+    """Looks up the routes, headsigns and next arrivals of any stop in the all-stops index,
+    with live predictions from one realtime feed.
+    """
+    def __init__(self, db, feed=None):
+        self.db = db
+        self.feed = feed
+        self.calendar = {service_id: json.loads(service) for service_id, service in db.execute("SELECT service_id, service FROM calendar")}
+
+    def stop_name(self, stop_id):
+        row = self.db.execute("SELECT name FROM stops WHERE stop_id = ?", (stop_id,)).fetchone()
+        return row[0] if row else ""
+
+    def search(self, text, limit=SEARCH_LIMIT):
+        """Return up to limit (stop_id, name) whose name contains text (case-insensitive)."""
+        return self.db.execute("SELECT stop_id, name FROM stops WHERE name LIKE ? ORDER BY name LIMIT ?",
+                               (f"%{text}%", limit)).fetchall()
+
+    def static_data(self, stop_id):
+        """Return StaticGTFSData for the trips calling at stop_id, like the daemon's stop trip index."""
+        trips = {}
+        query = "SELECT trip_id, route_id, headsign, service_id, arrival FROM stop_times JOIN trips USING (trip_id) WHERE stop_id = ?"
+        for trip_id, route_id, headsign, service_id, arrival in self.db.execute(query, (stop_id,)):
+            trip = trips.get(trip_id)
+            stop_times = (trip.stop_times if trip else ()) + ((stop_id, arrival),)
+            trips[trip_id] = bus.StopTrip(route_id, headsign, service_id, stop_times)
+        return bus.StaticGTFSData(trips, {trip.service_id: self.calendar.get(trip.service_id, {"added": [], "removed": []})
+                                          for trip in trips.values()})
+
+    def predictions(self, stop_id):
+        """Return the StopTimePredictions for stop_id in the realtime feed (all routes)."""
+        if self.feed is None:
+            return []
+        try:
+            return bus.scan_trip_updates(self.feed, {stop_id})[2]
+        except (ValueError, IndexError, UnicodeDecodeError):
+            return bus.parse_trip_updates(self.feed, {stop_id})[2]
+
+    def next_arrivals(self, stop_id, count=ARRIVAL_COUNT, now=None):
+        """Return {(route_id, headsign): [arrival dicts]} for every route and headsign serving stop_id,
+        each with up to count future arrivals sorted by time. Arrival dicts have the same keys as
+        the daemon's; "scheduled" is True for timetable arrivals without a live prediction.
+        """
+        now = bus.clock_time() if now is None else now
+        static_data = self.static_data(stop_id)
+        groups = {(trip.route_id, trip.headsign): [] for trip in static_data.trips.values()}
+
+        live_trips = set()
+        for prediction in self.predictions(stop_id):
+            if prediction.timestamp <= now:
+                continue
+            trip = static_data.trips.get(prediction.trip_id)
+            headsign = trip.headsign if trip else ""
+            live_trips.add(prediction.trip_id)
+            groups.setdefault((prediction.route_id, headsign), []).append(
+                arrival_dict(stop_id, prediction.route_id, prediction.trip_id, headsign, prediction.timestamp, False))
+
+        # An empty headsign means all headsigns to the timetable, so only routes without any get scheduled
+        # arrivals under it (live trips missing from the static data also end up there)
+        headsign_routes = {route_id for route_id, headsign in groups if headsign}
+        timetable = bus.ScheduleTimetable(static_data)
+        for (route_id, headsign), arrivals in groups.items():
+            if headsign or route_id not in headsign_routes:
+                for timestamp, trip_id, _ in timetable.next_arrivals(stop_id, route_id, headsign, now, count + len(arrivals)):
+                    if trip_id not in live_trips:
+                        arrivals.append(arrival_dict(stop_id, route_id, trip_id, headsign, timestamp, True))
+            arrivals.sort(key=lambda arrival: arrival["timestamp"])
+            del arrivals[count:]
+        return dict(sorted(groups.items(), key=lambda item: (route_sort_key(item[0][0]), item[0][1])))
+
+
+def arrival_dict(stop_id, route_id, trip_id, headsign, timestamp, scheduled):
+    return {
+        "time": datetime.fromtimestamp(timestamp, tz=timezone.utc),
+        "route_id": route_id,
+        "stop_id": stop_id,
+        "trip_id": trip_id,
+        "headsign": headsign,
+        "timestamp": timestamp,
+        "scheduled": scheduled,
+    }
+
+
+def route_sort_key(route_id):
+    """Sort routes numerically where possible (2, 7, 12, 201 rather than 12, 2, 201, 7)."""
+    return (0, int(route_id), "") if route_id.isdigit() else (1, 0, route_id)
+
+
+def print_stop(explorer, stop_id, count=ARRIVAL_COUNT):
+    """Print the routes, headsigns and next arrivals of stop_id. Returns False if no trip serves it."""
+    start = time.perf_counter()
+    groups = explorer.next_arrivals(stop_id, count)
+    elapsed = time.perf_counter() - start
+    if not groups:
+        print(f"No trips serve stop {stop_id}.")
+        return False
+
+    name = explorer.stop_name(stop_id)
+    print(f"\nStop {stop_id}" + (f" ({name})" if name else ""))
+    width = max(len(headsign or "(no headsign)") for _, headsign in groups)
+    for (route_id, headsign), arrivals in groups.items():
+        times = "  ".join(arrival["time"].astimezone(bus.LOCAL_TZ).strftime("%H:%M") + ("*" if arrival["scheduled"] else " ")
+                          for arrival in arrivals)
+        print(f"  {route_id:>5}  {(headsign or '(no headsign)'):<{width}}  {times or '-'}")
+    print(f"  (* scheduled, no live prediction; answered in {elapsed * 1000:.1f} ms)")
+    return True
+
+
+def interactive(explorer, count, offline):
+    """Prompt for stop IDs or names until an empty line or end of input."""
+    print('Enter a stop ID, part of a stop name, "r" to reload the realtime feed, or nothing to quit.')
+    while True:
+        try:
+            query = input("\nstop> ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            return
+        if not query:
+            return
+        if query == "r":
+            explorer.feed, header_timestamp, source = load_realtime_feed(offline)
+            print(describe_feed(explorer.feed, header_timestamp, source))
+        elif explorer.db.execute("SELECT 1 FROM stop_times WHERE stop_id = ? LIMIT 1", (query,)).fetchone():
+            print_stop(explorer, query, count)
+        else:
+            matches = explorer.search(query)
+            if not matches:
+                print(f"No stop with ID or name {query!r}.")
+            for stop_id, name in matches:
+                print(f"  {stop_id:>6}  {name}")
+
+
+def describe_feed(feed, header_timestamp, source):
+    if feed is None:
+        return f"No realtime feed ({source}), showing scheduled arrivals only."
+    return f"Realtime feed from {max(0, bus.clock_time() - header_timestamp):.0f} s ago ({source})."
+
+
+def open_explorer(offline=False):
+    """Return a StopExplorer over the freshest cached static GTFS zip and the cached realtime feed,
+    updating either first if it is stale (unless offline). Exits if there is no static data.
+    """
+    db = None
+    for _ in range(3):  # The daemon may replace its zip while it is being indexed
+        zip_path, meta = ensure_static_zip(offline)
+        if not meta:
+            print("No static GTFS data cached" + (" (run without --offline to download it)." if offline else "."), file=sys.stderr)
+            sys.exit(1)
+        db = open_index(zip_path, meta)
+        if db is not None:
+            break
+    if db is None:
+        print("The static GTFS data kept changing while it was being indexed, try again.", file=sys.stderr)
+        sys.exit(1)
+    explorer = StopExplorer(db)
+    explorer.feed, header_timestamp, source = load_realtime_feed(offline)
+    print(describe_feed(explorer.feed, header_timestamp, source))
+    return explorer
+
+
+def main():
+    args = sys.argv[1:]
+    offline = "--offline" in args
+    count = ARRIVAL_COUNT
+    if "--count" in args:
+        position = args.index("--count")
+        try:
+            count = int(args[position + 1])
+        except (IndexError, ValueError):
+            print("Usage:" + __doc__.split("Usage:")[1].rstrip())
+            sys.exit(1)
+        del args[position:position + 2]
+    stop_ids = [arg for arg in args if not arg.startswith("--")]
+
+    setup_logging("bustime", "WARNING")
+    explorer = open_explorer(offline)
+    if not stop_ids:
+        interactive(explorer, count, offline)
+        return
+    for stop_id in stop_ids:
+        print_stop(explorer, stop_id, count)
+
+
+if __name__ == "__main__":
+    main()
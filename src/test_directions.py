@@ -1,345 +1,52 @@
 #!/usr/bin/env python3
 """
-Test program to fetch and display all bus arrivals with their headsigns (destinations).
-This helps determine which headsign to use in the config file.
-Uses static GTFS data to get destination/direction information.
+Show the routes and headsigns (destinations) serving each display's stop, with the next arrivals,
+to help pick the DISPLAYn_HEADSIGN values in config.txt.
+Built on stop_explorer.py, so it reads the same cached static GTFS data and realtime feed and only
+downloads them when they are stale. Use stop_explorer.py directly to browse other stops.
+
+Usage:
+    python3 test_directions.py [--offline]
 """
 
-import requests
-from datetime import datetime, timezone
-from google.transit import gtfs_realtime_pb2
-import urllib3
-import ssl
-from requests.adapters import HTTPAdapter
-from urllib3.util.ssl_ import create_urllib3_context
 import sys
-import os
-from zoneinfo import ZoneInfo
-from pathlib import Path
-import csv
-import zipfile
-import io
-
-# Disable SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-
-def load_config():
-    """Load configuration from config.txt file."""
-    config_path = Path(__file__).parent / "config.txt"
-    
-    if not config_path.exists():
-        raise FileNotFoundError(f"Configuration file not found: {config_path}")
-    
-    config = {}
-    
-    with open(config_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            
-            if '=' in line:
-                key, value = line.split('=', 1)
-                key = key.strip()
-                value = value.strip()
-                
-                if value.lower() == 'true':
-                    config[key] = True
-                elif value.lower() == 'false':
-                    config[key] = False
-                else:
-                    try:
-                        if '.' in value:
-                            config[key] = float(value)
-                        else:
-                            config[key] = int(value)
-                    except ValueError:
-                        config[key] = value
-    
-    return config
-
-
-class DH_KeyAdapter(HTTPAdapter):
-    """Custom adapter to allow weak DH keys for older servers"""
-    def init_poolmanager(self, *args, **kwargs):
-        ctx = create_urllib3_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        ctx.set_ciphers('DEFAULT@SECLEVEL=1')
-        kwargs['ssl_context'] = ctx
-        return super().init_poolmanager(*args, **kwargs)
-
-
-def get_api_session():
-    """Get or create the API session."""
-    session = requests.Session()
-    session.mount("https://", DH_KeyAdapter())
-    return session
-
+from collections import Counter
 
-def load_static_gtfs_directions(static_gtfs_url):
-    """
-    Load trip-to-direction mapping from static GTFS data.
-    Returns a dictionary mapping trip_id to (direction_id, trip_headsign).
-    """
-    trip_to_direction = {}
-    
-    try:
-        print("[INFO] Loading static GTFS data for direction mapping...")
-        session = get_api_session()
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        # Download the static GTFS zip file
-        response = session.get(static_gtfs_url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        # Extract and parse the trips.txt file
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
-            # Read trips.txt to get trip_id -> direction_id and headsign mapping
-            with zip_file.open('trips.txt') as f:
-                reader = csv.DictReader(io.TextIOWrapper(f, encoding='utf-8'))
-                for row in reader:
-                    trip_id = row.get('trip_id')
-                    direction_id = row.get('direction_id')
-                    headsign = row.get('trip_headsign', '')
-                    if trip_id:
-                        try:
-                            dir_id = int(direction_id) if direction_id else None
-                        except (ValueError, TypeError):
-                            dir_id = None
-                        trip_to_direction[trip_id] = {
-                            'direction_id': dir_id,
-                            'headsign': headsign
-                        }
-        
-        print(f"[INFO] Loaded {len(trip_to_direction)} trip-direction mappings from static GTFS data.\n")
-        return trip_to_direction
-    
-    except Exception as e:
-        print(f"[ERROR] Failed to load static GTFS data: {e}")
-        return {}
+import bus_arrival_times as bus
+import stop_explorer
+from bustime_logging import setup_logging
 
 
 def test_directions():
-    """Fetch and display all bus arrivals with their headsigns (destinations)."""
-    try:
-        config = load_config()
-    except FileNotFoundError as e:
-        print(f"Error: {e}")
-        print("Please create a config.txt file in the src directory.")
-        sys.exit(1)
-    
-    # Extract configuration
-    API_URL = config.get("API_URL", "https://webapps.regionofwaterloo.ca/api/grt-routes/api/tripupdates/1")
-    STATIC_GTFS_URL = config.get("STATIC_GTFS_URL", "https://webapps.regionofwaterloo.ca/api/grt-routes/api/staticfeeds/1")
-    STOP_ID = str(config.get("STOP_ID", "2783"))
-    LOCAL_TZ = ZoneInfo(config.get("LOCAL_TZ", "America/Toronto"))
-    DISPLAY1_ROUTE = str(config.get("DISPLAY1_ROUTE", "12"))
-    DISPLAY2_ROUTE = str(config.get("DISPLAY2_ROUTE", "19"))
-    
-    # Load static GTFS data to get direction mappings
-    trip_to_direction = load_static_gtfs_directions(STATIC_GTFS_URL)
-    
-    print(f"[INFO] Fetching bus data for stop {STOP_ID}...")
-    print(f"[INFO] Looking for routes: {DISPLAY1_ROUTE}, {DISPLAY2_ROUTE}\n")
-    
-    try:
-        session = get_api_session()
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        response = session.get(API_URL, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        # Parse the protobuf message
-        feed = gtfs_realtime_pb2.FeedMessage()
-        feed.ParseFromString(response.content)
-        
-        # Collect all arrival data
-        all_arrivals = []
-        
-        for entity in feed.entity:
-            if entity.HasField("trip_update"):
-                trip_update = entity.trip_update
-                
-                for stop_time_update in trip_update.stop_time_update:
-                    if str(stop_time_update.stop_id) == STOP_ID:
-                        # Get arrival time
-                        if stop_time_update.HasField("arrival"):
-                            timestamp = stop_time_update.arrival.time
-                        elif stop_time_update.HasField("departure"):
-                            timestamp = stop_time_update.departure.time
-                        else:
-                            continue
-                        
-                        arrival_time = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-                        route_id = trip_update.trip.route_id
-                        trip_id = trip_update.trip.trip_id
-                        # Get direction_id and headsign from static GTFS data mapping
-                        trip_info = trip_to_direction.get(trip_id, {})
-                        direction_id = trip_info.get('direction_id')
-                        headsign = trip_info.get('headsign', '')
-                        
-                        all_arrivals.append({
-                            "time": arrival_time,
-                            "route_id": route_id,
-                            "trip_id": trip_id,
-                            "direction_id": direction_id,
-                            "headsign": headsign,
-                            "timestamp": timestamp
-                        })
-        
-        # Filter to future arrivals and sort
-        now_timestamp = datetime.now(timezone.utc).timestamp()
-        future_arrivals = [a for a in all_arrivals if a["timestamp"] > now_timestamp]
-        future_arrivals.sort(key=lambda x: x["timestamp"])
-        
-        if not future_arrivals:
-            print("No upcoming arrivals found.")
-            return
-        
-        # Group by route
-        routes = {}
-        for arrival in future_arrivals:
-            route = arrival["route_id"]
-            if route not in routes:
-                routes[route] = []
-            routes[route].append(arrival)
-        
-        # Display results
-        print(f"Found {len(future_arrivals)} upcoming arrivals\n")
-        
-        for route in sorted(routes.keys()):
-            arrivals = routes[route]
-            print(f"\n{'='*80}")
-            print(f"ROUTE {route}")
-            print(f"{'='*80}")
-            
-            # Group by headsign (destination/direction name)
-            # Use headsign since direction_id is all 0s in GRT data
-            directions = {}
-            for arrival in arrivals:
-                headsign = arrival.get("headsign", "Unknown")
-                if headsign not in directions:
-                    directions[headsign] = []
-                directions[headsign].append(arrival)
-            
-            # Get all unique headsigns (sorted)
-            headsign_list = sorted([h for h in directions.keys() if h])  # Filter out empty strings
-            
-            # Check if any trips don't have headsign data
-            has_no_headsign = "Unknown" in directions
-            
-            if len(headsign_list) >= 2:
-                # Show side-by-side comparison when 2+ headsigns exist
-                h0, h1 = headsign_list[0], headsign_list[1]
-                arrivals_h0 = directions.get(h0, [])
-                arrivals_h1 = directions.get(h1, [])
-                
-                print(f"\n{h0}:".ljust(40) + f"{h1}:")
-                print("-" * 40 + "-" * 40)
-                
-                max_arrivals = max(len(arrivals_h0), len(arrivals_h1))
-                for i in range(max_arrivals):
-                    left = ""
-                    if i < len(arrivals_h0):
-                        local_time = arrivals_h0[i]["time"].astimezone(LOCAL_TZ)
-                        time_str = local_time.strftime("%I:%M %p")
-                        left = f"  {time_str}"
-                    
-                    right = ""
-                    if i < len(arrivals_h1):
-                        local_time = arrivals_h1[i]["time"].astimezone(LOCAL_TZ)
-                        time_str = local_time.strftime("%I:%M %p")
-                        right = f"  {time_str}"
-                    
-                    print(left.ljust(40) + right)
-                
-                print(f"\nTotal arrivals: {len(arrivals_h0)}".ljust(40) + f"Total arrivals: {len(arrivals_h1)}")
-            elif len(headsign_list) == 1:
-                # Only one headsign available
-                headsign = headsign_list[0]
-                headsign_arrivals = directions[headsign]
-                print(f"\nHeadsign: {headsign} ({len(headsign_arrivals)} arrivals)")
-                print("-" * 40)
-                
-                for arrival in headsign_arrivals[:10]:
-                    local_time = arrival["time"].astimezone(LOCAL_TZ)
-                    time_str = local_time.strftime("%I:%M %p")
-                    print(f"  {time_str} (trip: {arrival['trip_id']})")
-                
-                if len(headsign_arrivals) > 10:
-                    print(f"  ... and {len(headsign_arrivals) - 10} more")
-            else:
-                # No headsign data available
-                print(f"\nNo headsign data available for this route.")
-            
-            # Show warning about missing headsign data
-            if has_no_headsign and directions.get("Unknown"):
-                unknown_arrivals = directions["Unknown"]
-                print(f"\n⚠️  WARNING: {len(unknown_arrivals)} trips found WITHOUT headsign data:")
-                print("   Trip IDs without headsign data:")
-                for arrival in unknown_arrivals[:5]:
-                    print(f"     - {arrival['trip_id']} ({arrival['time'].astimezone(LOCAL_TZ).strftime('%I:%M %p')})")
-                if len(unknown_arrivals) > 5:
-                    print(f"     ... and {len(unknown_arrivals) - 5} more")
-        
-        # Summary for config
-        print("\n" + "=" * 80)
-        print("SUMMARY FOR CONFIG.TXT:")
-        print("=" * 80)
-        print("Note: The system now uses trip HEADSIGN (destination) to differentiate directions")
-        print("      since the GRT static GTFS doesn't use direction_id to separate opposite directions.\n")
-        
-        for route in sorted(routes.keys()):
-            route_arrivals = routes[route]
-            headsigns = {}
-            for arrival in route_arrivals:
-                headsign = arrival.get("headsign", "Unknown")
-                if headsign not in headsigns:
-                    headsigns[headsign] = 0
-                headsigns[headsign] += 1
-            
-            headsign_list = sorted([h for h in headsigns.keys() if h and h != "Unknown"])
-            
-            if route == DISPLAY1_ROUTE:
-                print(f"\nRoute {DISPLAY1_ROUTE} (DISPLAY1):")
-                if headsign_list:
-                    print(f"  Available destinations:")
-                    for h in headsign_list:
-                        print(f"    - {h} ({headsigns[h]} arrivals)")
-                    print(f"  Example: Set DISPLAY1_HEADSIGN = {headsign_list[0]}")
-                    if len(headsign_list) > 1:
-                        print(f"           or DISPLAY1_HEADSIGN = {headsign_list[1]}")
-                    print(f"  Leave blank to show all destinations")
-                else:
-                    print(f"  No headsign data available")
-            elif route == DISPLAY2_ROUTE:
-                print(f"\nRoute {DISPLAY2_ROUTE} (DISPLAY2):")
-                if headsign_list:
-                    print(f"  Available destinations:")
-                    for h in headsign_list:
-                        print(f"    - {h} ({headsigns[h]} arrivals)")
-                    print(f"  Example: Set DISPLAY2_HEADSIGN = {headsign_list[0]}")
-                    if len(headsign_list) > 1:
-                        print(f"           or DISPLAY2_HEADSIGN = {headsign_list[1]}")
-                    print(f"  Leave blank to show all destinations")
-                else:
-                    print(f"  No headsign data available")
-        
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching data from API: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error parsing feed: {e}")
-        import traceback
-        traceback.print_exc()
-        sys.exit(1)
+    setup_logging("bustime", "WARNING")
+    explorer = stop_explorer.open_explorer(offline="--offline" in sys.argv[1:])
+
+    for stop_id in dict.fromkeys(display.stop_id for display in bus.DISPLAYS):
+        stop_explorer.print_stop(explorer, stop_id)
+
+    print("\n" + "=" * 80)
+    print("SUMMARY FOR CONFIG.TXT:")
+    print("=" * 80)
+    print("Trips are told apart by HEADSIGN (destination), since the GRT static GTFS doesn't use")
+    print("direction_id to separate opposite directions.")
+
+    for display in bus.DISPLAYS:
+        # Scheduled trips per headsign of the display's route at its stop, across all service days
+        headsigns = Counter(trip.headsign for trip in explorer.static_data(display.stop_id).trips.values()
+                            if trip.route_id == display.route_id and trip.headsign)
+        prefix = f"DISPLAY{display.number}"
+        print(f"\nRoute {display.route_id} at stop {display.stop_id} ({prefix}):")
+        if not headsigns:
+            print("  No headsign data available")
+            continue
+        print("  Available destinations:")
+        for headsign, trips in sorted(headsigns.items()):
+            print(f"    - {headsign} ({trips} scheduled trips)")
+        example, *others = sorted(headsigns)
+        print(f"  Example: Set {prefix}_HEADSIGN = {example}")
+        if others:
+            print(f"           or {prefix}_HEADSIGN = {others[0]}")
+        print("  Leave blank to show all destinations")
 
 
 if __name__ == "__main__":